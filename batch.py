@@ -0,0 +1,233 @@
+"""
+Пакетная обработка документов без UI: тот же конвейер, что и в Streamlit-приложении (pipeline.py).
+
+Источник — локальная папка (файлы загружаются в S3 как через форму) или префикс S3 с уже загруженными
+документами (обрабатываются на месте). Для каждого документа в его папку upload_id_XXX/ пишется extraction-*.json.
+
+Данные заявителя (ФИО и тип документа) берутся:
+  1) из манифеста CSV (--manifest; колонки file, fio, doc_type; file — имя файла или ключ S3);
+  2) для S3 — из _client последнего extraction-*.json в папке документа;
+  3) из --fio / --doc-type по умолчанию.
+
+Для S3 доступна пересборка по сохранённым intermediate/ (--replay): textract — без повторного OCR
+(поля и печать заново через Bedrock, например после изменения промптов), checks — и без Bedrock
+(только проверки МИБ, например после изменения VALIDITY_DAYS или MIB_ERRORS).
+
+Примеры:
+    python batch.py ./archive --manifest archive.csv --workers 8
+    python batch.py s3://loan-deferment-idp-test-tlek/uploads/ --workers 16 --output-dir out/
+    python batch.py s3://loan-deferment-idp-test-tlek/uploads/ --replay checks --workers 32
+"""
+import argparse
+import csv
+import json
+import mimetypes
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.exceptions import ClientError
+
+import catalog
+import pipeline
+import ratelimit
+import tracing
+
+# Форматы, которые принимает форма загрузки
+DOCUMENT_EXTENSIONS = (".pdf", ".jpg", ".jpeg")
+
+
+def parse_s3_uri(uri: str) -> tuple[str, str]:
+    bucket, _, prefix = uri[len("s3://"):].partition("/")
+    return bucket, prefix
+
+
+def load_manifest(path: str | None) -> dict:
+    """{имя файла или ключ S3: {"fio", "doc_type"}} из CSV с колонками file, fio, doc_type."""
+    if not path:
+        return {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return {row["file"].strip(): {"fio": (row.get("fio") or "").strip() or None,
+                                      "doc_type": (row.get("doc_type") or "").strip() or None}
+                for row in csv.DictReader(f) if (row.get("file") or "").strip()}
+
+
+def content_type_for(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def list_local_documents(root: str) -> list[dict]:
+    docs = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in sorted(filenames):
+            if name.lower().endswith(DOCUMENT_EXTENSIONS):
+                docs.append({"source": "local", "path": os.path.join(dirpath, name), "name": name})
+    return docs
+
+
+def list_s3_documents(s3_client, bucket: str, prefix: str) -> list[dict]:
+    """
+    Документы под префиксом: всё, кроме превью, extraction-*.json и служебных объектов.
+    Для каждого документа запоминается последний extraction-*.json его папки (для _client).
+    """
+    objects = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(obj["Key"] for obj in page.get("Contents", []) or [])
+
+    latest_json = {}
+    for key in objects:
+        folder, _, name = key.rpartition("/")
+        if name.startswith("extraction-") and name.endswith(".json"):
+            if key > latest_json.get(folder, ""):
+                latest_json[folder] = key
+
+    docs = []
+    for key in sorted(objects):
+        folder, _, name = key.rpartition("/")
+        if "/previews/" in f"/{key}" or not name.lower().endswith(DOCUMENT_EXTENSIONS):
+            continue
+        docs.append({"source": "s3", "bucket": bucket, "key": key, "name": name, "last_json": latest_json.get(folder)})
+    return docs
+
+
+def client_info_from_s3(s3_client, bucket: str, json_key: str | None) -> dict:
+    if not json_key:
+        return {}
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=json_key)
+        client = json.loads(obj["Body"].read()).get("_client") or {}
+    except (ClientError, ValueError):
+        return {}
+    return {"fio": client.get("fio"), "doc_type": client.get("doc_type") or client.get("doc_type_value")}
+
+
+def process_one(doc: dict, args, manifest: dict) -> dict:
+    """Обрабатывает один документ; ошибки не прерывают пакет, а попадают в строку отчёта."""
+    s3 = pipeline.get_aws_client("s3", pipeline.AWS_PROFILE.strip() or None, pipeline.AWS_REGION)
+    t0 = time.perf_counter()
+    row = {"file": doc.get("path") or f"s3://{doc['bucket']}/{doc['key']}", "key": doc.get("key"),
+           "json_key": None, "verdict": None, "errors": [], "error": None}
+    trace = tracing.Trace()
+    preflight = None
+    client = {}
+    try:
+        if doc["source"] == "local":
+            bucket = args.bucket
+            with open(doc["path"], "rb") as f:
+                file_bytes = f.read()
+            client = manifest.get(doc["name"]) or manifest.get(doc["path"]) or {}
+            if pipeline.PREFLIGHT_ENABLED:
+                # Заведомо отклоняемый файл не загружается в S3 и не обрабатывается
+                with trace.span("preflight"):
+                    preflight = pipeline.preflight_document(file_bytes, doc["name"], content_type_for(doc["name"]))
+                if not preflight["ok"]:
+                    parsed = pipeline.preflight_rejection(preflight, client.get("fio") or args.fio,
+                                                          client.get("doc_type") or args.doc_type)
+                    row["verdict"] = parsed["_checks"]["verdict"]
+                    row["errors"] = [e.get("code") for e in parsed["_errors"]]
+                    row["preflight"] = [i["message"] for i in preflight["issues"]]
+                    catalog.record_extraction(bucket, None, None, parsed)
+                    row["seconds"] = round(time.perf_counter() - t0, 2)
+                    return row
+            with trace.span("upload"):
+                key = pipeline.upload_document(s3, file_bytes, doc["name"], content_type_for(doc["name"]),
+                                               bucket=bucket, key_prefix=args.key_prefix,
+                                               sha256=preflight["sha256"] if preflight else None)
+            row["key"] = key
+        else:
+            bucket, key = doc["bucket"], doc["key"]
+            with trace.span("download") as span:
+                file_bytes = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+                span.set(payload_bytes=len(file_bytes))
+            client = manifest.get(key) or manifest.get(doc["name"]) or client_info_from_s3(s3, bucket, doc.get("last_json"))
+
+        result = pipeline.process_document(
+            file_bytes,
+            key,
+            content_type_for(doc["name"]),
+            client.get("fio") or args.fio,
+            client.get("doc_type") or args.doc_type,
+            bucket=bucket,
+            llm_mode=args.llm_mode,
+            trace=trace,
+            preflight=preflight,
+            replay=args.replay,
+        )
+        parsed = result["parsed"]
+        row["json_key"] = result["json_key"]
+        row["verdict"] = (parsed.get("_checks") or {}).get("verdict")
+        row["errors"] = [e.get("code") for e in parsed.get("_errors") or []]
+        if args.output_dir:
+            out_name = row["key"].replace("/", "__") + "." + result["json_key"].rsplit("/", 1)[-1]
+            with open(os.path.join(args.output_dir, out_name), "wb") as f:
+                f.write(result["payload"])
+    except ClientError as e:
+        err = e.response.get("Error", {})
+        row["error"] = f"{err.get('Code', 'Unknown')} - {err.get('Message', str(e))}"
+    except Exception as e:
+        row["error"] = str(e)
+    if row["error"]:
+        catalog.record_failure(doc.get("bucket") or args.bucket, row["key"], row["error"],
+                               client.get("fio") or args.fio, client.get("doc_type") or args.doc_type)
+    row["seconds"] = round(time.perf_counter() - t0, 2)
+    return row
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Пакетная обработка документов (папка или s3://bucket/prefix)")
+    ap.add_argument("input", help="локальная папка или s3://bucket/prefix")
+    ap.add_argument("--workers", type=int, default=4, help="число документов в обработке одновременно")
+    ap.add_argument("--manifest", help="CSV с колонками file, fio, doc_type")
+    ap.add_argument("--fio", help="ФИО заявителя по умолчанию")
+    ap.add_argument("--doc-type", help="тип документа по умолчанию (метка из формы или Лист/Приказ/Справка)")
+    ap.add_argument("--bucket", default=pipeline.BUCKET_NAME, help="бакет для загрузки локальных файлов")
+    ap.add_argument("--key-prefix", default=pipeline.KEY_PREFIX, help="префикс для загрузки локальных файлов")
+    ap.add_argument("--llm-mode", choices=["split", "combined"], help="по умолчанию IDP_LLM_MODE")
+    ap.add_argument("--output-dir", help="дополнительно сохранить extraction-*.json локально")
+    ap.add_argument("--limit", type=int, help="обработать не более N документов")
+    ap.add_argument("--replay", choices=pipeline.REPLAY_MODES,
+                    help="только для s3://: пересборка по intermediate/ без Textract (checks — и без Bedrock)")
+    args = ap.parse_args(argv)
+    if args.replay and not args.input.startswith("s3://"):
+        ap.error("--replay применяется только к уже обработанным документам в S3 (s3://bucket/prefix)")
+
+    manifest = load_manifest(args.manifest)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    profile = pipeline.AWS_PROFILE.strip() or None
+    pipeline.warm_aws_clients(profile, pipeline.AWS_REGION, pipeline.BEDROCK_REGION, args.bucket)
+    if args.input.startswith("s3://"):
+        bucket, prefix = parse_s3_uri(args.input)
+        docs = list_s3_documents(pipeline.get_aws_client("s3", profile, pipeline.AWS_REGION), bucket, prefix)
+    else:
+        docs = list_local_documents(args.input)
+    if args.limit:
+        docs = docs[:args.limit]
+    print(f"Документов: {len(docs)}, потоков: {args.workers}", file=sys.stderr)
+
+    t0 = time.perf_counter()
+    rows = []
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="idp-batch") as executor:
+        futures = [executor.submit(process_one, doc, args, manifest) for doc in docs]
+        for fut in as_completed(futures):
+            row = fut.result()
+            rows.append(row)
+            status = row["error"] or f"{row['verdict']} {','.join(c for c in row['errors'] if c)}".strip()
+            print(f"[{len(rows)}/{len(docs)}] {row['file']} -> {status} ({row['seconds']} c)", file=sys.stderr)
+    # Превью загружаются в фоне — дожидаемся их до выхода
+    pipeline.wait_background_tasks()
+
+    elapsed = time.perf_counter() - t0
+    failed = [r for r in rows if r["error"]]
+    print(json.dumps(sorted(rows, key=lambda r: r["file"]), ensure_ascii=False, indent=2))
+    print("Лимиты AWS: " + json.dumps(ratelimit.rate_limit_metrics(), ensure_ascii=False), file=sys.stderr)
+    print(f"Готово: {len(rows) - len(failed)} успешно, {len(failed)} с ошибкой, {elapsed:.1f} c "
+          f"({len(rows) / elapsed if elapsed else 0:.2f} док/с)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,362 @@
+"""
+Локальные заглушки S3, Textract и Bedrock для офлайн-бенчмарков.
+
+Заглушки подключаются к настоящим клиентам boto3 через событие botocore before-send и подменяют только
+HTTP-ответ: сериализация запросов, общий ограничитель (ratelimit.py), повторы и трассировка работают как
+с живым AWS. Задержки задаются логнормальным распределением (медиана, sigma) на операцию, троттлинг —
+вероятностью ответа ThrottlingException на сервис или операцию.
+
+Textract отвечает записанными блоками (replay) — по SHA-256 байтов документа или имени объекта в S3;
+Bedrock — заготовленными ответами для детекции печати/QR и извлечения полей; usage ответа повторяет поля
+Anthropic, включая кэш промпта (cache_creation_input_tokens / cache_read_input_tokens по префиксу до cache_control).
+"""
+import base64
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from botocore.awsrequest import AWSResponse
+
+# (медиана, sigma) задержки в секундах; ключ — "сервис.Операция" или "сервис"
+DEFAULT_LATENCY = {
+    "s3": (0.03, 0.5),
+    "textract.AnalyzeDocument": (1.2, 0.35),
+    "textract.StartDocumentAnalysis": (0.15, 0.3),
+    "textract.GetDocumentAnalysis": (0.08, 0.3),
+    "textract.job": (4.0, 0.3),  # время выполнения асинхронной задачи Textract
+    "bedrock-runtime.InvokeModel": (2.5, 0.4),  # текстовый запрос
+    "bedrock-runtime.InvokeModel.image": (3.5, 0.4),  # запрос с изображениями
+    # Потоковый ответ: время до первого токена; остаток генерации — равномерно по дельтам
+    "bedrock-runtime.InvokeModelWithResponseStream": (0.8, 0.4),
+    "bedrock-runtime.InvokeModelWithResponseStream.image": (1.5, 0.4),
+}
+STREAM_CHARS_PER_DELTA = 12
+STREAM_SECONDS_PER_DELTA = 0.03
+# Текст, который модель дописывает после JSON (пояснения); при раннем обрыве потока не читается
+STREAM_TRAILER = "\n\nПояснение: значения полей взяты из текста документа и изображений страниц."
+
+# Кэш промпта Anthropic: минимальная длина кэшируемого префикса (Claude 3.7 Sonnet) и время жизни записи
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_TTL_SECONDS = 300
+
+DEFAULT_FIELDS = {
+    "ФИО заявителя": "Иванова Анна Петровна",
+    "Тип документа": "Справка",
+    "Наименование документа": "Справка о выходе в декретный отпуск по уходу за ребенком",
+    "Дата выдачи документа": None,  # подставляется «сегодня», чтобы проверка срока проходила
+    "Дата начала отпуска": "01/10/2026",
+    "Дата окончания отпуска": "01/04/2028",
+}
+DEFAULT_STAMP = {"stamp_present": True, "stamp_confidence": 92, "qr_present": False, "qr_confidence": 85}
+
+
+def synthetic_blocks(fio: str, pages: int = 1) -> dict:
+    """Блоки Textract, похожие на справку: строки текста и одна подпись на странице."""
+    lines = [
+        "СПРАВКА",
+        "о выходе в декретный отпуск по уходу за ребенком",
+        f"Выдана {fio}",
+        "в том, что она действительно находится в отпуске по уходу за ребенком",
+        f"Дата выдачи {time.strftime('%d.%m.%Y')}",
+        "Директор ____________",
+        "М.П.",
+    ]
+    blocks = []
+    for page in range(1, pages + 1):
+        blocks.append({"BlockType": "PAGE", "Page": page, "Id": uuid.uuid4().hex})
+        for i, text in enumerate(lines):
+            blocks.append({"BlockType": "LINE", "Text": text, "Confidence": 98.5 - i, "Page": page, "Id": uuid.uuid4().hex,
+                           "Geometry": {"BoundingBox": {"Left": 0.1, "Top": 0.1 + i * 0.05, "Width": 0.6, "Height": 0.03}}})
+        blocks.append({"BlockType": "SIGNATURE", "Confidence": 87.0, "Page": page, "Id": uuid.uuid4().hex,
+                       "Geometry": {"BoundingBox": {"Left": 0.5, "Top": 0.8, "Width": 0.2, "Height": 0.05}}})
+    return {"Blocks": blocks, "DocumentMetadata": {"Pages": pages}}
+
+
+class _Raw:
+    """Тело HTTP-ответа в том виде, в каком его читает botocore (stream / read)."""
+
+    def __init__(self, data: bytes):
+        self._buf = io.BytesIO(data)
+
+    def stream(self, **kwargs):
+        yield self._buf.read()
+
+    def read(self, amt=None):
+        return self._buf.read(amt)
+
+    def close(self):
+        pass
+
+
+class _RawStream(_Raw):
+    """Потоковое тело: кадры отдаются по одному с задержкой; close() прекращает выдачу (обрыв клиентом)."""
+
+    def __init__(self, frames: list[bytes], first_delay: float, delay: float, on_frame=None):
+        super().__init__(b"".join(frames))
+        self._frames = frames
+        self._first_delay = first_delay
+        self._delay = delay
+        self._on_frame = on_frame
+        self._closed = False
+
+    def stream(self, **kwargs):
+        for i, frame in enumerate(self._frames):
+            time.sleep(self._first_delay if i == 0 else self._delay)
+            if self._closed:
+                return
+            if self._on_frame is not None:
+                self._on_frame(len(frame))
+            yield frame
+
+    def close(self):
+        self._closed = True
+
+
+def eventstream_frame(payload: bytes, event_type: str = "chunk") -> bytes:
+    """Кадр application/vnd.amazon.eventstream: prelude, заголовки (строковые), payload, CRC32."""
+    headers = b""
+    for name, value in ((":event-type", event_type), (":content-type", "application/json"), (":message-type", "event")):
+        n, v = name.encode(), value.encode()
+        headers += struct.pack("!B", len(n)) + n + struct.pack("!BH", 7, len(v)) + v
+    total = 12 + len(headers) + len(payload) + 4
+    prelude = struct.pack("!II", total, len(headers))
+    prelude += struct.pack("!I", zlib.crc32(prelude))
+    message = prelude + headers + payload
+    return message + struct.pack("!I", zlib.crc32(message))
+
+
+class AwsStubs:
+    def __init__(self, latency: dict | None = None, throttle: dict | None = None, time_scale: float = 1.0,
+                 fields: dict | None = None, stamp: dict | None = None, seed: int | None = None,
+                 prompt_cache_min_tokens: int = PROMPT_CACHE_MIN_TOKENS):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.throttle = dict(throttle or {})
+        self.time_scale = time_scale
+        self.fields = dict(DEFAULT_FIELDS, **(fields or {}))
+        if not self.fields.get("Дата выдачи документа"):
+            self.fields["Дата выдачи документа"] = time.strftime("%d/%m/%Y")
+        self.stamp = dict(stamp or DEFAULT_STAMP)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.blocks = {}  # sha256 байтов или имя файла -> ответ Textract
+        self.jobs = {}  # JobId -> (готово в момент, ответ)
+        self.stats = {}  # сервис -> {"requests", "throttled", "bytes_out", "bytes_in", ...}
+        self.prompt_cache_min_tokens = prompt_cache_min_tokens
+        self.prompt_cache = {}  # хэш префикса промпта -> момент истечения (monotonic)
+
+    # --- Настройка ---
+    def add_document(self, name: str, data: bytes, blocks: dict):
+        """Записанный ответ Textract для документа (по байтам и по имени объекта)."""
+        self.blocks[hashlib.sha256(data).hexdigest()] = blocks
+        self.blocks[os.path.basename(name)] = blocks
+
+    def install(self, client):
+        service = client.meta.service_model.service_id.hyphenize()
+        client.meta.events.register(f"before-send.{service}", self._before_send, unique_id=f"idp-stub-{service}")
+        return client
+
+    # --- Вспомогательное ---
+    def _sleep(self, key: str):
+        median, sigma = self.latency.get(key) or self.latency.get(key.split(".")[0]) or (0.0, 0.0)
+        if median > 0:
+            with self.lock:
+                delay = median * math.exp(self.rng.gauss(0, sigma))
+            time.sleep(delay * self.time_scale)
+
+    def _throttled(self, service: str, op: str) -> bool:
+        p = self.throttle.get(f"{service}.{op}", self.throttle.get(service, 0.0))
+        with self.lock:
+            return p > 0 and self.rng.random() < p
+
+    def _count(self, service: str, **deltas):
+        with self.lock:
+            st = self.stats.setdefault(service, {"requests": 0, "throttled": 0, "bytes_out": 0, "bytes_in": 0})
+            for k, v in deltas.items():
+                st[k] = st.get(k, 0) + v
+
+    @staticmethod
+    def _response(request, status: int, body: bytes, headers: dict | None = None) -> AWSResponse:
+        hdrs = {"content-length": str(len(body))}
+        hdrs.update(headers or {})
+        return AWSResponse(request.url, status, hdrs, _Raw(body))
+
+    @staticmethod
+    def _request_body(request) -> bytes:
+        body = request.body
+        if isinstance(body, str):
+            return body.encode("utf-8")
+        return body if isinstance(body, (bytes, bytearray)) else b""
+
+    # --- Обработчик before-send ---
+    def _before_send(self, request, event_name: str, **kwargs):
+        _, service, op = event_name.split(".", 2)
+        # Тело S3 PutObject передаётся чанками с контрольной суммой: исходный размер — в X-Amz-Decoded-Content-Length
+        out = int(request.headers.get("X-Amz-Decoded-Content-Length") or request.headers.get("Content-Length")
+                  or len(self._request_body(request)))
+        self._count(service, requests=1, bytes_out=out)
+        if self._throttled(service, op):
+            self._count(service, throttled=1)
+            self._sleep(f"{service}.{op}.throttle")
+            return self._throttle_response(request, service)
+        handler = getattr(self, f"_{service.replace('-', '_')}_{op}", None)
+        if handler is None:
+            self._sleep(f"{service}.{op}")
+            resp = self._response(request, 200, b"")
+        else:
+            resp = handler(request)
+        self._count(service, bytes_in=int(resp.headers.get("content-length") or 0))
+        return resp
+
+    def _throttle_response(self, request, service: str) -> AWSResponse:
+        if service == "s3":
+            body = b"<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>"
+            return self._response(request, 503, body)
+        body = json.dumps({"__type": "ThrottlingException", "message": "Rate exceeded"}).encode()
+        return self._response(request, 429 if service == "bedrock-runtime" else 400, body,
+                              {"x-amzn-ErrorType": "ThrottlingException", "content-type": "application/x-amz-json-1.1"})
+
+    # --- S3 ---
+    def _s3_PutObject(self, request):
+        self._sleep("s3.PutObject")
+        return self._response(request, 200, b"", {"ETag": f'"{uuid.uuid4().hex}"'})
+
+    def _s3_CopyObject(self, request):
+        self._sleep("s3.CopyObject")
+        body = f"<CopyObjectResult><ETag>\"{uuid.uuid4().hex}\"</ETag></CopyObjectResult>".encode()
+        return self._response(request, 200, body)
+
+    def _s3_CreateMultipartUpload(self, request):
+        self._sleep("s3.CreateMultipartUpload")
+        body = (f"<InitiateMultipartUploadResult><UploadId>{uuid.uuid4().hex}</UploadId>"
+                "</InitiateMultipartUploadResult>").encode()
+        return self._response(request, 200, body)
+
+    def _s3_UploadPart(self, request):
+        self._sleep("s3.UploadPart")
+        return self._response(request, 200, b"", {"ETag": f'"{uuid.uuid4().hex}"'})
+
+    def _s3_CompleteMultipartUpload(self, request):
+        self._sleep("s3.CompleteMultipartUpload")
+        body = f"<CompleteMultipartUploadResult><ETag>\"{uuid.uuid4().hex}-1\"</ETag></CompleteMultipartUploadResult>".encode()
+        return self._response(request, 200, body)
+
+    def _s3_GetObject(self, request):
+        self._sleep("s3.GetObject")
+        body = b"<Error><Code>NoSuchKey</Code><Message>The specified key does not exist.</Message></Error>"
+        return self._response(request, 404, body)
+
+    # --- Textract ---
+    def _blocks_for(self, params: dict) -> dict:
+        doc = params.get("Document") or params.get("DocumentLocation") or {}
+        if doc.get("Bytes"):
+            found = self.blocks.get(hashlib.sha256(base64.b64decode(doc["Bytes"])).hexdigest())
+        else:
+            found = self.blocks.get(os.path.basename((doc.get("S3Object") or {}).get("Name", "")))
+        return found or synthetic_blocks(self.fields["ФИО заявителя"])
+
+    def _textract_AnalyzeDocument(self, request):
+        self._sleep("textract.AnalyzeDocument")
+        return self._response(request, 200, json.dumps(self._blocks_for(json.loads(self._request_body(request)))).encode())
+
+    def _textract_StartDocumentAnalysis(self, request):
+        self._sleep("textract.StartDocumentAnalysis")
+        job_id = uuid.uuid4().hex
+        median, sigma = self.latency["textract.job"]
+        with self.lock:
+            ready_at = time.monotonic() + median * math.exp(self.rng.gauss(0, sigma)) * self.time_scale
+            self.jobs[job_id] = (ready_at, self._blocks_for(json.loads(self._request_body(request))))
+        return self._response(request, 200, json.dumps({"JobId": job_id}).encode())
+
+    def _textract_GetDocumentAnalysis(self, request):
+        self._sleep("textract.GetDocumentAnalysis")
+        params = json.loads(self._request_body(request))
+        ready_at, blocks = self.jobs[params["JobId"]]
+        if time.monotonic() < ready_at:
+            body = {"JobStatus": "IN_PROGRESS"}
+        else:
+            body = dict(blocks, JobStatus="SUCCEEDED")
+        return self._response(request, 200, json.dumps(body).encode())
+
+    # --- Bedrock ---
+    def _answer(self, payload: dict) -> tuple[str, bool]:
+        content = (payload.get("messages") or [{}])[0].get("content") or []
+        has_image = any(c.get("type") == "image" for c in content)
+        text = json.dumps(payload.get("system", ""), ensure_ascii=False) + json.dumps(content, ensure_ascii=False)
+        if has_image and "ФИО заявителя" in text:
+            answer = dict(self.fields, **self.stamp)
+        elif has_image:
+            answer = self.stamp
+        else:
+            answer = self.fields
+        return json.dumps(answer, ensure_ascii=False), has_image
+
+    @staticmethod
+    def _tokens(blocks: list) -> int:
+        """Грубая оценка токенов: ~3 символа JSON блоков (без экранирования кириллицы) на токен."""
+        return len(json.dumps(blocks, ensure_ascii=False)) // 3 if blocks else 0
+
+    def _usage(self, payload: dict, answer: str) -> dict:
+        """
+        usage ответа Anthropic. Префикс запроса (system, затем content сообщений) до последнего блока с cache_control
+        не короче prompt_cache_min_tokens записывается в кэш на PROMPT_CACHE_TTL_SECONDS, повторный — читается из него.
+        """
+        system = payload.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        blocks = list(system) + [c for m in payload.get("messages") or [] for c in m.get("content") or []]
+        end = max((i + 1 for i, b in enumerate(blocks) if isinstance(b, dict) and b.get("cache_control")), default=0)
+        usage = {"input_tokens": self._tokens(blocks), "output_tokens": max(1, len(answer) // 3),
+                 "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        prefix = self._tokens(blocks[:end])
+        if end and prefix >= self.prompt_cache_min_tokens:
+            key = hashlib.sha256(json.dumps(blocks[:end], sort_keys=True).encode("utf-8")).hexdigest()
+            now = time.monotonic()
+            with self.lock:
+                hit = self.prompt_cache.get(key, 0) > now
+                self.prompt_cache[key] = now + PROMPT_CACHE_TTL_SECONDS
+            usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = prefix
+            usage["input_tokens"] -= prefix
+        return usage
+
+    def _bedrock_runtime_InvokeModel(self, request):
+        payload = json.loads(self._request_body(request))
+        answer, has_image = self._answer(payload)
+        self._sleep("bedrock-runtime.InvokeModel.image" if has_image else "bedrock-runtime.InvokeModel")
+        body = {"content": [{"type": "text", "text": answer}], "stop_reason": "end_turn",
+                "usage": self._usage(payload, answer)}
+        return self._response(request, 200, json.dumps(body, ensure_ascii=False).encode("utf-8"),
+                              {"content-type": "application/json"})
+
+    def _bedrock_runtime_InvokeModelWithResponseStream(self, request):
+        payload = json.loads(self._request_body(request))
+        answer, has_image = self._answer(payload)
+        usage = self._usage(payload, answer)
+        key = "bedrock-runtime.InvokeModelWithResponseStream"
+        median, sigma = self.latency.get(key + (".image" if has_image else "")) or self.latency[key]
+        with self.lock:
+            first_delay = median * math.exp(self.rng.gauss(0, sigma)) * self.time_scale
+
+        def chunk(event: dict) -> bytes:
+            data = json.dumps(event, ensure_ascii=False).encode("utf-8")
+            return eventstream_frame(json.dumps({"bytes": base64.b64encode(data).decode()}).encode())
+
+        text = answer + STREAM_TRAILER
+        frames = [chunk({"type": "message_start", "message": {"role": "assistant",
+                                                                "usage": dict(usage, output_tokens=1)}})]
+        frames += [chunk({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text[i:i + STREAM_CHARS_PER_DELTA]}})
+                   for i in range(0, len(text), STREAM_CHARS_PER_DELTA)]
+        frames.append(chunk({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                             "usage": {"output_tokens": max(1, len(text) // 3)}}))
+        frames.append(chunk({"type": "message_stop"}))
+        # Длина тела заранее неизвестна клиенту: байты ответа считаются по мере чтения кадров
+        body = _RawStream(frames, first_delay, STREAM_SECONDS_PER_DELTA * self.time_scale,
+                          on_frame=lambda n: self._count("bedrock-runtime", bytes_in=n, stream_frames=1))
+        return AWSResponse(request.url, 200, {"content-type": "application/vnd.amazon.eventstream"}, body)
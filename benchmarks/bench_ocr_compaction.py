@@ -0,0 +1,194 @@
+"""
+Бенчмарк подготовки OCR-текста для запроса полей: обрезка [:15000] против сжатия по строкам (ocrtext.py).
+
+Синтетические ответы Textract с известными значениями полей (короткая справка, шумный скан с таблицей и
+мусорными строками низкой уверенности, длинный многостраничный приказ с датой в конце, колонтитулы на каждой
+странице) и, с --textract-replay, записанные ответы Textract. Для каждого варианта — размер текста в символах
+и токенах (оценка), время подготовки и полнота: сколько известных значений полей осталось в тексте.
+С --live оба текста отправляются в Bedrock: фактические input_tokens, задержка и совпадение извлечённых полей.
+
+Примеры:
+    python benchmarks/bench_ocr_compaction.py
+    python benchmarks/bench_ocr_compaction.py --token-budget 2000 3000 4000
+    python benchmarks/bench_ocr_compaction.py --textract-replay recorded/ --live
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ocrtext  # noqa: E402
+import pipeline  # noqa: E402
+
+FIO = "Сейтова Айгуль Маратовна"
+ISSUE_DATE = "14.09.2026"
+WORDS = ("в соответствии с трудовым кодексом республики казахстан положением о порядке предоставления "
+         "работодатель обязуется обеспечить сохранение места работы заработной платы социальных выплат "
+         "на основании заявления и медицинского заключения согласно внутренним правилам организации").split()
+GARBAGE = "~#@%^&*{}<>ЖЪЫьъ0OoIl1|/\\"
+
+
+def line_block(text: str, page: int, top: float, conf: float) -> dict:
+    return {"BlockType": "LINE", "Text": text, "Confidence": conf, "Page": page, "Id": uuid.uuid4().hex,
+            "Geometry": {"BoundingBox": {"Left": 0.1, "Top": top, "Width": 0.8, "Height": 0.02}}}
+
+
+def filler(rng: random.Random, words: int = 11) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_doc(pages: list[list[tuple[str, float]]]) -> dict:
+    blocks = []
+    for p, lines in enumerate(pages, 1):
+        blocks.append({"BlockType": "PAGE", "Page": p, "Id": uuid.uuid4().hex})
+        blocks.extend(line_block(text, p, 0.05 + i * 0.9 / max(1, len(lines)), conf) for i, (text, conf) in enumerate(lines))
+    return {"Blocks": blocks, "DocumentMetadata": {"Pages": len(pages)}}
+
+
+def synthetic_documents(rng: random.Random) -> list[dict]:
+    """[{"name", "tex_resp", "fields": {поле: значение, которое должно остаться в тексте}}]."""
+    fields = {"ФИО заявителя": FIO, "Дата выдачи документа": ISSUE_DATE}
+    docs = []
+
+    short = [("СПРАВКА", 99.0), ("о выходе в декретный отпуск по уходу за ребенком", 98.0), (f"Выдана {FIO}", 97.5),
+             ("в том, что она действительно находится в отпуске по уходу за ребенком", 97.0),
+             (f"Дата выдачи {ISSUE_DATE}", 96.0), ("Директор ____________", 90.0), ("М.П.", 80.0)]
+    docs.append({"name": "справка (коротко)", "tex_resp": make_doc([short]), "fields": dict(fields, **{"Тип документа": "СПРАВКА"})})
+
+    noisy = [("СПРАВКА", 95.0), ("о выходе в декретный отпуск по уходу за ребенком", 93.0)]
+    for i in range(60):
+        noisy.append(("".join(rng.choice(GARBAGE) for _ in range(rng.randint(8, 40))), rng.uniform(10, 45)))
+        noisy.append((f"| {i + 1} | {filler(rng, 3)} | ______ | {rng.randint(100, 999)} |", rng.uniform(60, 90)))
+        if i == 30:
+            noisy.append((f"Ф.И.О.: {FIO}", 88.0))
+        if i == 55:
+            noisy.append((f"Дата выдачи: {ISSUE_DATE}", 42.0))  # подпись и дата — плохо распознанный низ страницы
+    docs.append({"name": "шумный скан", "tex_resp": make_doc([noisy]), "fields": dict(fields, **{"Тип документа": "СПРАВКА"})})
+
+    pages = []
+    for p in range(6):
+        lines = [("ТОО «Северный ветер» БИН 123456789012", 97.0), ("г. Алматы, ул. Абая 1, тел. 8 727 000 00 00", 96.0)]
+        if p == 0:
+            lines += [("ПРИКАЗ № 45-к", 98.0), ("о выходе в декретный отпуск по уходу за ребенком", 97.5),
+                      (f"Работник: {FIO}", 97.0)]
+        lines += [(filler(rng), rng.uniform(85, 99)) for _ in range(40)]
+        if p == 5:
+            lines += [(f"Дата приказа {ISSUE_DATE}", 96.0), ("Директор ____________ /Ахметов Б.К./", 90.0)]
+        lines.append((f"Страница {p + 1} из 6", 99.0))
+        pages.append(lines)
+    docs.append({"name": "длинный приказ", "tex_resp": make_doc(pages), "fields": dict(fields, **{"Тип документа": "ПРИКАЗ"})})
+    return docs
+
+
+def replay_documents(replay_dir: str) -> list[dict]:
+    docs = []
+    for name in sorted(os.listdir(replay_dir)):
+        if not name.endswith((".json", ".json.gz")):
+            continue
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(os.path.join(replay_dir, name), "rt", encoding="utf-8") as f:
+            docs.append({"name": name, "tex_resp": json.load(f), "fields": {}})
+    return docs
+
+
+def timed(fn, repeat: int) -> tuple[str, float]:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        text = fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return text, statistics.median(times)
+
+
+def invoke_fields(client, model_id: str, text: str) -> dict:
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1024,
+        "temperature": 0,
+        "system": pipeline.system_prompt(pipeline.EXTRACTION_INSTRUCTION),
+        "messages": [{"role": "user", "content": [{"type": "text", "text": pipeline.OCR_TEXT_HEADER + text}]}],
+    }
+    t0 = time.perf_counter()
+    resp = client.invoke_model(modelId=model_id, contentType="application/json", accept="application/json", body=json.dumps(body))
+    data = json.loads(resp["body"].read())
+    return {"latency_s": time.perf_counter() - t0, "input_tokens": (data.get("usage") or {}).get("input_tokens"),
+            "fields": pipeline.parse_json_relaxed(data.get("content", [{}])[0].get("text", "")) or {}}
+
+
+def field_matches(extracted: dict, expected: dict) -> int:
+    n = 0
+    for key, value in expected.items():
+        got = extracted.get(key)
+        if key == "ФИО заявителя":
+            n += pipeline.norm_name(got) == pipeline.norm_name(value)
+        elif key == "Дата выдачи документа":
+            n += pipeline.parse_date_safe(got) == pipeline.parse_date_safe(value)
+        else:
+            n += str(got or "").casefold() == value.casefold()
+    return n
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="OCR-текст для запроса полей: обрезка [:15000] против сжатия по строкам")
+    ap.add_argument("--token-budget", type=int, nargs="+", default=[ocrtext.OCR_TOKEN_BUDGET])
+    ap.add_argument("--min-confidence", type=float, default=ocrtext.OCR_MIN_CONFIDENCE)
+    ap.add_argument("--textract-replay", help="папка с записанными ответами Textract (*.json[.gz])")
+    ap.add_argument("--repeat", type=int, default=20, help="повторов для времени подготовки (медиана)")
+    ap.add_argument("--live", action="store_true", help="вызвать Bedrock и сравнить извлечённые поля (платно)")
+    ap.add_argument("--model-id", default=os.getenv("BEDROCK_INFERENCE_PROFILE", "us.anthropic.claude-3-7-sonnet-20250219-v1:0"))
+    ap.add_argument("--region", default=os.getenv("BEDROCK_REGION", "us-east-1"))
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", dest="json_out", help="сохранить результаты в JSON")
+    args = ap.parse_args(argv)
+
+    client = None
+    if args.live:
+        import boto3
+        client = boto3.client("bedrock-runtime", region_name=args.region)
+
+    docs = synthetic_documents(random.Random(args.seed))
+    if args.textract_replay:
+        docs += replay_documents(args.textract_replay)
+
+    rows = []
+    for doc in docs:
+        tex = doc["tex_resp"]
+        variants = [("обрезка [:15000]", lambda: pipeline.textract_blocks_to_text(tex)[:ocrtext.OCR_LEGACY_MAX_CHARS])]
+        for budget in args.token_budget:
+            variants.append((f"сжатие {budget} ток.", lambda b=budget: ocrtext.compact_ocr_text(
+                tex, token_budget=b, min_confidence=args.min_confidence)["text"]))
+        for label, fn in variants:
+            text, ms = timed(fn, args.repeat)
+            found = sum(value.casefold() in text.casefold() for value in doc["fields"].values())
+            row = {"document": doc["name"], "variant": label, "chars": len(text), "est_tokens": ocrtext.estimate_text_tokens(text),
+                   "prep_ms": round(ms, 2), "fields_in_text": f"{found}/{len(doc['fields'])}" if doc["fields"] else "—", "live": None}
+            if client:
+                live = invoke_fields(client, args.model_id, text)
+                live["fields_ok"] = f"{field_matches(live['fields'], doc['fields'])}/{len(doc['fields'])}" if doc["fields"] else "—"
+                row["live"] = live
+            rows.append(row)
+
+    header = f"{'документ':<22} {'вариант':<20} {'символов':>9} {'токены≈':>8} {'мс':>7} {'поля в тексте':>13}"
+    if client:
+        header += f" {'input_tokens':>12} {'сек':>6} {'поля LLM':>8}"
+    print(header)
+    for r in rows:
+        line = (f"{r['document'][:22]:<22} {r['variant']:<20} {r['chars']:>9} {r['est_tokens']:>8} {r['prep_ms']:>7.2f}"
+                f" {r['fields_in_text']:>13}")
+        if r["live"]:
+            line += f" {str(r['live']['input_tokens']):>12} {r['live']['latency_s']:>6.2f} {r['live']['fields_ok']:>8}"
+        print(line)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Офлайн-бенчмарк конвейера обработки документа без живого AWS.
+
+Прогоняет upload_document + process_document (pipeline.py) по корпусу документов с заглушками S3, Textract
+и Bedrock (benchmarks/aws_stubs.py): задержки — логнормальные, троттлинг — с заданной вероятностью. Общий
+ограничитель запросов, повторы, рендер превью, поиск QR и подготовка изображений работают по-настоящему.
+
+Отчёт: пропускная способность, перцентили длительности по стадиям (из _timings), пиковая память,
+байты по сервисам, троттлинг, вызовы AWS и повторы по стадиям, токены Bedrock (в том числе запись и чтение кэша промпта). --json сохраняет отчёт, --compare сравнивает с сохранённым.
+
+Примеры:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py test-local-v2.pdf --docs 40 --concurrency 8 --time-scale 0.2
+    python benchmarks/bench_pipeline.py --throttle bedrock-runtime=0.1 --latency bedrock-runtime.InvokeModel=4:0.5
+    python benchmarks/bench_pipeline.py --json after.json --compare before.json
+    python benchmarks/bench_pipeline.py --streaming --compare before.json
+    python benchmarks/bench_pipeline.py --prompt-cache --prompt-cache-min-tokens 0 --json cached.json
+"""
+import argparse
+import gzip
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Окружение до импорта pipeline: без общего состояния в S3, без кэша результатов, фиктивные учётные данные,
+# каталог результатов — во временной папке (строки прогонов не попадают в .catalog.sqlite3 рабочей копии)
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("UPLOAD_ID_BACKEND", "ulid")
+os.environ.setdefault("IDP_RESULT_CACHE", "0")
+os.environ.setdefault("IDP_CATALOG_PATH", os.path.join(tempfile.mkdtemp(prefix="idp-bench-"), "catalog.sqlite3"))
+
+import fitz  # noqa: E402
+
+import pipeline  # noqa: E402
+import ratelimit  # noqa: E402
+import tracing  # noqa: E402
+import vision  # noqa: E402
+from aws_stubs import PROMPT_CACHE_MIN_TOKENS, AwsStubs, synthetic_blocks  # noqa: E402
+
+TOKEN_KEYS = ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens",
+              "prompt_cache_writes", "prompt_cache_hits")
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def synthetic_variants(name: str, data: bytes) -> list[dict]:
+    """
+    Варианты PDF: JPEG-скан первой страницы, двухстраничный PDF (асинхронный Textract), скан 300 dpi.
+    Двухстраничный PDF предварительная проверка отклоняет (ошибка МИБ 04) — у него multipage=True, и run_one
+    пропускает отказ, чтобы вариант доходил до StartDocumentAnalysis и опроса (стадия textract_poll).
+    """
+    stem = os.path.splitext(os.path.basename(name))[0]
+    out = []
+    with fitz.open(stream=data, filetype="pdf") as src:
+        page = src.load_page(0)
+        jpeg = page.get_pixmap(dpi=150, colorspace=fitz.csRGB, alpha=False).tobytes("jpeg", jpg_quality=85)
+        out.append({"name": f"{stem}-scan.jpg", "bytes": jpeg, "content_type": "image/jpeg"})
+
+        two = fitz.open()
+        two.insert_pdf(src, from_page=0, to_page=0)
+        two.insert_pdf(src, from_page=0, to_page=0)
+        out.append({"name": f"{stem}-2pages.pdf", "bytes": two.tobytes(), "content_type": "application/pdf", "multipage": True})
+        two.close()
+
+        hi = fitz.open()
+        pix = page.get_pixmap(dpi=300, colorspace=fitz.csRGB, alpha=False)
+        hi_page = hi.new_page(width=page.rect.width, height=page.rect.height)
+        hi_page.insert_image(hi_page.rect, stream=pix.tobytes("jpeg", jpg_quality=90))
+        out.append({"name": f"{stem}-300dpi.pdf", "bytes": hi.tobytes(), "content_type": "application/pdf"})
+        hi.close()
+    return out
+
+
+def load_corpus(files: list[str], synthetic: bool) -> list[dict]:
+    corpus = []
+    for path in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        is_pdf = path.lower().endswith(".pdf")
+        corpus.append({"name": os.path.basename(path), "bytes": data, "content_type": "application/pdf" if is_pdf else "image/jpeg"})
+        if synthetic and is_pdf:
+            corpus.extend(synthetic_variants(path, data))
+    return corpus
+
+
+def load_replay(replay_dir: str | None, name: str) -> dict | None:
+    """Записанный ответ Textract: <replay_dir>/<имя>.json или .json.gz ({"Blocks": [...]})."""
+    if not replay_dir:
+        return None
+    for candidate in (f"{name}.json", f"{name}.json.gz", f"{os.path.splitext(name)[0]}.json", f"{os.path.splitext(name)[0]}.json.gz"):
+        path = os.path.join(replay_dir, candidate)
+        if os.path.exists(path):
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+    return None
+
+
+def parse_pairs(items: list[str], kind=float) -> dict:
+    """["bedrock-runtime=0.1", "textract.AnalyzeDocument=1.5:0.3"] -> {ключ: значение}."""
+    out = {}
+    for item in items or []:
+        key, _, value = item.partition("=")
+        out[key] = tuple(kind(v) for v in value.split(":")) if ":" in value else kind(value)
+    return out
+
+
+def run_one(doc: dict, fio: str, doc_type: str, llm_mode: str | None) -> dict:
+    s3 = pipeline.get_aws_client("s3", None, pipeline.AWS_REGION)
+    trace = tracing.Trace()
+    t0 = time.perf_counter()
+    try:
+        preflight = None
+        if pipeline.PREFLIGHT_ENABLED:
+            with trace.span("preflight"):
+                preflight = pipeline.preflight_document(doc["bytes"], doc["name"], doc["content_type"])
+            if doc.get("multipage"):
+                preflight = dict(preflight, ok=True, issues=[])
+        with trace.span("upload"):
+            key = pipeline.upload_document(s3, doc["bytes"], doc["name"], doc["content_type"],
+                                           sha256=preflight["sha256"] if preflight else None)
+        result = pipeline.process_document(doc["bytes"], key, doc["content_type"], fio, doc_type,
+                                           llm_mode=llm_mode, trace=trace, preflight=preflight)
+        parsed = result["parsed"]
+        return {"name": doc["name"], "seconds": time.perf_counter() - t0, "timings": parsed.get("_timings") or {},
+                "verdict": (parsed.get("_checks") or {}).get("verdict"), "error": None}
+    except Exception as e:
+        return {"name": doc["name"], "seconds": time.perf_counter() - t0, "timings": trace.timings(), "verdict": None, "error": str(e)}
+
+
+def build_report(rows: list[dict], wall: float, stubs: AwsStubs, peak_bytes: int) -> dict:
+    stage_ms = {}
+    for r in rows:
+        for name, st in (r["timings"].get("stages") or {}).items():
+            stage_ms.setdefault(name, []).append(st.get("duration_ms") or 0.0)
+            # Потоковый режим Bedrock: время до первого разобранного поля ответа
+            if st.get("stream_first_field_ms"):
+                stage_ms.setdefault(f"{name}:1st_field", []).append(st["stream_first_field_ms"])
+    # Токены Bedrock по всем стадиям: входные без кэша, запись и чтение кэша промпта, выходные
+    tokens = {}
+    for r in rows:
+        for st in (r["timings"].get("stages") or {}).values():
+            for k in TOKEN_KEYS:
+                tokens[k] = tokens.get(k, 0) + (st.get(k) or 0)
+    # Вызовы AWS и повторы по стадиям (из спанов, в том числе из рабочих потоков s3transfer)
+    aws_stages = {}
+    for r in rows:
+        for name, st in (r["timings"].get("stages") or {}).items():
+            if "aws_calls" in st or "aws_requests" in st:
+                agg = aws_stages.setdefault(name, {"calls": 0, "retries": 0})
+                agg["calls"] += st.get("aws_calls", 0)
+                agg["retries"] += st.get("retries", 0)
+    doc_ms = [r["seconds"] * 1000 for r in rows if not r["error"]]
+    stages = {name: {"n": len(v), "p50": percentile(v, 50), "p95": percentile(v, 95), "p99": percentile(v, 99), "max": max(v)}
+              for name, v in stage_ms.items()}
+    stages["document"] = {"n": len(doc_ms), "p50": percentile(doc_ms, 50), "p95": percentile(doc_ms, 95),
+                          "p99": percentile(doc_ms, 99), "max": max(doc_ms) if doc_ms else None}
+    return {
+        "documents": len(rows),
+        "errors": sum(1 for r in rows if r["error"]),
+        "error_samples": sorted({r["error"] for r in rows if r["error"]})[:5],
+        "wall_seconds": round(wall, 3),
+        "throughput_docs_per_s": round(len(rows) / wall, 3) if wall else None,
+        "stages_ms": stages,
+        "peak_python_mb": round(peak_bytes / 2**20, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "bedrock_tokens": tokens,
+        "aws": stubs.stats,
+        "aws_stages": aws_stages,
+        # Успешные загрузки, вызовы которых не попали в спан s3_upload: повторы загрузки были бы не видны
+        "untraced_uploads": sum(1 for r in rows if not r["error"]
+                                and not ((r["timings"].get("stages") or {}).get("s3_upload") or {}).get("aws_calls")),
+        "rate_limits": ratelimit.rate_limit_metrics(),
+        "verdicts": {v: sum(1 for r in rows if r["verdict"] == v) for v in sorted({str(r["verdict"]) for r in rows})},
+    }
+
+
+def print_report(report: dict, baseline: dict | None = None):
+    def delta(cur, old):
+        if not baseline or cur is None or not old:
+            return ""
+        return f" ({(cur - old) / old * 100:+.0f}%)"
+
+    base_stages = (baseline or {}).get("stages_ms", {})
+    print(f"Документов: {report['documents']}, ошибок: {report['errors']}, {report['wall_seconds']} c, "
+          f"{report['throughput_docs_per_s']} док/с{delta(report['throughput_docs_per_s'], (baseline or {}).get('throughput_docs_per_s'))}")
+    print(f"Пиковая память Python: {report['peak_python_mb']} МБ, max RSS: {report['max_rss_mb']} МБ")
+    print(f"\n{'стадия':<18} {'n':>4} {'p50 мс':>10} {'p95 мс':>10} {'p99 мс':>10} {'max мс':>10}")
+    for name, st in report["stages_ms"].items():
+        old = base_stages.get(name, {})
+        print(f"{name:<18} {st['n']:>4} {st['p50'] or 0:>10.1f} {st['p95'] or 0:>10.1f} {st['p99'] or 0:>10.1f} {st['max'] or 0:>10.1f}"
+              f"{delta(st['p50'], old.get('p50'))}{delta(st['p95'], old.get('p95'))}")
+    tokens = report.get("bedrock_tokens") or {}
+    print("\nТокены Bedrock: " + ", ".join(f"{k} {tokens.get(k, 0)}" for k in TOKEN_KEYS))
+    print(f"\n{'сервис':<18} {'запросов':>9} {'троттлинг':>10} {'отправлено':>12} {'получено':>12}")
+    for service, st in sorted(report["aws"].items()):
+        print(f"{service:<18} {st['requests']:>9} {st['throttled']:>10} {st['bytes_out']:>12} {st['bytes_in']:>12}")
+    print(f"\n{'стадия':<18} {'вызовов AWS':>12} {'повторов':>9}")
+    for name, st in sorted(report["aws_stages"].items()):
+        print(f"{name:<18} {st['calls']:>12} {st['retries']:>9}")
+    for sample in report["error_samples"]:
+        print(f"Ошибка: {sample}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера с заглушками S3/Textract/Bedrock")
+    ap.add_argument("files", nargs="*", default=[os.path.join(ROOT, "test-local-v2.pdf")], help="документы корпуса (PDF/JPEG)")
+    ap.add_argument("--no-synthetic", action="store_true", help="без синтетических вариантов PDF")
+    ap.add_argument("--docs", type=int, help="сколько документов обработать (корпус повторяется по кругу)")
+    ap.add_argument("--concurrency", type=int, default=4, help="документов одновременно")
+    ap.add_argument("--time-scale", type=float, default=1.0, help="множитель задержек заглушек (0.1 — в 10 раз быстрее)")
+    ap.add_argument("--latency", nargs="*", help="задержки: операция=медиана[:sigma], например textract.AnalyzeDocument=1.5:0.3")
+    ap.add_argument("--throttle", nargs="*", help="вероятность троттлинга: сервис[.Операция]=p, например bedrock-runtime=0.1")
+    ap.add_argument("--textract-replay", help="папка с записанными ответами Textract (<имя документа>.json[.gz])")
+    ap.add_argument("--llm-mode", choices=["split", "combined"])
+    ap.add_argument("--streaming", action="store_true", help="потоковые ответы Bedrock (IDP_BEDROCK_STREAMING=1)")
+    ap.add_argument("--prompt-cache", action="store_true", help="инструкции в system с cache_control (IDP_BEDROCK_PROMPT_CACHE=1)")
+    ap.add_argument("--prompt-cache-min-tokens", type=int, default=PROMPT_CACHE_MIN_TOKENS,
+                    help="минимальный кэшируемый префикс в заглушке Bedrock (токенов)")
+    ap.add_argument("--fio", default="Иванова Анна Петровна")
+    ap.add_argument("--doc-type", default="Справка о выходе в декретный отпуск по уходу за ребенком")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", dest="json_out", help="сохранить отчёт в JSON")
+    ap.add_argument("--compare", help="отчёт JSON предыдущего прогона для сравнения")
+    args = ap.parse_args(argv)
+    if args.streaming:
+        pipeline.BEDROCK_STREAMING = True
+    if args.prompt_cache:
+        pipeline.BEDROCK_PROMPT_CACHE = True
+
+    stubs = AwsStubs(latency=parse_pairs(args.latency), throttle=parse_pairs(args.throttle),
+                     time_scale=args.time_scale, fields={"ФИО заявителя": args.fio}, seed=args.seed,
+                     prompt_cache_min_tokens=args.prompt_cache_min_tokens)
+    for service, region in (("s3", pipeline.AWS_REGION), ("textract", pipeline.AWS_REGION), ("bedrock-runtime", pipeline.BEDROCK_REGION)):
+        stubs.install(pipeline.get_aws_client(service, None, region))
+
+    corpus = load_corpus(args.files, synthetic=not args.no_synthetic)
+    for doc in corpus:
+        pages = pipeline.pdf_page_count(doc["bytes"]) if doc["content_type"] == "application/pdf" else 1
+        stubs.add_document(doc["name"], doc["bytes"], load_replay(args.textract_replay, doc["name"]) or synthetic_blocks(args.fio, pages or 1))
+    docs = [corpus[i % len(corpus)] for i in range(args.docs or len(corpus))]
+    print(f"Корпус: {', '.join(d['name'] for d in corpus)}; документов: {len(docs)}, одновременно: {args.concurrency}", file=sys.stderr)
+
+    # Отложенные импорты (PyMuPDF, OpenCV) — вне измерений, как после фонового прогрева приложения
+    vision.preload_optional_modules()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        rows = list(executor.map(lambda d: run_one(d, args.fio, args.doc_type, args.llm_mode), docs))
+    pipeline.wait_background_tasks()
+    wall = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report = build_report(rows, wall, stubs, peak)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if report["untraced_uploads"]:
+        raise SystemExit(f"Загрузок без вызовов AWS в спане s3_upload: {report['untraced_uploads']}")
+
+
+if __name__ == "__main__":
+    main()
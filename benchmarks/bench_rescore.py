@@ -0,0 +1,109 @@
+"""
+Бенчмарк пересчёта проверок: скалярный compute_checks в цикле против compute_checks_frame (rescore.py).
+
+Генерирует синтетический архив extraction-*.json (ФИО с опечатками и пунктуацией, все типы документов, даты
+в разных форматах, граничные и нераспознаваемые, печать/QR True/False/None, PDF и изображения, отклонённые
+файлы), сверяет результаты построчно и печатает время обоих вариантов. Ненулевой код выхода при расхождениях.
+
+Примеры:
+    python benchmarks/bench_rescore.py
+    python benchmarks/bench_rescore.py --rows 100000 --scalar-rows 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pipeline  # noqa: E402
+import rescore  # noqa: E402
+
+NAMES = ["Иванова Анна Петровна", "Петров Пётр Сергеевич", "Smith John", "Сейтова Айгуль Маратовна"]
+DATE_STYLES = ("%d.%m.%Y", "%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y")
+# Граничные даты: края календаря (срок не вычислить), 29 февраля, однозначные день/месяц, неверный месяц, пробелы
+EDGE_DATES = ("31.12.9999", "01.01.0001", "0001-01-01", "29.02.2024", "29.02.2025", "1.2.2025", "2025-13-01",
+              " 05.06.2025 ", "31/12/1899", "1/1/99")
+
+
+def synthetic_extraction(rng: random.Random, today: date) -> dict:
+    fio = rng.choice(NAMES)
+    doc_fio = rng.choice([fio, fio.upper(), f"  {fio}, ", rng.choice(NAMES), None, ""])
+    client_doc = rng.choice(pipeline.DOC_TYPE_OPTIONS + ["Справка", None])
+    doc_type = rng.choice(["Лист", "Приказ", "Справка", "справка", None, "Договор"])
+    issued = today - timedelta(days=rng.randint(0, 400))
+    issue_date = rng.choice([issued.strftime(rng.choice(DATE_STYLES)), rng.choice(EDGE_DATES), "31.02.2025", "вчера", None, ""])
+    is_pdf = rng.random() < 0.7
+    page_count = rng.choice([1, 1, 1, 2, None]) if is_pdf else None
+    parsed = {
+        "ФИО заявителя": doc_fio,
+        "Тип документа": doc_type,
+        "Дата выдачи документа": issue_date,
+        "_client": {"fio": fio, "doc_type": client_doc},
+        "_stamps": {"stamp_present": rng.choice([True, False, None]), "qr_present": rng.choice([True, False, None])},
+    }
+    if is_pdf and page_count and page_count > 1 and rng.random() < 0.5:
+        preflight = {"ok": False, "format": "pdf", "is_pdf": True, "size_bytes": 1, "page_count": page_count,
+                     "width": None, "height": None, "issues": [{"check": "pages", "message": "PDF содержит 2 страниц(ы)"}],
+                     "checks": {"file_valid": True, "pdf_has_one_page": False, "pdf_page_count": page_count}}
+        err = pipeline.MIB_ERRORS["Прикрепленный файл должен содержать один документ"]
+        preflight["errors"] = [{"field": "Прикрепленный файл должен содержать один документ", "code": err["code"], "message": err["message"]}]
+        return pipeline.preflight_rejection(preflight, fio, client_doc)
+    parsed["_checks"], parsed["_errors"] = pipeline.compute_checks(parsed, fio, client_doc, is_pdf, page_count, today=today)
+    return parsed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Скалярный compute_checks против векторизованного compute_checks_frame")
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--scalar-rows", type=int, default=20000, help="строк для скалярного прогона (время экстраполируется)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    today = date.today()
+    docs = [synthetic_extraction(rng, today) for _ in range(args.rows)]
+    df = rescore.extractions_frame([rescore.extraction_row(d, str(i)) for i, d in enumerate(docs)])
+
+    t0 = time.perf_counter()
+    result = rescore.compute_checks_frame(df, today=today)
+    vector_s = time.perf_counter() - t0
+
+    n = min(args.scalar_rows, args.rows)
+    t0 = time.perf_counter()
+    scalar = []
+    for d in docs[:n]:
+        if d.get("_preflight"):
+            scalar.append((d["_checks"], d["_errors"]))
+            continue
+        checks = d["_checks"]
+        scalar.append(pipeline.compute_checks(d, d["_client"]["fio"], d["_client"]["doc_type"],
+                                              checks["pdf_page_count"] is not None or checks["pdf_has_one_page"] is not None,
+                                              checks["pdf_page_count"], today=today))
+    scalar_s = (time.perf_counter() - t0) * args.rows / n
+
+    mismatches = 0
+    names = [name for name, _ in rescore.CHECK_ERRORS]
+    for i, (checks, errors) in enumerate(scalar):
+        row = result.iloc[i]
+        got = {name: (None if row[name] is None or row[name] is rescore.pd.NA else bool(row[name])) for name in names}
+        want = {name: checks.get(name) for name in names}
+        codes = ",".join(e["code"] for e in errors)
+        if got != want or row["verdict"] != checks["verdict"] or row["error_codes"] != codes or \
+                (None if rescore.pd.isna(row["valid_until"]) else row["valid_until"]) != checks.get("valid_until"):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"Расхождение в строке {i}: {want} {checks['verdict']} {codes} {checks.get('valid_until')} | "
+                      f"{got} {row['verdict']} {row['error_codes']} {row['valid_until']}")
+
+    print(f"Строк: {args.rows}; векторизованно: {vector_s:.3f} c; скалярно: {scalar_s:.2f} c"
+          f"{' (экстраполяция с ' + str(n) + ')' if n < args.rows else ''}; ускорение x{scalar_s / vector_s:.0f}")
+    print(f"Сверено строк: {n}, расхождений: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
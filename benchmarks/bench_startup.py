@@ -0,0 +1,119 @@
+"""
+Бенчмарк холодного старта Streamlit-приложения: время импорта и первого рендера формы.
+
+Каждое измерение — отдельный свежий процесс Python (как новый контейнер App Runner/ECS при масштабировании;
+файлы модулей при этом уже в кэше ОС): «импорт» — import streamlit + pipeline + jobs, как в начале main.py;
+«первый рендер» — AppTest.from_file("main.py").run(), от запуска скрипта до готовой формы загрузки.
+Для каждого измерения печатается, какие тяжёлые зависимости (pandas, PyMuPDF, boto3, OpenCV...) оказались
+загружены. --eager импортирует их заранее внутри измеряемого участка — так, как было до отложенных импортов.
+
+Примеры:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 10 --eager
+    python benchmarks/bench_startup.py --json startup.json
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("pandas", "numpy", "fitz", "boto3", "botocore.config", "cv2", "PIL.Image")
+APP_MODULES = ("streamlit", "pipeline", "jobs")  # импорты в начале main.py
+
+
+def _eager_imports():
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+
+def child(phase: str, eager: bool) -> dict:
+    """Одно измерение в текущем (свежем) процессе."""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    if phase == "import":
+        t0 = time.perf_counter()
+        if eager:
+            _eager_imports()
+        for name in APP_MODULES:
+            importlib.import_module(name)
+        ms = (time.perf_counter() - t0) * 1000
+        exceptions = []
+    else:
+        from streamlit.testing.v1 import AppTest
+
+        # Инфраструктура AppTest сама импортирует streamlit — его исключаем, иначе он в обоих вариантах одинаков
+        at = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=60)
+        t0 = time.perf_counter()
+        if eager:
+            _eager_imports()
+        at.run()
+        ms = (time.perf_counter() - t0) * 1000
+        exceptions = [str(e.value) for e in at.exception]
+    return {"ms": ms, "loaded": [m for m in HEAVY_MODULES if m in sys.modules], "exceptions": exceptions}
+
+
+def measure(phase: str, eager: bool, repeat: int, env: dict) -> dict:
+    runs = []
+    for _ in range(repeat):
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", phase] + (["--eager"] if eager else [])
+        t0 = time.perf_counter()
+        out = subprocess.run(cmd, env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+        run = json.loads(out.stdout.strip().splitlines()[-1])
+        run["process_ms"] = (time.perf_counter() - t0) * 1000
+        runs.append(run)
+    return {
+        "phase": phase,
+        "eager": eager,
+        "median_ms": round(statistics.median(r["ms"] for r in runs), 1),
+        "min_ms": round(min(r["ms"] for r in runs), 1),
+        "process_median_ms": round(statistics.median(r["process_ms"] for r in runs), 1),
+        "loaded": runs[-1]["loaded"],
+        "exceptions": runs[-1]["exceptions"],
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Холодный старт: импорт и первый рендер main.py в свежем процессе")
+    ap.add_argument("--repeat", type=int, default=5, help="свежих процессов на измерение (медиана)")
+    ap.add_argument("--eager", action="store_true", help="также измерить с заранее импортированными тяжёлыми зависимостями")
+    ap.add_argument("--json", dest="json_out", help="сохранить результаты в JSON")
+    ap.add_argument("--child", choices=["import", "render"], help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child, args.eager)))
+        return
+
+    tmp = tempfile.mkdtemp(prefix="idp-startup-")
+    # Без живого AWS: фиктивные учётные данные, локальные файлы задач и каталога; прогрев клиентов идёт в фоне
+    env = dict(os.environ, AWS_ACCESS_KEY_ID="bench", AWS_SECRET_ACCESS_KEY="bench", AWS_EC2_METADATA_DISABLED="true",
+               IDP_JOB_DB_PATH=os.path.join(tmp, "jobs.sqlite3"), IDP_CATALOG_PATH=os.path.join(tmp, "catalog.sqlite3"),
+               PYTHONWARNINGS="ignore")
+    rows = []
+    for eager in ([False, True] if args.eager else [False]):
+        for phase in ("import", "render"):
+            rows.append(measure(phase, eager, args.repeat, env))
+
+    print(f"{'измерение':<16} {'вариант':<12} {'медиана мс':>10} {'мин мс':>8} {'процесс мс':>10}  загружено")
+    for r in rows:
+        label = "импорт" if r["phase"] == "import" else "первый рендер"
+        print(f"{label:<16} {'eager' if r['eager'] else 'по запросу':<12} {r['median_ms']:>10.1f} {r['min_ms']:>8.1f}"
+              f" {r['process_median_ms']:>10.1f}  {', '.join(r['loaded']) or '—'}")
+        if r["exceptions"]:
+            print(f"  исключения: {r['exceptions']}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
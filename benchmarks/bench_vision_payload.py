@@ -0,0 +1,131 @@
+"""
+Бенчмарк размера vision-запроса для детекции печати/QR.
+
+Сравнивает текущий вариант (полные PNG страниц PDF с zoom=2.0, JPEG как есть) с предобработкой из vision.py:
+размер тела запроса, оценку входных токенов и — с флагом --live — фактические токены из usage,
+задержку и совпадение stamp_present/qr_present с исходным вариантом.
+
+Примеры:
+    python benchmarks/bench_vision_payload.py
+    python benchmarks/bench_vision_payload.py docs/*.pdf --long-edge 768 1024 1280 --format jpeg webp --crop full footer
+    python benchmarks/bench_vision_payload.py docs/*.pdf --live --model-id us.anthropic.claude-3-7-sonnet-20250219-v1:0
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fitz  # noqa: E402
+
+import vision  # noqa: E402
+
+
+def render_pages(path: str, max_pages: int = 3, zoom: float = 2.0) -> list[bytes]:
+    """Страницы так же, как их рендерит приложение: PNG, zoom=2.0, не более трёх. JPEG — как есть."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not path.lower().endswith(".pdf"):
+        return [data]
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        mat = fitz.Matrix(zoom, zoom)
+        return [doc.load_page(i).get_pixmap(matrix=mat, colorspace=fitz.csRGB, alpha=False).tobytes("png")
+                for i in range(min(len(doc), max_pages))]
+
+
+def baseline_content(pages: list[bytes]) -> tuple[list[dict], int]:
+    content, tokens = [], 0
+    for png in pages:
+        pix = fitz.Pixmap(png)
+        media = "image/png" if png[:4] == b"\x89PNG" else "image/jpeg"
+        content.append(vision.b64_image_from_bytes(png, media))
+        tokens += vision.estimate_image_tokens(pix.width, pix.height)
+    return content, tokens
+
+
+def variant_content(pages: list[bytes], **options) -> tuple[list[dict], int]:
+    content, tokens = [], 0
+    for png in pages:
+        for part in vision.preprocess_vision_image(png, **options):
+            content.append(vision.b64_image_from_bytes(part["bytes"], part["media_type"]))
+            tokens += part["tokens"] or 0
+    return content, tokens
+
+
+def invoke(client, model_id: str, content: list[dict]) -> dict:
+    body = vision.build_stamp_request_body(content)
+    t0 = time.perf_counter()
+    resp = client.invoke_model(modelId=model_id, contentType="application/json", accept="application/json", body=json.dumps(body))
+    data = json.loads(resp["body"].read())
+    latency = time.perf_counter() - t0
+    result = vision.parse_stamp_response(data.get("content", [{}])[0].get("text", ""))
+    result["input_tokens"] = (data.get("usage") or {}).get("input_tokens")
+    result["latency_s"] = latency
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Размер и токены vision-запроса: полные PNG против предобработки")
+    ap.add_argument("files", nargs="*", default=[os.path.join(ROOT, "test-local-v2.pdf")], help="PDF/JPEG документы")
+    ap.add_argument("--long-edge", type=int, nargs="+", default=[vision.VISION_LONG_EDGE])
+    ap.add_argument("--format", nargs="+", default=[vision.VISION_IMAGE_FORMAT], choices=["jpeg", "webp", "png"])
+    ap.add_argument("--quality", type=int, nargs="+", default=[vision.VISION_IMAGE_QUALITY])
+    ap.add_argument("--crop", nargs="+", default=[vision.VISION_CROP], choices=sorted(vision.VISION_CROP_REGIONS))
+    ap.add_argument("--live", action="store_true", help="вызвать Bedrock и сравнить ответы (платно)")
+    ap.add_argument("--model-id", default=os.getenv("BEDROCK_INFERENCE_PROFILE", "us.anthropic.claude-3-7-sonnet-20250219-v1:0"))
+    ap.add_argument("--region", default=os.getenv("BEDROCK_REGION", "us-east-1"))
+    ap.add_argument("--json", dest="json_out", help="сохранить сырые результаты в JSON")
+    args = ap.parse_args(argv)
+
+    client = None
+    if args.live:
+        import boto3
+        client = boto3.client("bedrock-runtime", region_name=args.region)
+
+    variants = [dict(long_edge=le, fmt=fm, quality=q, crop=c)
+                for le, fm, q, c in itertools.product(args.long_edge, args.format, args.quality, args.crop)]
+    rows = []
+    for path in args.files:
+        pages = render_pages(path)
+        base, base_tokens = baseline_content(pages)
+        base_bytes = len(json.dumps(vision.build_stamp_request_body(base)))
+        base_live = invoke(client, args.model_id, base) if client else None
+        rows.append({"file": path, "variant": "исходный (текущий)", "images": len(base), "payload_bytes": base_bytes,
+                     "est_tokens": base_tokens, "live": base_live})
+        for opts in variants:
+            content, tokens = variant_content(pages, **opts)
+            live = invoke(client, args.model_id, content) if client else None
+            if live and base_live:
+                live["agree"] = (live.get("stamp_present") == base_live.get("stamp_present")
+                                 and live.get("qr_present") == base_live.get("qr_present"))
+            rows.append({"file": path, "variant": "{long_edge}px {fmt} q{quality} {crop}".format(**opts), "images": len(content),
+                         "payload_bytes": len(json.dumps(vision.build_stamp_request_body(content))),
+                         "est_tokens": tokens, "live": live})
+
+    header = f"{'файл':<28} {'вариант':<28} {'изобр.':>6} {'байт':>10} {'токены≈':>8}"
+    if args.live:
+        header += f" {'input_tokens':>12} {'сек':>6} {'печать':>6} {'QR':>5} {'совпад.':>7}"
+    print(header)
+    for r in rows:
+        line = f"{os.path.basename(r['file'])[:28]:<28} {r['variant'][:28]:<28} {r['images']:>6} {r['payload_bytes']:>10} {r['est_tokens']:>8}"
+        live = r["live"]
+        if live:
+            line += (f" {str(live.get('input_tokens')):>12} {live['latency_s']:>6.2f} {str(live.get('stamp_present')):>6}"
+                     f" {str(live.get('qr_present')):>5} {str(live.get('agree', '—')):>7}")
+        print(line)
+
+    if args.live:
+        agreed = [r["live"]["agree"] for r in rows if r["live"] and "agree" in r["live"]]
+        if agreed:
+            print(f"\nСовпадение с исходными изображениями: {sum(agreed)}/{len(agreed)}")
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Каталог результатов обработки: локальный SQLite-индекс по всем extraction-*.json.
+
+Конвейер дописывает строку на каждое сохранённое извлечение (и на каждую неудачную обработку) — записи
+только добавляются, повторная обработка документа (replay, batch) даёт новую строку. Приложению для
+сотрудников не нужно обходить папки в S3: список, фильтры по статусу, вердикту, коду ошибки и типу документа,
+постраничный просмотр — запросы к индексу. Полный JSON по-прежнему читается из S3 по json_key.
+
+Строка: id, recorded_at, bucket, upload_id, doc_key, json_key, status (COMPLETE | ERROR), verdict,
+error_codes ("05,01"), doc_type, client_doc_type, client_fio, llm_mode, replay, cache_hit, trace_id, total_ms,
+timings (стадии из _timings), error.
+
+Примеры:
+    python catalog.py list --verdict fail --limit 20
+    python catalog.py list --error-code 03 --cursor 1520
+    python catalog.py stats
+    python catalog.py backfill s3://loan-deferment-idp-test-tlek/uploads/
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+CATALOG_ENABLED = os.getenv("IDP_CATALOG", "1") != "0"
+CATALOG_PATH = os.getenv("IDP_CATALOG_PATH", ".catalog.sqlite3")
+
+STATUS_COMPLETE = "COMPLETE"
+STATUS_ERROR = "ERROR"
+
+_COLUMNS = ("id", "recorded_at", "bucket", "upload_id", "doc_key", "json_key", "status", "verdict", "error_codes",
+            "doc_type", "client_doc_type", "client_fio", "llm_mode", "replay", "cache_hit", "trace_id", "total_ms", "timings", "error")
+
+
+def _connect(path: str | None = None):
+    conn = sqlite3.connect(path or CATALOG_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS extractions ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, recorded_at TEXT NOT NULL, bucket TEXT, upload_id TEXT, doc_key TEXT,"
+        " json_key TEXT, status TEXT NOT NULL, verdict TEXT, error_codes TEXT, doc_type TEXT, client_doc_type TEXT,"
+        " client_fio TEXT, llm_mode TEXT, replay TEXT, cache_hit INTEGER, trace_id TEXT, total_ms REAL, timings TEXT,"
+        " error TEXT)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_extractions_doc ON extractions (doc_key, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_extractions_verdict ON extractions (verdict, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_extractions_status ON extractions (status, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_extractions_recorded ON extractions (recorded_at)")
+    return conn
+
+
+def upload_id_of(doc_key: str | None) -> str | None:
+    """Идентификатор загрузки — имя папки документа (upload_id_XXX)."""
+    if not doc_key or "/" not in doc_key:
+        return None
+    return doc_key.rsplit("/", 2)[-2]
+
+
+def _insert(row: dict):
+    row = dict(row, recorded_at=row.get("recorded_at") or datetime.utcnow().isoformat(timespec="seconds") + "Z")
+    cols = [c for c in _COLUMNS if c != "id"]
+    conn = _connect()
+    try:
+        conn.execute(f"INSERT INTO extractions ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                     [row.get(c) for c in cols])
+    finally:
+        conn.close()
+
+
+def record_extraction(bucket: str | None, doc_key: str | None, json_key: str | None, parsed: dict,
+                      recorded_at: str | None = None):
+    """Строка каталога для сохранённого результата (json_key None — результат не сохранялся в S3). Ошибки не пробрасываются."""
+    if not CATALOG_ENABLED:
+        return
+    try:
+        checks = parsed.get("_checks") if isinstance(parsed.get("_checks"), dict) else {}
+        client = parsed.get("_client") or {}
+        timings = parsed.get("_timings") or {}
+        _insert({
+            "recorded_at": recorded_at,
+            "bucket": bucket,
+            "upload_id": upload_id_of(doc_key),
+            "doc_key": doc_key,
+            "json_key": json_key,
+            "status": STATUS_COMPLETE,
+            "verdict": checks.get("verdict"),
+            "error_codes": ",".join(str(e.get("code")) for e in parsed.get("_errors") or [] if e.get("code")),
+            "doc_type": parsed.get("Тип документа"),
+            "client_doc_type": client.get("doc_type_value") or client.get("doc_type"),
+            "client_fio": client.get("fio"),
+            "llm_mode": parsed.get("_llm_mode"),
+            "replay": (parsed.get("_replay") or {}).get("mode"),
+            "cache_hit": int(bool((parsed.get("_cache") or {}).get("hit"))),
+            "trace_id": timings.get("trace_id"),
+            "total_ms": timings.get("total_ms"),
+            "timings": json.dumps(timings.get("stages") or {}, ensure_ascii=False) if timings else None,
+        })
+    except Exception:
+        pass
+
+
+def record_failure(bucket: str | None, doc_key: str | None, error: str, client_fio: str | None = None,
+                   client_doc_type: str | None = None):
+    """Строка каталога для неудачной обработки (status ERROR). Ошибки не пробрасываются."""
+    if not CATALOG_ENABLED:
+        return
+    try:
+        _insert({"bucket": bucket, "upload_id": upload_id_of(doc_key), "doc_key": doc_key, "status": STATUS_ERROR,
+                 "client_fio": client_fio, "client_doc_type": client_doc_type, "error": error})
+    except Exception:
+        pass
+
+
+def _where(status=None, verdict=None, error_code=None, doc_type=None, upload_id=None,
+           since=None, until=None, latest_only=True, cursor=None) -> tuple[str, list]:
+    clauses, params = [], []
+    if latest_only:
+        # Последняя строка каждого документа; ошибки без ключа (файл не загружен) — каждая отдельно
+        clauses.append("id IN (SELECT MAX(id) FROM extractions GROUP BY COALESCE(doc_key, 'id:' || id))")
+    for column, value in (("status", status), ("verdict", verdict), ("doc_type", doc_type), ("upload_id", upload_id)):
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if error_code:
+        clauses.append("instr(',' || error_codes || ',', ?) > 0")
+        params.append(f",{error_code},")
+    if since:
+        clauses.append("recorded_at >= ?")
+        params.append(since)
+    if until:
+        clauses.append("recorded_at < ?")
+        params.append(until)
+    if cursor:
+        clauses.append("id < ?")
+        params.append(int(cursor))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def list_extractions(limit: int = 50, **filters) -> dict:
+    """
+    Страница каталога, новые сверху. filters: status, verdict, error_code, doc_type, upload_id, since, until
+    (ISO-время), latest_only (по умолчанию True — одна строка на документ), cursor (next_cursor прошлой страницы).
+    Возвращает {"items": [...], "next_cursor": int | None}.
+    """
+    where, params = _where(**filters)
+    conn = _connect()
+    try:
+        rows = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM extractions{where} ORDER BY id DESC LIMIT ?",
+                            params + [int(limit) + 1]).fetchall()
+    finally:
+        conn.close()
+    items = [dict(zip(_COLUMNS, r)) for r in rows[:limit]]
+    for item in items:
+        item["timings"] = json.loads(item["timings"]) if item["timings"] else None
+        item["error_codes"] = [c for c in (item["error_codes"] or "").split(",") if c]
+    return {"items": items, "next_cursor": items[-1]["id"] if len(rows) > limit else None}
+
+
+def count_extractions(**filters) -> int:
+    filters.pop("cursor", None)
+    where, params = _where(**filters)
+    conn = _connect()
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM extractions{where}", params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def catalog_stats(latest_only: bool = True) -> dict:
+    """Число документов по статусу и вердикту."""
+    where, params = _where(latest_only=latest_only)
+    conn = _connect()
+    try:
+        rows = conn.execute(f"SELECT status, verdict, COUNT(*) FROM extractions{where} GROUP BY status, verdict",
+                            params).fetchall()
+    finally:
+        conn.close()
+    return {f"{status}/{verdict}" if verdict else status: n for status, verdict, n in rows}
+
+
+def backfill_from_s3(s3_client, bucket: str, prefix: str) -> int:
+    """Разовое заполнение каталога по существующим extraction-*.json (обход S3). Возвращает число строк."""
+    keys = []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(o["Key"] for o in page.get("Contents", []) or []
+                    if o["Key"].rsplit("/", 1)[-1].startswith("extraction-") and o["Key"].endswith(".json"))
+    conn = _connect()
+    try:
+        known = {r[0] for r in conn.execute("SELECT json_key FROM extractions WHERE json_key IS NOT NULL")}
+    finally:
+        conn.close()
+    added = 0
+    for json_key in sorted(keys):
+        if json_key in known:
+            continue
+        folder, _, name = json_key.rpartition("/")
+        parsed = json.loads(s3_client.get_object(Bucket=bucket, Key=json_key)["Body"].read())
+        # Ключ документа — объект рядом с JSON; время — из имени extraction-YYYYMMDD-HHMMSS.json
+        doc_key = None
+        page = s3_client.list_objects_v2(Bucket=bucket, Prefix=f"{folder}/", Delimiter="/")
+        for obj in page.get("Contents", []) or []:
+            obj_name = obj["Key"].rsplit("/", 1)[-1]
+            if not obj_name.startswith("extraction-"):
+                doc_key = obj["Key"]
+                break
+        try:
+            recorded_at = datetime.strptime(name[len("extraction-"):-len(".json")], "%Y%m%d-%H%M%S").isoformat() + "Z"
+        except ValueError:
+            recorded_at = None
+        record_extraction(bucket, doc_key, json_key, parsed, recorded_at=recorded_at)
+        added += 1
+    return added
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Каталог результатов обработки (SQLite-индекс)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    ls = sub.add_parser("list", help="страница каталога")
+    ls.add_argument("--status", choices=[STATUS_COMPLETE, STATUS_ERROR])
+    ls.add_argument("--verdict", choices=["pass", "fail", "unknown"])
+    ls.add_argument("--error-code", help="код ошибки МИБ, например 03")
+    ls.add_argument("--doc-type", help="Лист | Приказ | Справка")
+    ls.add_argument("--upload-id")
+    ls.add_argument("--since", help="ISO-время, например 2026-10-01")
+    ls.add_argument("--until")
+    ls.add_argument("--all-versions", action="store_true", help="все строки, а не последняя по документу")
+    ls.add_argument("--limit", type=int, default=50)
+    ls.add_argument("--cursor", type=int, help="next_cursor предыдущей страницы")
+    sub.add_parser("stats", help="число документов по статусу и вердикту")
+    bf = sub.add_parser("backfill", help="заполнить каталог по extraction-*.json в S3")
+    bf.add_argument("uri", help="s3://bucket/prefix")
+    args = ap.parse_args(argv)
+
+    if args.command == "list":
+        page = list_extractions(limit=args.limit, status=args.status, verdict=args.verdict, error_code=args.error_code,
+                                doc_type=args.doc_type, upload_id=args.upload_id, since=args.since, until=args.until,
+                                latest_only=not args.all_versions, cursor=args.cursor)
+        print(json.dumps(page, ensure_ascii=False, indent=2))
+    elif args.command == "stats":
+        print(json.dumps(catalog_stats(), ensure_ascii=False, indent=2))
+    else:
+        import pipeline
+
+        bucket, _, prefix = args.uri[len("s3://"):].partition("/")
+        s3 = pipeline.get_aws_client("s3", pipeline.AWS_PROFILE.strip() or None, pipeline.AWS_REGION)
+        print(f"Добавлено строк: {backfill_from_s3(s3, bucket, prefix)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
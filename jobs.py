@@ -0,0 +1,354 @@
+"""
+Фоновая очередь задач обработки документов.
+
+Отправка формы только ставит задачу в очередь (submit_job) и сразу возвращает job_id; обработка
+(загрузка в S3, Textract, Bedrock, проверки) выполняется пулом рабочих потоков процесса, общим для всех сессий.
+Страница опрашивает запись статуса (get_job) в формате status.json:
+
+    {"job_id", "status": "PROCESSING" | "COMPLETE" | "ERROR", "stage", "progress",
+     "created_at", "updated_at", "file_name", "s3_key", "s3_uri", "json_key", "error", "result", "partial",
+     "owner": {"host", "pid", "boot_id"}}
+
+partial — поля ответов LLM, уже полученные в потоковом режиме (IDP_BEDROCK_STREAMING=1), до завершения задачи.
+
+Записи хранятся в SQLite (по умолчанию, переживают перезапуск страницы) или в памяти процесса.
+Байты превью страниц и JSON-payload не сериализуются и доступны только в памяти процесса, выполнившего задачу,
+и недолго: JOB_ARTIFACTS_TTL_SECONDS после завершения и не больше JOB_ARTIFACTS_MAX задач (вытесняются давно
+не читавшиеся). Запись статуса с результатом хранится JOB_RETENTION_SECONDS.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
+
+import catalog
+import pipeline
+import tracing
+
+JOB_BACKEND = os.getenv("IDP_JOB_BACKEND", "sqlite")  # sqlite | memory
+JOB_DB_PATH = os.getenv("IDP_JOB_DB_PATH", ".jobs.sqlite3")  # общий для процессов одного хоста
+JOB_WORKERS = int(os.getenv("IDP_JOB_WORKERS", "4"))  # документов в обработке одновременно на процесс
+JOB_POLL_SECONDS = float(os.getenv("IDP_JOB_POLL_SECONDS", "1.0"))  # интервал опроса статуса страницей
+JOB_RETENTION_SECONDS = int(os.getenv("IDP_JOB_RETENTION_SECONDS", str(24 * 3600)))
+JOB_ARTIFACTS_TTL_SECONDS = int(os.getenv("IDP_JOB_ARTIFACTS_TTL_SECONDS", "1800"))  # превью и payload в памяти
+JOB_ARTIFACTS_MAX = int(os.getenv("IDP_JOB_ARTIFACTS_MAX", "32"))  # задач с превью в памяти одновременно
+
+STATUS_PROCESSING = "PROCESSING"
+STATUS_COMPLETE = "COMPLETE"
+STATUS_ERROR = "ERROR"
+
+_JOBS: dict = {}  # бэкенд memory: job_id -> (запись статуса, время обновления)
+_JOB_ARTIFACTS: OrderedDict = OrderedDict()  # job_id -> {"pdf_previews", "payload", "finished_at"}; LRU, только в памяти
+_JOBS_LOCK = threading.Lock()
+_UPDATE_LOCK = threading.RLock()  # чтение-изменение-запись статуса из потока задачи и потоков стадий
+_JOB_EXECUTOR = None
+# Владелец задач этого процесса: по нему при старте отличаются осиротевшие задачи от задач живых соседних процессов
+_JOB_OWNER = {"host": socket.gethostname(), "pid": os.getpid(), "boot_id": pipeline.new_ulid()}
+
+
+def _utcnow_iso() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+def _job_db_connect():
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30, isolation_level=None)
+    # WAL: опрос статуса страницами не блокирует запись прогресса рабочими потоками
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, record TEXT NOT NULL, updated_at REAL NOT NULL)"
+    )
+    return conn
+
+
+def _save_job(record: dict):
+    if JOB_BACKEND == "memory":
+        with _JOBS_LOCK:
+            _JOBS[record["job_id"]] = (dict(record), time.time())
+        return
+    conn = _job_db_connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, status, record, updated_at) VALUES (?, ?, ?, ?)",
+            (record["job_id"], record["status"], json.dumps(record, ensure_ascii=False), time.time()),
+        )
+    finally:
+        conn.close()
+
+
+def get_job(job_id: str) -> dict | None:
+    """Текущая запись статуса задачи (копия) или None, если задача неизвестна."""
+    if JOB_BACKEND == "memory":
+        with _JOBS_LOCK:
+            entry = _JOBS.get(job_id)
+            return dict(entry[0]) if entry else None
+    conn = _job_db_connect()
+    try:
+        row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def _expire_artifacts(now: float):
+    # Вызывается под _JOBS_LOCK: просроченные и сверх JOB_ARTIFACTS_MAX (давно не читавшиеся) — удаляются
+    cutoff = now - JOB_ARTIFACTS_TTL_SECONDS
+    for job_id in [j for j, a in _JOB_ARTIFACTS.items() if a["finished_at"] < cutoff]:
+        _JOB_ARTIFACTS.pop(job_id, None)
+    while len(_JOB_ARTIFACTS) > max(0, JOB_ARTIFACTS_MAX):
+        _JOB_ARTIFACTS.popitem(last=False)
+
+
+def _store_artifacts(job_id: str, pdf_previews: dict | None, payload: bytes | None):
+    with _JOBS_LOCK:
+        _JOB_ARTIFACTS[job_id] = {"pdf_previews": pdf_previews, "payload": payload, "finished_at": time.time()}
+        _expire_artifacts(time.time())
+
+
+def get_job_artifacts(job_id: str) -> dict:
+    """
+    Несериализуемые результаты задачи (байты превью, JSON-payload), если задача выполнялась в этом процессе
+    и они ещё не вытеснены; иначе {} (страница показывает результат без превью, JSON собирается заново).
+    """
+    with _JOBS_LOCK:
+        _expire_artifacts(time.time())
+        if job_id not in _JOB_ARTIFACTS:
+            return {}
+        _JOB_ARTIFACTS.move_to_end(job_id)
+        return dict(_JOB_ARTIFACTS[job_id])
+
+
+def _update_job(job_id: str, **fields):
+    with _UPDATE_LOCK:
+        record = get_job(job_id) or {"job_id": job_id}
+        record.update(fields)
+        record["updated_at"] = _utcnow_iso()
+        _save_job(record)
+
+
+def _add_partial_field(job_id: str, name: str, value):
+    with _UPDATE_LOCK:
+        record = get_job(job_id) or {"job_id": job_id}
+        record["partial"] = dict(record.get("partial") or {}, **{name: value})
+        record["updated_at"] = _utcnow_iso()
+        _save_job(record)
+
+
+def _purge_old_jobs():
+    """Удаляет завершённые задачи старше JOB_RETENTION_SECONDS."""
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _JOBS_LOCK:
+        _expire_artifacts(time.time())
+        if JOB_BACKEND == "memory":
+            for job_id in [j for j, (r, ts) in _JOBS.items() if r["status"] != STATUS_PROCESSING and ts < cutoff]:
+                _JOBS.pop(job_id, None)
+    if JOB_BACKEND != "memory":
+        conn = _job_db_connect()
+        try:
+            conn.execute("DELETE FROM jobs WHERE status != ? AND updated_at < ?", (STATUS_PROCESSING, cutoff))
+        finally:
+            conn.close()
+
+
+def _pid_alive(pid) -> bool:
+    if not isinstance(pid, int) or pid <= 0:
+        return False
+    if os.name == "nt":
+        return True  # os.kill(pid, 0) на Windows посылает CTRL_C_EVENT — живость не проверяем
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_orphaned(record: dict) -> bool:
+    """
+    Задача в PROCESSING, которую больше некому выполнять: её процесс-владелец на этом хосте завершился
+    или перезапустился (тот же pid, другой boot_id). Задачи других хостов и живых процессов не трогаем.
+    """
+    owner = record.get("owner")
+    if not owner:
+        return True  # запись без владельца — от версии без этого поля
+    if owner.get("host") != _JOB_OWNER["host"]:
+        return False
+    if owner.get("pid") == _JOB_OWNER["pid"]:
+        return owner.get("boot_id") != _JOB_OWNER["boot_id"]
+    return not _pid_alive(owner.get("pid"))
+
+
+def _fail_orphaned_jobs():
+    conn = _job_db_connect()
+    try:
+        rows = conn.execute("SELECT record FROM jobs WHERE status = ?", (STATUS_PROCESSING,)).fetchall()
+    finally:
+        conn.close()
+    for (raw,) in rows:
+        record = json.loads(raw)
+        if _is_orphaned(record):
+            record.update(status=STATUS_ERROR, error="Обработка прервана перезапуском приложения", updated_at=_utcnow_iso())
+            _save_job(record)
+
+
+def get_job_executor():
+    """
+    Пул рабочих потоков процесса. Перед первым созданием задачи SQLite, оставшиеся в PROCESSING
+    от завершившегося или перезапущенного процесса, помечаются как ERROR — выполнять их больше некому.
+    """
+    global _JOB_EXECUTOR
+    with _JOBS_LOCK:
+        if _JOB_EXECUTOR is None:
+            # Под блокировкой и до публикации пула: параллельный submit_job не успеет сохранить задачу до обхода
+            if JOB_BACKEND != "memory":
+                _fail_orphaned_jobs()
+            _JOB_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS), thread_name_prefix="idp-job")
+        return _JOB_EXECUTOR
+
+
+def _fail_job(job_id: str, error: str, bucket: str, key: str | None, client_fio: str | None, client_doc_type: str | None):
+    """Статус ERROR в записи задачи и строка об ошибке в каталоге результатов."""
+    _update_job(job_id, status=STATUS_ERROR, error=error)
+    catalog.record_failure(bucket, key, error, client_fio, client_doc_type)
+
+
+def _run_job(job_id: str, file_bytes: bytes, filename: str, content_type: str,
+             client_fio: str | None, client_doc_type: str | None,
+             bucket: str, key_prefix: str, inference_profile: str | None):
+    """
+    Загрузка и обработка документа в рабочем потоке; исход фиксируется в записи статуса. Любое непредвиденное
+    исключение (предварительная проверка, каталог, запись результата) завершает задачу статусом ERROR —
+    иначе страница опрашивала бы задачу в PROCESSING бесконечно.
+    """
+    try:
+        _run_job_stages(job_id, file_bytes, filename, content_type, client_fio, client_doc_type,
+                        bucket, key_prefix, inference_profile)
+    except Exception as e:
+        try:
+            _fail_job(job_id, f"Обработка не удалась: {e}", bucket, (get_job(job_id) or {}).get("s3_key"),
+                      client_fio, client_doc_type)
+        except Exception:
+            pass
+
+
+def _run_job_stages(job_id: str, file_bytes: bytes, filename: str, content_type: str,
+                    client_fio: str | None, client_doc_type: str | None,
+                    bucket: str, key_prefix: str, inference_profile: str | None):
+    def _on_progress(label: str, percent: int):
+        # Проценты конвейера (0..100) переводятся в диапазон после загрузки (30..100)
+        _update_job(job_id, stage=label, progress=30 + percent * 70 // 100)
+
+    def _on_field(name: str, value):
+        _add_partial_field(job_id, name, value)
+
+    trace = tracing.Trace()
+    preflight = None
+    if pipeline.PREFLIGHT_ENABLED:
+        # Локальная проверка до S3: заведомо отклоняемый файл не загружается и не отправляется в Textract/Bedrock
+        with trace.span("preflight"):
+            preflight = pipeline.preflight_document(file_bytes, filename, content_type)
+        if not preflight["ok"]:
+            parsed = pipeline.preflight_rejection(preflight, client_fio, client_doc_type)
+            parsed["_timings"] = trace.timings()
+            trace.export()
+            catalog.record_extraction(bucket, None, None, parsed)
+            _update_job(job_id, status=STATUS_COMPLETE, stage="Файл не прошёл предварительную проверку", progress=100,
+                        is_pdf=preflight["is_pdf"], page_count=preflight["page_count"], result=parsed)
+            return
+
+    try:
+        s3 = pipeline.get_aws_client("s3", pipeline.AWS_PROFILE.strip() or None, pipeline.AWS_REGION)
+        _update_job(job_id, stage="Загрузка файла...", progress=5)
+        with trace.span("upload"):
+            key = pipeline.upload_document(s3, file_bytes, filename, content_type, bucket=bucket, key_prefix=key_prefix,
+                                           sha256=preflight["sha256"] if preflight else None)
+        s3_uri = f"s3://{bucket}/{key}"
+        _update_job(job_id, stage=f"Файл загружен в {s3_uri}", progress=30, s3_key=key, s3_uri=s3_uri)
+    except NoCredentialsError:
+        _fail_job(job_id, "AWS-учётные данные не найдены. Настройте их через ~/.aws/credentials или переменные окружения.",
+                  bucket, None, client_fio, client_doc_type)
+        return
+    except ClientError as e:
+        err = e.response.get("Error", {})
+        _fail_job(job_id, f"AWS ClientError: {err.get('Code', 'Unknown')} - {err.get('Message', str(e))}",
+                  bucket, None, client_fio, client_doc_type)
+        return
+    except (BotoCoreError, Exception) as e:
+        _fail_job(job_id, f"Ошибка при загрузке: {e}", bucket, None, client_fio, client_doc_type)
+        return
+
+    try:
+        result = pipeline.process_document(
+            file_bytes,
+            key,
+            content_type,
+            client_fio,
+            client_doc_type,
+            bucket=bucket,
+            inference_profile=inference_profile,
+            on_progress=_on_progress,
+            trace=trace,
+            on_field=_on_field,
+            preflight=preflight,
+        )
+    except ClientError as e:
+        err = e.response.get("Error", {})
+        _fail_job(job_id, f"Ошибка обработки: {err.get('Code', 'Unknown')} - {err.get('Message', str(e))}",
+                  bucket, key, client_fio, client_doc_type)
+        return
+    except Exception as e:
+        _fail_job(job_id, f"Обработка не удалась: {e}", bucket, key, client_fio, client_doc_type)
+        return
+
+    _store_artifacts(job_id, result.get("pdf_previews"), result.get("payload"))
+    _update_job(
+        job_id,
+        status=STATUS_COMPLETE,
+        stage="Обработка завершена",
+        progress=100,
+        json_key=result["json_key"],
+        is_pdf=result["is_pdf"],
+        page_count=result["page_count"],
+        result=result["parsed"],
+        partial=None,
+    )
+
+
+def submit_job(file_bytes: bytes, filename: str, content_type: str | None,
+               client_fio: str | None, client_doc_type: str | None,
+               bucket: str = pipeline.BUCKET_NAME, key_prefix: str = pipeline.KEY_PREFIX,
+               inference_profile: str | None = None) -> str:
+    """Ставит документ в очередь обработки и сразу возвращает job_id."""
+    executor = get_job_executor()
+    _purge_old_jobs()
+    job_id = pipeline.new_ulid()
+    now = _utcnow_iso()
+    _save_job({
+        "job_id": job_id,
+        "status": STATUS_PROCESSING,
+        "stage": "В очереди",
+        "progress": 0,
+        "created_at": now,
+        "updated_at": now,
+        "file_name": filename,
+        "s3_key": None,
+        "s3_uri": None,
+        "json_key": None,
+        "error": None,
+        "result": None,
+        "partial": None,
+        "owner": dict(_JOB_OWNER),
+    })
+    executor.submit(
+        _run_job, job_id, file_bytes, filename, content_type or "application/octet-stream",
+        client_fio, client_doc_type, bucket, key_prefix, inference_profile,
+    )
+    return job_id
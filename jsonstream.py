@@ -0,0 +1,90 @@
+"""
+Инкрементальный разбор JSON-объекта из потокового ответа LLM.
+
+Текст подаётся кусками (feed) по мере поступления дельт Bedrock. Верхнеуровневые поля объекта
+возвращаются сразу, как только значение поля полностью получено (после запятой или закрывающей скобки),
+а после закрывающей '}' объекта разбор завершается (done) — остаток генерации можно не читать.
+Текст до первой '{' (пояснения, ```json) пропускается, как и в parse_json_relaxed.
+"""
+import json
+
+
+class JsonObjectStream:
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._start = None  # позиция '{' верхнего уровня
+        self._end = None  # позиция после закрывающей '}'
+        self._member_start = None  # начало текущего поля "ключ": значение
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self.fields = {}
+        self.done = False
+
+    @property
+    def text(self) -> str:
+        """Весь полученный текст; после завершения — ровно до закрывающей '}'."""
+        if self._end is not None:
+            return self._text[:self._end]
+        return self._text
+
+    def feed(self, chunk: str) -> list[tuple[str, object]]:
+        """Добавляет кусок текста; возвращает поля (ключ, значение), завершённые этим куском."""
+        if self.done or not chunk:
+            return []
+        self._text += chunk
+        new_fields = []
+        text = self._text
+        pos = self._pos
+        while pos < len(text) and not self.done:
+            ch = text[pos]
+            if self._start is None:
+                if ch == "{":
+                    self._start = pos
+                    self._member_start = pos + 1
+                    self._depth = 1
+            elif self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(self._member_start, pos, new_fields)
+                    self._end = pos + 1
+                    self.done = True
+            elif ch == "," and self._depth == 1:
+                self._emit(self._member_start, pos, new_fields)
+                self._member_start = pos + 1
+            pos += 1
+        self._pos = pos
+        return new_fields
+
+    def _emit(self, start: int, end: int, out: list):
+        fragment = self._text[start:end].strip()
+        if not fragment:
+            return
+        try:
+            member = json.loads("{" + fragment + "}")
+        except Exception:
+            return
+        for k, v in member.items():
+            self.fields[k] = v
+            out.append((k, v))
+
+    def result(self) -> dict | None:
+        """Разобранный объект целиком (None, если объект не завершён или невалиден)."""
+        if not self.done:
+            return None
+        try:
+            return json.loads(self._text[self._start:self._end])
+        except Exception:
+            return None
@@ -0,0 +1,100 @@
+"""
+Подготовка OCR-текста Textract для запроса извлечения полей.
+
+Вместо обрезки склеенного текста по числу символов строки LINE отбираются по структуре: отбрасываются строки
+с низкой уверенностью OCR, повторы (колонтитулы на каждой странице) и табличный шум, пробелы схлопываются.
+Если текст не помещается в бюджет токенов, в первую очередь остаются строки с ключевыми словами
+(ФИО, Приказ, Справка, Лист, отпуск, выдан...) и датами, их соседи (значение часто на следующей строке)
+и начало первой страницы (наименование документа); порядок чтения сохраняется.
+Модуль не зависит от Streamlit и AWS — его используют pipeline.py и бенчмарки.
+"""
+import os
+import re
+
+# --- Параметры (переопределяются переменными окружения) ---
+OCR_COMPACT = os.getenv("IDP_OCR_COMPACT", "1") != "0"  # 0 — прежняя обрезка текста до OCR_LEGACY_MAX_CHARS
+OCR_TOKEN_BUDGET = int(os.getenv("IDP_OCR_TOKEN_BUDGET", "4000"))  # оценка токенов OCR-текста в промпте
+OCR_MIN_CONFIDENCE = float(os.getenv("IDP_OCR_MIN_CONFIDENCE", "50"))  # уверенность Textract (0..100)
+OCR_LEGACY_MAX_CHARS = 15000
+OCR_CHARS_PER_TOKEN = 3  # кириллица: примерно 3 символа на токен Claude
+
+# Строки, рядом с которыми находятся нужные поля (сопоставляются со строкой в casefold)
+KEYWORD_RE = re.compile(
+    r"\bф\.?\s*и\.?\s*о\b|фамили|имя|отчеств|приказ|справк|лист\w*\s+временн|нетрудоспособн|отпуск|декрет|"
+    r"выдан|дата|работник|сотрудни|гражданин"
+)
+DATE_RE = re.compile(
+    r"\b\d{1,2}\s*[./-]\s*\d{1,2}\s*[./-]\s*\d{2,4}\b|\b\d{4}-\d{2}-\d{2}\b|"
+    r"\b\d{1,2}\s+(?:января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+\d{4}"
+)
+# Табличный шум: рамки, линии подчёркивания, отточия
+_NOISE_RE = re.compile(r"[|¦│┃…]+|[_=*—]{2,}|[-.]{3,}")
+_ALNUM = "[0-9A-Za-zА-Яа-яЁёӘәҒғҚқҢңӨөҰұҮүҺһІі]"
+_TWO_ALNUM_RE = re.compile(f"{_ALNUM}.*?{_ALNUM}", re.DOTALL)  # меньше двух букв/цифр — шум
+
+HEAD_LINES = 5  # первые строки первой страницы: наименование документа
+NEIGHBOR_LINES = 2  # соседи строки с ключевым словом
+
+
+def estimate_text_tokens(text: str) -> int:
+    return (len(text) + OCR_CHARS_PER_TOKEN - 1) // OCR_CHARS_PER_TOKEN
+
+
+def clean_line(text: str) -> str:
+    """Строка без табличного шума и лишних пробелов."""
+    return " ".join(_NOISE_RE.sub(" ", text or "").split()).strip(" :;,")
+
+
+def compact_ocr_text(tex_resp: dict, token_budget: int | None = None, min_confidence: float | None = None) -> dict:
+    """
+    Сжатый OCR-текст из блоков Textract (LINE) в пределах бюджета токенов.
+    Возвращает {"text", "tokens", "lines_total", "lines_kept", "dropped": {"low_confidence", "duplicate", "noise", "budget"}}.
+    """
+    token_budget = OCR_TOKEN_BUDGET if token_budget is None else token_budget
+    min_confidence = OCR_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    dropped = {"low_confidence": 0, "duplicate": 0, "noise": 0, "budget": 0}
+    raw = [b for b in tex_resp.get("Blocks", []) or [] if b.get("BlockType") == "LINE" and b.get("Text")]
+
+    lines = []  # (текст, страница, важность)
+    seen = set()
+    for b in raw:
+        text = clean_line(b["Text"])
+        if not _TWO_ALNUM_RE.search(text):
+            dropped["noise"] += 1
+            continue
+        norm = text.casefold()
+        if norm in seen:
+            dropped["duplicate"] += 1
+            continue
+        keyword = bool(KEYWORD_RE.search(norm))
+        date = bool(DATE_RE.search(norm))
+        conf = b.get("Confidence")
+        # Строку с ключевым словом или датой оставляем и при низкой уверенности: без неё поле точно не извлечь
+        if isinstance(conf, (int, float)) and conf < min_confidence and not (keyword or date):
+            dropped["low_confidence"] += 1
+            continue
+        seen.add(norm)
+        lines.append([text, b.get("Page") or 1, 3 * keyword + 2 * date])
+
+    base = [line[2] for line in lines]
+    for i, line in enumerate(lines):
+        if i < HEAD_LINES and line[1] == lines[0][1]:
+            line[2] += 2
+        if any(base[j] for j in range(max(0, i - NEIGHBOR_LINES), min(len(lines), i + NEIGHBOR_LINES + 1)) if j != i):
+            line[2] += 1
+
+    # Строка стоит токенов вместе с переводом строки
+    cost = [estimate_text_tokens(line[0]) + 1 for line in lines]
+    if sum(cost) <= token_budget:
+        keep = set(range(len(lines)))
+    else:
+        keep, used = set(), 0
+        for i in sorted(range(len(lines)), key=lambda i: (-lines[i][2], i)):
+            if used + cost[i] <= token_budget:
+                keep.add(i)
+                used += cost[i]
+        dropped["budget"] = len(lines) - len(keep)
+
+    text = "\n".join(lines[i][0] for i in sorted(keep))
+    return {"text": text, "tokens": estimate_text_tokens(text), "lines_total": len(raw), "lines_kept": len(keep),
+            "dropped": dropped}
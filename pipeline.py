@@ -0,0 +1,1527 @@
+"""
+Конвейер обработки документа без зависимостей от Streamlit.
+
+загрузка в S3 -> Textract (текст + подписи) | превью PDF -> печать/QR -> извлечение полей (Bedrock)
+-> проверки МИБ -> extraction-*.json в S3.
+
+Используется Streamlit-приложением (main.py) и пакетной обработкой (batch.py).
+"""
+import os
+from datetime import datetime, date
+import re
+import json
+import io
+import time
+import random
+import secrets
+import sqlite3
+import threading
+import hashlib
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+
+# boto3, botocore.config и PyMuPDF (fitz) импортируются при первом использовании: импорт pipeline из main.py
+# не должен задерживать первый рендер формы (см. benchmarks/bench_startup.py)
+from botocore.exceptions import ClientError
+
+import catalog
+import ocrtext
+import ratelimit
+import tracing
+from jsonstream import JsonObjectStream
+import vision
+from vision import (
+    STAMP_INSTRUCTION,
+    STAMP_SCHEMA_FIELDS,
+    build_stamp_request_body,
+    detect_qr_local,
+    parse_stamp_response,
+    prepare_vision_content,
+)
+
+# ======================= ПАРАМЕТРЫ =========================
+AWS_PROFILE = ""   # профиль AWS из ~/.aws/credentials (оставьте пустым для env/role)
+AWS_REGION = "us-east-1"   # регион AWS
+BEDROCK_REGION = "us-east-1"  # регион Bedrock
+MODEL_ID = "anthropic.claude-3-7-sonnet-20250219-v1:0"  # используемая LLM модель с vision
+BUCKET_NAME = "loan-deferment-idp-test-tlek"  # имя S3-бакета
+KEY_PREFIX = "uploads/"  # базовый префикс для загрузок
+UPLOAD_ID_BACKEND = os.getenv("UPLOAD_ID_BACKEND", "s3")  # выдача upload_id: s3 (счётчик в S3) | sqlite (локальный файл) | ulid
+UPLOAD_ID_COUNTER_NAME = "_upload_id_counter.json"  # объект-счётчик внутри KEY_PREFIX (бэкенд s3)
+UPLOAD_ID_SQLITE_PATH = os.getenv("UPLOAD_ID_SQLITE_PATH", ".upload_ids.sqlite3")  # файл счётчика (бэкенд sqlite)
+
+# Общие настройки клиентов boto3 (botocore Config): пул соединений под параллельные стадии, keep-alive.
+# Повторы и снижение скорости при троттлинге — в общем ограничителе процесса (ratelimit.py), поэтому ретраи botocore выключены
+AWS_CLIENT_CONFIG = dict(
+    max_pool_connections=32,
+    retries={"total_max_attempts": 1, "mode": "standard"},
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=120,
+)
+# Загрузка документов в S3 (boto3 TransferConfig): файлы больше порога идут multipart-загрузкой, части параллельно
+S3_TRANSFER_CONFIG = dict(
+    multipart_threshold=int(os.getenv("IDP_S3_MULTIPART_THRESHOLD_MB", "8")) * 1024 * 1024,
+    multipart_chunksize=int(os.getenv("IDP_S3_MULTIPART_CHUNK_MB", "8")) * 1024 * 1024,
+    max_concurrency=int(os.getenv("IDP_S3_UPLOAD_CONCURRENCY", "4")),
+    use_threads=True,
+)
+LLM_MODE = os.getenv("IDP_LLM_MODE", "split")  # split: два вызова Bedrock (печать/QR + поля) | combined: один мультимодальный вызов
+# Потоковые ответы Bedrock (InvokeModelWithResponseStream): поля JSON разбираются по мере поступления,
+# чтение прекращается после закрывающей '}'. Требует права bedrock:InvokeModelWithResponseStream.
+BEDROCK_STREAMING = os.getenv("IDP_BEDROCK_STREAMING", "0") == "1"
+# Кэширование префикса промпта Anthropic (cache_control): статичные инструкции и схема ответа вынесены в system,
+# повторные запросы читают префикс из кэша. Bedrock кэширует префикс от 1024 токенов (Claude 3.7 Sonnet); текущие
+# инструкции короче, поэтому по умолчанию выключено — инструкция идёт в сообщении пользователя, как без кэша
+BEDROCK_PROMPT_CACHE = os.getenv("IDP_BEDROCK_PROMPT_CACHE", "0") == "1"
+
+# Кэш результатов по SHA-256 файла: повторная загрузка того же документа не вызывает Textract и Bedrock
+RESULT_CACHE_ENABLED = os.getenv("IDP_RESULT_CACHE", "1") != "0"
+RESULT_CACHE_PATH = os.getenv("IDP_RESULT_CACHE_PATH", ".result_cache.sqlite3")  # локальный уровень (SQLite)
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("IDP_RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("IDP_RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_S3_PREFIX = os.getenv("IDP_RESULT_CACHE_S3_PREFIX", "")  # общий уровень в S3, например "cache/results/" (пусто — выключен)
+
+# Textract: синхронный AnalyzeDocument принимает до 10 МБ байтами; интервалы опроса асинхронной задачи
+TEXTRACT_SYNC_MAX_BYTES = 10 * 1024 * 1024
+TEXTRACT_POLL_INITIAL_SECONDS = 0.5
+TEXTRACT_POLL_MAX_SECONDS = 5.0
+
+# Предварительная локальная проверка файла до загрузки в S3 и вызовов AWS (см. preflight_document).
+# Пределы Textract: PDF до 500 МБ, изображения до 10 МБ и не больше 10000 пикселей по стороне.
+PREFLIGHT_ENABLED = os.getenv("IDP_PREFLIGHT", "1") != "0"
+PREFLIGHT_MAX_PDF_BYTES = int(os.getenv("IDP_PREFLIGHT_MAX_PDF_BYTES", str(50 * 1024 * 1024)))
+PREFLIGHT_MAX_IMAGE_BYTES = 10 * 1024 * 1024
+PREFLIGHT_MIN_IMAGE_SIDE = int(os.getenv("IDP_PREFLIGHT_MIN_IMAGE_SIDE", "150"))  # меньше — текст не читается
+PREFLIGHT_MAX_IMAGE_SIDE = 10000
+PREFLIGHT_MAX_PAGES = 1  # правило МИБ: один документ (одна страница) в файле
+
+# Промежуточные результаты в папке документа (intermediate/*.json.gz): сырые блоки Textract и ответы LLM.
+# По ним process_document(replay=...) пересобирает результат без повторного OCR (и без Bedrock — для проверок).
+INTERMEDIATES_ENABLED = os.getenv("IDP_INTERMEDIATES", "1") != "0"
+REPLAY_MODES = ("textract", "checks")
+
+# Inference Profile for Claude 3.7 Sonnet (can be ID or ARN). ARN is recommended.
+DEFAULT_INFERENCE_PROFILE_ID = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+DEFAULT_INFERENCE_PROFILE_ARN = "arn:aws:bedrock:us-east-1:183295407481:inference-profile/us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+
+
+# ======================= КОНСТАНТЫ И УТИЛИТЫ =========================
+# Варианты типа документа (отображаемые метки)
+DOC_TYPE_OPTIONS = [
+    "Лист временной нетрудоспособности (больничный лист)",
+    "Приказ о выходе в декретный отпуск по уходу за ребенком",
+    "Справка о выходе в декретный отпуск по уходу за ребенком",
+]
+
+# Маппинг из меток UI к коротким значениям
+DOC_TYPE_VALUE_MAP = {
+    "Лист временной нетрудоспособности (больничный лист)": "Лист",
+    "Приказ о выходе в декретный отпуск по уходу за ребенком": "Приказ",
+    "Справка о выходе в декретный отпуск по уходу за ребенком": "Справка",
+}
+
+# Сообщения верификации МИБ (успешные тексты для зелёных статусов)
+MIB_RULES = {
+    "ФИО заявителя и ФИО в документе должны совпадать": {
+        "success": "ФИО совпадает.",
+    },
+    "Наименование документа": {
+        "success": "Тип документа подтверждён.",
+    },
+    "Актуальная дата": {
+        "success": "Документ в пределах срока актуальности.",
+    },
+    "Наличие QR или печати": {
+        "success": "Обнаружены печать и/или QR.",
+    },
+    "Прикрепленный файл должен содержать один документ": {
+        "success": "Загружен один документ (1 страница PDF).",
+    },
+}
+
+# Сроки актуальности по типу документа (календарные дни)
+VALIDITY_DAYS = {"Лист": 180, "Приказ": 30, "Справка": 10}
+
+# Нормализация ФИО и разбор дат: регулярные выражения и форматы собираются один раз при импорте
+_NAME_JUNK_RE = re.compile(r"[^a-zа-яё\s-]")
+_SPACES_RE = re.compile(r"\s+")
+DATE_FORMATS = ("%d.%m.%Y", "%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y")
+
+def norm_name(val: str | None) -> str | None:
+    """Нормализация ФИО: тримминг, нижний регистр, удаление лишних символов."""
+    if not isinstance(val, str) or not val.strip():
+        return None
+    s = _SPACES_RE.sub(" ", val.strip()).lower()
+    s = _NAME_JUNK_RE.sub("", s)
+    s = _SPACES_RE.sub(" ", s)
+    return s
+
+def format_date_ddmmyyyy(val) -> str:
+    """Единое форматирование даты для отображения: DD/MM/YYYY. Принимает str | datetime | date | None."""
+    d: date | None = None
+    if isinstance(val, str):
+        d = parse_date_safe(val)
+    elif isinstance(val, datetime):
+        d = val.date()
+    elif isinstance(val, date):
+        d = val
+    if d is None:
+        return "—"
+    return d.strftime("%d/%m/%Y")
+
+# Сообщения и коды ошибок МИБ (для отображения/интеграции)
+MIB_ERRORS = {
+    # Ключи соответствуют заголовкам проверок/полей в UI
+    "Наименование документа": {
+        "message": "Не верный формат документа. Пожалуйста, проверьте правильность выбранных данных",
+        "code": "01",
+    },
+    "Актуальная дата": {
+        "message": "Не верный формат документа. Загрузите пожалуйста обновленный документ с актуальной датой. Пожалуйста проверьте правильность выбранных данных",
+        "code": "03",
+    },
+    "Прикрепленный файл должен содержать один документ": {
+        "message": "Не верный формат документа. Пожалуйста прикрепите только один документ в одном файле",
+        "code": "04",
+    },
+    "ФИО заявителя и ФИО в документе должны совпадать": {
+        "message": "Не верный формат документа. Некоторые документы не относятся к заявителю. Пожалуйста проверьте правильность выбранных данных.",
+        "code": "05",
+    },
+    "Наличие QR или печати": {
+        "message": "Не верный формат документа. Некоторые документы не содержат в себе печать/QR подтверждения. Пожалуйста проверьте правильность выбранных данных",
+        "code": "06",
+    },
+    # Файл не прошёл предварительную проверку (пустой, повреждён, защищён паролем, не PDF/JPEG/PNG, неподходящие
+    # размеры изображения) — не путать с 01: тип документа при этом не проверялся
+    "Файл документа": {
+        "message": "Не удалось прочитать файл документа. Пожалуйста загрузите неповреждённый PDF, JPEG или PNG без пароля и в хорошем качестве",
+        "code": "07",
+    },
+}
+
+def norm_doc_type(val: str | None) -> str | None:
+    """Приведение типа документа к одному из значений: Лист | Приказ | Справка."""
+    if not isinstance(val, str) or not val.strip():
+        return None
+    s = val.strip().lower()
+    if "лист" in s:
+        return "Лист"
+    if "приказ" in s:
+        return "Приказ"
+    if "справк" in s:
+        return "Справка"
+    if s in ("лист", "приказ", "справка"):
+        return s.capitalize()
+    return None
+
+
+def parse_date_safe(s: str | None):
+    """Пробуем распарсить дату в нескольких популярных форматах. Возвращает date или None."""
+    if not isinstance(s, str) or not s.strip():
+        return None
+    s = s.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date()
+        except Exception:
+            pass
+    return None
+
+
+def parse_json_relaxed(s: str) -> dict | None:
+    """Пытаемся распарсить JSON. Если не получается, вырезаем фрагмент между первой '{' и последней '}'."""
+    try:
+        return json.loads(s)
+    except Exception:
+        start = s.find("{")
+        end = s.rfind("}")
+        if start != -1 and end != -1 and end > start:
+            try:
+                return json.loads(s[start:end + 1])
+            except Exception:
+                return None
+        return None
+
+# ===================== ФУНКЦИИ ============================
+# Реестр клиентов boto3 на уровне процесса
+_AWS_SESSIONS: dict = {}
+_AWS_CLIENTS: dict = {}
+_AWS_CLIENTS_LOCK = threading.Lock()
+_AWS_WARMED: set = set()
+_BOTO_CONFIGS: dict = {}
+
+def _get_boto3_session(profile: str | None, region_name: str | None):
+    # Вызывается под _AWS_CLIENTS_LOCK: сессии boto3 не потокобезопасны
+    import boto3
+
+    key = (profile or None, region_name or None)
+    if key not in _AWS_SESSIONS:
+        _AWS_SESSIONS[key] = boto3.session.Session(profile_name=profile or None, region_name=region_name or None)
+    return _AWS_SESSIONS[key]
+
+def _aws_client_config():
+    """botocore Config по AWS_CLIENT_CONFIG, один на процесс. Вызывается под _AWS_CLIENTS_LOCK."""
+    if "client" not in _BOTO_CONFIGS:
+        from botocore.config import Config
+
+        _BOTO_CONFIGS["client"] = Config(**AWS_CLIENT_CONFIG)
+    return _BOTO_CONFIGS["client"]
+
+def _s3_transfer_config():
+    """boto3 TransferConfig по S3_TRANSFER_CONFIG, один на процесс."""
+    if "s3_transfer" not in _BOTO_CONFIGS:
+        from boto3.s3.transfer import TransferConfig
+
+        _BOTO_CONFIGS["s3_transfer"] = TransferConfig(**S3_TRANSFER_CONFIG)
+    return _BOTO_CONFIGS["s3_transfer"]
+
+def get_aws_client(service: str, profile: str | None, region_name: str | None):
+    """
+    Реестр клиентов boto3 на уровне процесса: один клиент на (сервис, профиль, регион).
+    Клиенты потокобезопасны и переиспользуются между rerun'ами и сессиями вместе с пулом соединений.
+    """
+    key = (service, profile or None, region_name or None)
+    client = _AWS_CLIENTS.get(key)
+    if client is None:
+        with _AWS_CLIENTS_LOCK:
+            client = _AWS_CLIENTS.get(key)
+            if client is None:
+                client = _get_boto3_session(profile, region_name).client(service, config=_aws_client_config())
+                # Все вызовы клиента проходят через общие лимиты и повторы процесса и учитываются в спанах
+                ratelimit.install(client)
+                tracing.install(client)
+                _AWS_CLIENTS[key] = client
+    return client
+
+def warm_aws_clients(profile: str | None, aws_region: str | None, bedrock_region: str | None, bucket: str | None):
+    """
+    В фоне создаёт клиенты, открывает TLS-соединение к S3 и импортирует PyMuPDF и OpenCV (один раз на процесс).
+    Импорт boto3 и загрузка моделей сервисов (~0.2 с) не задерживают первый рендер; обработка, начатая до конца
+    прогрева, получает те же клиенты из реестра get_aws_client.
+    """
+    key = (profile or None, aws_region, bedrock_region, bucket)
+    with _AWS_CLIENTS_LOCK:
+        if key in _AWS_WARMED:
+            return True
+        _AWS_WARMED.add(key)
+
+    def _open_connection():
+        try:
+            s3 = get_aws_client("s3", profile, aws_region)
+            get_aws_client("textract", profile, aws_region)
+            get_aws_client("bedrock-runtime", profile, bedrock_region)
+            if bucket:
+                s3.head_bucket(Bucket=bucket)
+        except Exception:
+            # Прогрев не обязателен: ошибки (нет прав/учётных данных) проявятся при реальной загрузке
+            pass
+        vision.preload_optional_modules()
+
+    threading.Thread(target=_open_connection, name="idp-aws-warmup", daemon=True).start()
+    return True
+
+def get_s3_client(profile, region_name):
+    return get_aws_client("s3", profile, region_name)
+
+def scan_max_upload_id(s3_client, bucket, prefix) -> int:
+    """Полный перебор префиксов upload_id_XXX/ в S3. Используется только для первичной инициализации счётчика."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    existing_max = 0
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        for cp in page.get("CommonPrefixes", []) or []:
+            p = cp.get("Prefix", "")
+            m = re.search(r"upload_id_(\d{3,})/\Z", p)
+            if m:
+                existing_max = max(existing_max, int(m.group(1)))
+    return existing_max
+
+def _allocate_upload_id_s3(s3_client, bucket, prefix, max_attempts: int = 10) -> int:
+    """
+    Атомарный счётчик в S3-объекте на условной записи (If-Match / If-None-Match).
+    При отсутствии объекта счётчик один раз инициализируется текущим максимумом из листинга.
+    """
+    counter_key = f"{prefix}{UPLOAD_ID_COUNTER_NAME}"
+    for attempt in range(max_attempts):
+        try:
+            obj = s3_client.get_object(Bucket=bucket, Key=counter_key)
+            last_id = int(json.loads(obj["Body"].read()).get("last_id", 0))
+            cond = {"IfMatch": obj["ETag"]}
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+            # Миграция: счётчика ещё нет — засеваем его максимумом существующих папок
+            last_id = scan_max_upload_id(s3_client, bucket, prefix)
+            cond = {"IfNoneMatch": "*"}
+        next_id = last_id + 1
+        try:
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=counter_key,
+                Body=json.dumps({"last_id": next_id, "updated_at": datetime.utcnow().isoformat() + "Z"}).encode("utf-8"),
+                ContentType="application/json",
+                **cond,
+            )
+            return next_id
+        except ClientError as e:
+            # Счётчик изменила другая сессия — перечитываем и пробуем снова
+            if e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+            time.sleep(random.random() * 0.05 * (attempt + 1))
+    raise Exception("Не удалось выделить upload_id: счётчик постоянно изменяется другими сессиями")
+
+def _allocate_upload_id_sqlite(db_path: str, prefix: str, seed) -> int:
+    """Атомарный счётчик в локальном SQLite (для развёртывания на одном хосте). seed() вызывается один раз."""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS upload_counter (prefix TEXT PRIMARY KEY, last_id INTEGER NOT NULL)")
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT last_id FROM upload_counter WHERE prefix = ?", (prefix,)).fetchone()
+        if row is None:
+            next_id = seed() + 1
+            conn.execute("INSERT INTO upload_counter (prefix, last_id) VALUES (?, ?)", (prefix, next_id))
+        else:
+            next_id = row[0] + 1
+            conn.execute("UPDATE upload_counter SET last_id = ? WHERE prefix = ?", (next_id, prefix))
+        conn.execute("COMMIT")
+        return next_id
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+_CROCKFORD32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+def new_ulid() -> str:
+    """ULID: 48 бит времени (мс) + 80 бит случайности, Crockford base32 — сортируется по времени."""
+    value = (int(time.time() * 1000) << 80) | secrets.randbits(80)
+    return "".join(_CROCKFORD32[(value >> shift) & 0x1F] for shift in range(125, -1, -5))
+
+def get_next_upload_folder(s3_client, bucket, prefix, backend: str | None = None):
+    backend = (backend or UPLOAD_ID_BACKEND or "s3").strip().lower()
+    try:
+        if backend == "ulid":
+            return f"{prefix}upload_id_{new_ulid()}/"
+        if backend == "sqlite":
+            next_id = _allocate_upload_id_sqlite(
+                UPLOAD_ID_SQLITE_PATH, f"{bucket}/{prefix}", lambda: scan_max_upload_id(s3_client, bucket, prefix)
+            )
+        else:
+            next_id = _allocate_upload_id_s3(s3_client, bucket, prefix)
+        return f"{prefix}upload_id_{next_id:03d}/"
+    except Exception:
+        # Уникальный идентификатор без обращения к хранилищу счётчика
+        return f"{prefix}upload_id_{new_ulid()}/"
+
+def textract_blocks_to_text(tex_resp: dict) -> str:
+    lines = [b.get("Text", "") for b in tex_resp.get("Blocks", []) if b.get("BlockType") == "LINE"]
+    return "\n".join([ln for ln in lines if ln])
+
+def llm_input_text(tex_resp: dict) -> str:
+    """OCR-текст для запроса полей: сжатие по строкам в бюджет токенов (ocrtext.py) или прежняя обрезка по символам."""
+    if not ocrtext.OCR_COMPACT:
+        return textract_blocks_to_text(tex_resp)[:ocrtext.OCR_LEGACY_MAX_CHARS]
+    compact = ocrtext.compact_ocr_text(tex_resp)
+    span = tracing.current_span()
+    if span is not None:
+        span.set(ocr_lines=compact["lines_total"], ocr_lines_kept=compact["lines_kept"], ocr_tokens=compact["tokens"])
+    return compact["text"]
+
+def pdf_page_count(pdf_bytes: bytes) -> int | None:
+    """Количество страниц PDF по байтам в памяти (без рендеринга). None, если PyMuPDF недоступен или PDF не читается."""
+    fitz = vision.optional_module("fitz")
+    if fitz is None or not pdf_bytes:
+        return None
+    try:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            return len(doc)
+    except Exception:
+        return None
+
+def sniff_file_format(file_bytes: bytes) -> str | None:
+    """Формат файла по сигнатуре (magic bytes): pdf | jpeg | png | None."""
+    head = bytes(file_bytes[:1024])
+    if b"%PDF-" in head:
+        return "pdf"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    return None
+
+def image_dimensions(file_bytes: bytes, fmt: str) -> tuple[int, int] | None:
+    """(ширина, высота) изображения из заголовка PNG/JPEG без декодирования пикселей."""
+    try:
+        if fmt == "png":
+            return int.from_bytes(file_bytes[16:20], "big"), int.from_bytes(file_bytes[20:24], "big")
+        if fmt == "jpeg":
+            # Идём по сегментам JPEG до маркера SOFn (кроме DHT/JPG/DAC)
+            i = 2
+            while i + 9 < len(file_bytes):
+                if file_bytes[i] != 0xFF:
+                    i += 1
+                    continue
+                marker = file_bytes[i + 1]
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+                    i += 1 if marker == 0xFF else 2
+                    continue
+                length = int.from_bytes(file_bytes[i + 2:i + 4], "big")
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    return int.from_bytes(file_bytes[i + 7:i + 9], "big"), int.from_bytes(file_bytes[i + 5:i + 7], "big")
+                i += 2 + length
+    except Exception:
+        return None
+    return None
+
+def preflight_document(file_bytes: bytes, filename: str, content_type: str | None) -> dict:
+    """
+    Локальная проверка загруженного файла до S3 и AWS: сигнатура формата и её соответствие расширению/MIME,
+    размер, число страниц PDF (и шифрование), размеры изображения, SHA-256 содержимого (ключ кэша результатов).
+    Возвращает {"ok", "format", "is_pdf", "size_bytes", "sha256", "page_count", "width", "height", "issues", "checks",
+    "errors"};
+    issues — [{"check", "message"}], errors — ошибки МИБ (04 — больше одной страницы, 07 — файл не читается или
+    не подходит по формату/размерам).
+    """
+    size = len(file_bytes or b"")
+    fmt = sniff_file_format(file_bytes or b"")
+    declared_pdf = ("pdf" in (content_type or "").lower()) or (filename or "").lower().endswith(".pdf")
+    result = {"ok": True, "format": fmt, "is_pdf": fmt == "pdf" if fmt else declared_pdf, "size_bytes": size,
+              "sha256": hashlib.sha256(file_bytes or b"").hexdigest(), "page_count": None, "width": None, "height": None, "issues": []}
+
+    def _issue(check: str, message: str):
+        result["issues"].append({"check": check, "message": message})
+
+    if size == 0:
+        _issue("size", "Пустой файл")
+    elif fmt is None:
+        _issue("format", "Неподдерживаемый формат файла (ожидается PDF или JPEG/PNG)")
+    elif declared_pdf != (fmt == "pdf"):
+        _issue("format", f"Содержимое файла ({fmt}) не соответствует расширению или типу файла")
+    elif fmt == "pdf":
+        if size > PREFLIGHT_MAX_PDF_BYTES:
+            _issue("size", f"Размер PDF {size} байт превышает {PREFLIGHT_MAX_PDF_BYTES}")
+        fitz = vision.optional_module("fitz")
+        if fitz is not None:
+            try:
+                with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+                    if doc.needs_pass:
+                        _issue("pdf_encrypted", "PDF защищён паролем")
+                    else:
+                        result["page_count"] = len(doc)
+            except Exception as e:
+                _issue("pdf_unreadable", f"PDF не читается: {e}")
+            pc = result["page_count"]
+            if pc == 0:
+                _issue("pages", "PDF не содержит страниц")
+            elif isinstance(pc, int) and pc > PREFLIGHT_MAX_PAGES:
+                _issue("pages", f"PDF содержит {pc} страниц(ы)")
+    else:
+        if size > PREFLIGHT_MAX_IMAGE_BYTES:
+            _issue("size", f"Размер изображения {size} байт превышает {PREFLIGHT_MAX_IMAGE_BYTES}")
+        dims = image_dimensions(file_bytes, fmt)
+        if dims is None:
+            _issue("image_dimensions", "Не удалось прочитать размеры изображения")
+        else:
+            result["width"], result["height"] = dims
+            if min(dims) < PREFLIGHT_MIN_IMAGE_SIDE or max(dims) > PREFLIGHT_MAX_IMAGE_SIDE:
+                _issue("image_dimensions", f"Размеры изображения {dims[0]}x{dims[1]} вне допустимых "
+                                           f"({PREFLIGHT_MIN_IMAGE_SIDE}..{PREFLIGHT_MAX_IMAGE_SIDE} пикселей)")
+
+    result["ok"] = not result["issues"]
+    pc = result["page_count"]
+    is_pdf = result["is_pdf"]
+    result["checks"] = {
+        "file_valid": not any(i["check"] != "pages" for i in result["issues"]),
+        "pdf_has_one_page": (pc == 1) if is_pdf and isinstance(pc, int) else None,
+        "pdf_page_count": pc if is_pdf else None,
+    }
+    errors = []
+    for field_key, failed in (
+        ("Прикрепленный файл должен содержать один документ", any(i["check"] == "pages" for i in result["issues"])),
+        ("Файл документа", not result["checks"]["file_valid"]),
+    ):
+        err = MIB_ERRORS.get(field_key)
+        if failed and err:
+            errors.append({"field": field_key, "code": err.get("code"), "message": err.get("message")})
+    result["errors"] = errors
+    return result
+
+# --- Textract AnalyzeDocument (SIGNATURES): один проход даёт и строки текста, и подписи ---
+def analyze_document_textract(textract_client, bucket: str, key: str, content_type: str,
+                              file_bytes: bytes | None = None, page_count: int | None = None) -> dict:
+    """
+    Один вызов Textract на документ: блоки LINE идут в OCR-текст, блоки SIGNATURE — в детекцию подписей.
+    Изображения и одностраничные PDF — синхронный analyze_document (по байтам из памяти, если они переданы),
+    многостраничные PDF — асинхронный start_document_analysis с адаптивным опросом.
+    Возвращает {"Blocks": [...]} (блоки всех страниц); ошибки пробрасываются.
+    """
+    is_pdf = ("pdf" in (content_type or "").lower()) or key.lower().endswith(".pdf")
+    if not is_pdf or page_count == 1:
+        if file_bytes and len(file_bytes) <= TEXTRACT_SYNC_MAX_BYTES:
+            document = {"Bytes": file_bytes}
+        else:
+            document = {"S3Object": {"Bucket": bucket, "Name": key}}
+        return textract_client.analyze_document(Document=document, FeatureTypes=["SIGNATURES"])
+
+    start = textract_client.start_document_analysis(
+        DocumentLocation={"S3Object": {"Bucket": bucket, "Name": key}},
+        FeatureTypes=["SIGNATURES"],
+    )
+    job_id = start["JobId"]
+    pages = []
+
+    def get_document_analysis(job_id, next_token=None):
+        # Троттлинг и повторы обрабатываются общим ограничителем (ratelimit.py)
+        params = {"JobId": job_id, "MaxResults": 1000}
+        if next_token:
+            params["NextToken"] = next_token
+        return textract_client.get_document_analysis(**params)
+
+    # Опрос начинается с короткого интервала и растёт до TEXTRACT_POLL_MAX_SECONDS
+    poll_interval = TEXTRACT_POLL_INITIAL_SECONDS
+    with tracing.span("textract_poll") as poll_span:
+        while True:
+            resp = get_document_analysis(job_id)
+            status = resp["JobStatus"]
+            if status == "SUCCEEDED":
+                pages.append(resp)
+                next_token = resp.get("NextToken")
+                while next_token:
+                    nxt = get_document_analysis(job_id, next_token=next_token)
+                    pages.append(nxt)
+                    next_token = nxt.get("NextToken")
+                break
+            elif status == "FAILED":
+                raise Exception("Textract анализ не удался")
+            else:
+                if poll_span is not None:
+                    poll_span.add("polls", 1)
+                time.sleep(poll_interval * (0.8 + 0.4 * random.random()))
+                poll_interval = min(poll_interval * 1.6, TEXTRACT_POLL_MAX_SECONDS)
+
+    return {"Blocks": [b for page in pages for b in (page.get("Blocks", []) or [])]}
+
+def extract_signatures(tex_resp: dict) -> dict:
+    """Подписи из блоков SIGNATURE ответа Textract. Формат как в _signatures: {"signatures": [...], "error": None}."""
+    results = []
+    for b in tex_resp.get("Blocks", []) or []:
+        if b.get("BlockType") == "SIGNATURE":
+            results.append({"confidence": b.get("Confidence"), "geometry": b.get("Geometry"), "page": b.get("Page")})
+    return {"signatures": results, "error": None}
+
+def detect_stamp_llm(bedrock_client, model_id: str, images: list[dict], inference_profile: str | None = None,
+                     on_field=None):
+    """
+    images: список элементов content для Anthropic messages API вида
+      {"type":"image", "source": {"type":"base64","media_type":"image/jpeg","data":"..."}}
+    on_field(name, value): поля ответа по мере поступления (только в потоковом режиме).
+    Возвращает: {"stamp_present", "stamp_confidence", "qr_present", "qr_confidence", "raw": str, "error": None|str}
+    """
+    try:
+        body = build_stamp_request_body(images, prompt_cache=BEDROCK_PROMPT_CACHE)
+        data = _invoke_with_inference_profile(bedrock_client, body, model_id=model_id, inference_profile=inference_profile,
+                                              on_field=on_field)
+        text = data.get("content", [{}])[0].get("text", "")
+        return parse_stamp_response(text)
+    except Exception as e:
+        return {"present": None, "confidence": None, "reason": None, "raw": "", "error": str(e)}
+
+def render_pdf_previews(pdf_bytes: bytes, max_pages: int = 3, zoom: float = 2.0) -> dict:
+    """
+    Рендер первых max_pages страниц PDF в PNG прямо из байтов в памяти (без S3 и временных файлов).
+    Возвращает dict: {"images": [bytes PNG, ...], "s3_keys": [], "page_count": int, "error": None|str}
+    """
+    fitz = vision.optional_module("fitz")
+    if fitz is None:
+        return {"images": [], "s3_keys": [], "page_count": 0, "error": "PyMuPDF (fitz) не установлен"}
+    try:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            total_pages = len(doc)
+            mat = fitz.Matrix(zoom, zoom)
+            images = []
+            for i in range(min(total_pages, max_pages)):
+                pix = doc.load_page(i).get_pixmap(matrix=mat, colorspace=fitz.csRGB, alpha=False)
+                images.append(pix.tobytes("png"))
+        return {"images": images, "s3_keys": [], "page_count": total_pages, "error": None}
+    except Exception as e:
+        return {"images": [], "s3_keys": [], "page_count": 0, "error": str(e)}
+
+def document_folder(key: str) -> str:
+    """Префикс папки документа в S3 (с завершающим "/"); для ключа в корне бакета — пустая строка."""
+    return key.rsplit("/", 1)[0] + "/" if "/" in key else ""
+
+def preview_keys(key: str, count: int) -> list[str]:
+    """Ключи PNG превью первых count страниц в папке документа: previews/page_XXX.png."""
+    folder = document_folder(key)
+    return [f"{folder}previews/page_{i + 1:03d}.png" for i in range(count)]
+
+def store_previews_async(s3_client, bucket: str, key: str, images: list[bytes]) -> list[str]:
+    """
+    Фоновая загрузка PNG превью в S3 рядом с исходным файлом: previews/page_XXX.png.
+    Возвращает ключи S3 сразу, не дожидаясь окончания загрузки.
+    """
+    s3_keys = preview_keys(key, len(images))
+    for img, preview_key in zip(images, s3_keys):
+        submit_background(
+            s3_client.upload_fileobj,
+            Fileobj=io.BytesIO(img),
+            Bucket=bucket,
+            Key=preview_key,
+            ExtraArgs={"ContentType": "image/png"},
+        )
+    return s3_keys
+
+def intermediate_key(key: str, name: str) -> str:
+    """Ключ промежуточного результата в папке документа: intermediate/<name>.json.gz."""
+    return f"{document_folder(key)}intermediate/{name}.json.gz"
+
+def store_intermediate_async(s3_client, bucket: str, key: str, name: str, data: dict) -> str:
+    """Сжимает data (JSON + gzip) в вызывающем потоке и загружает в S3 в фоне. Возвращает ключ объекта."""
+    obj_key = intermediate_key(key, name)
+    body = gzip.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"), compresslevel=6)
+    submit_background(
+        s3_client.upload_fileobj,
+        Fileobj=io.BytesIO(body),
+        Bucket=bucket,
+        Key=obj_key,
+        ExtraArgs={"ContentType": "application/json", "ContentEncoding": "gzip"},
+    )
+    return obj_key
+
+def copy_intermediate_async(s3_client, bucket: str, source: dict, key: str, name: str) -> str:
+    """
+    Серверная копия промежуточного результата из другой папки (source: {"bucket", "key"}) в папку документа,
+    в фоне. Используется при попадании в кэш результатов: Textract не вызывался, но replay="textract" по новой
+    папке должен работать. Исходный объект мог ещё загружаться в фоне (повторная загрузка сразу после первой),
+    поэтому NoSuchKey повторяется несколько раз. Возвращает ключ объекта.
+    """
+    obj_key = intermediate_key(key, name)
+
+    def _copy():
+        for attempt in range(3):
+            try:
+                return s3_client.copy_object(Bucket=bucket, Key=obj_key,
+                                             CopySource={"Bucket": source["bucket"], "Key": source["key"]})
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404") or attempt == 2:
+                    raise
+                time.sleep(1 + attempt)
+
+    submit_background(_copy)
+    return obj_key
+
+def load_intermediate(s3_client, bucket: str, key: str, name: str) -> dict | None:
+    """Промежуточный результат документа из S3 или None, если он не сохранялся."""
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=intermediate_key(key, name))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(gzip.decompress(obj["Body"].read()))
+
+# Схема полей и правила извлечения — общие для раздельного и совмещённого режимов LLM
+EXTRACTION_SCHEMA_FIELDS = (
+    "  \"ФИО заявителя\": string | null,\n"
+    "  \"Тип документа\": \"Лист\" | \"Приказ\" | \"Справка\" | null,\n"
+    "  \"Наименование документа\": string | null,\n"
+    "  \"Дата выдачи документа\": string | null,\n"
+    "  \"Дата начала отпуска\": string | null,\n"
+    "  \"Дата окончания отпуска\": string | null"
+)
+EXTRACTION_RULES = (
+    "Правила для определения поля 'Тип документа':\n"
+    "- Если 'Наименование документа' содержит 'Лист временной нетрудоспособности', то 'Тип документа' = 'Лист'.\n"
+    "- Если 'Наименование документа' содержит 'Приказ', то 'Тип документа' = 'Приказ'.\n"
+    "- Если 'Наименование документа' содержит 'Справка', то 'Тип документа' = 'Справка'.\n"
+    "- Если невозможно определить, то 'Тип документа' = null.\n\n"
+    "Форматирование дат:\n"
+    "- Все значения в полях 'Дата выдачи документа', 'Дата начала отпуска' и 'Дата окончания отпуска' должны быть приведены к формату DD/MM/YYYY.\n\n"
+)
+
+# Статичные инструкции (system, кэшируемый префикс); в сообщении пользователя — только OCR-текст и изображения
+EXTRACTION_INSTRUCTION = (
+    "Извлеки следующую информацию из текста.\n"
+    "Верни результат строго в формате JSON:\n"
+    "{\n"
+    + EXTRACTION_SCHEMA_FIELDS + "\n"
+    "}\n\n"
+    + EXTRACTION_RULES
+)
+COMBINED_INSTRUCTION = (
+    "Перед тобой изображения страниц отсканированного документа и распознанный (OCR) текст этого документа.\n"
+    "1) Извлеки из текста поля документа.\n"
+    "2) По изображениям страниц определи наличие печати (штамп: круглая или прямоугольная) и QR-кода (квадратный матричный код).\n"
+    "Верни результат строго в формате JSON без пояснений:\n"
+    "{\n"
+    + EXTRACTION_SCHEMA_FIELDS + ",\n"
+    + STAMP_SCHEMA_FIELDS + "\n"
+    "}\n\n"
+    + EXTRACTION_RULES
+)
+OCR_TEXT_HEADER = "Текст для анализа:\n"
+
+def build_prompt_russian(extracted_text: str) -> str:
+    """Промпт извлечения полей одной строкой (для моделей без system)."""
+    return EXTRACTION_INSTRUCTION + OCR_TEXT_HEADER + extracted_text
+
+def build_prompt_combined(extracted_text: str) -> str:
+    """Промпт совмещённого режима: поля из OCR-текста + печать/QR по приложенным изображениям страниц."""
+    return COMBINED_INSTRUCTION + OCR_TEXT_HEADER + extracted_text
+
+def system_prompt(text: str) -> list[dict]:
+    """Блоки system запроса Anthropic с точкой кэширования префикса (cache_control)."""
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+def extract_fields_llm(bedrock_client, model_id: str, extracted_text: str, inference_profile: str | None = None,
+                       on_field=None) -> dict | None:
+    """Раздельный режим: поля документа по OCR-тексту (при IDP_BEDROCK_PROMPT_CACHE=1 инструкция — в system)."""
+    if BEDROCK_PROMPT_CACHE:
+        text = call_bedrock_invoke(model_id, OCR_TEXT_HEADER + extracted_text, bedrock_client,
+                                   inference_profile=inference_profile, on_field=on_field, system=EXTRACTION_INSTRUCTION)
+    else:
+        text = call_bedrock_invoke(model_id, build_prompt_russian(extracted_text), bedrock_client,
+                                   inference_profile=inference_profile, on_field=on_field)
+    return parse_json_relaxed(text)
+
+def extract_combined_llm(bedrock_client, model_id: str, images: list[dict], extracted_text: str, inference_profile: str | None = None,
+                         on_field=None):
+    """
+    Совмещённый режим: один мультимодальный запрос (изображения страниц + OCR-текст).
+    on_field(name, value): поля ответа по мере поступления (только в потоковом режиме).
+    Возвращает (поля документа: dict | None, результат печати/QR в формате detect_stamp_llm).
+    Ошибка вызова Bedrock пробрасывается — как и при раздельном извлечении полей.
+    """
+    prompt = (OCR_TEXT_HEADER + extracted_text) if BEDROCK_PROMPT_CACHE else build_prompt_combined(extracted_text)
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1024,
+        "temperature": 0,
+        "messages": [
+            {
+                "role": "user",
+                "content": images + [{"type": "text", "text": prompt}],
+            }
+        ],
+    }
+    if BEDROCK_PROMPT_CACHE:
+        body["system"] = system_prompt(COMBINED_INSTRUCTION)
+    data = _invoke_with_inference_profile(bedrock_client, body, model_id=model_id, inference_profile=inference_profile,
+                                          on_field=on_field)
+    text = data.get("content", [{}])[0].get("text", "")
+    parsed = parse_json_relaxed(text)
+    if not isinstance(parsed, dict):
+        stamps = {"stamp_present": None, "stamp_confidence": None, "qr_present": None, "qr_confidence": None, "raw": text, "error": "LLM returned non-JSON"}
+        return None, stamps
+    stamps = {
+        "stamp_present": parsed.pop("stamp_present", None),
+        "stamp_confidence": parsed.pop("stamp_confidence", None),
+        "qr_present": parsed.pop("qr_present", None),
+        "qr_confidence": parsed.pop("qr_confidence", None),
+        "raw": text,
+        "error": None,
+    }
+    return parsed, stamps
+
+def get_bedrock_client(profile: str | None, region_name: str | None):
+    return get_aws_client("bedrock-runtime", profile, region_name)
+
+def resolve_inference_profile(override: str | None = None) -> str | None:
+    # Порядок приоритета: явное значение (например, из UI) -> ENV -> defaults
+    ip = (
+        override
+        or os.getenv("BEDROCK_INFERENCE_PROFILE")
+        or DEFAULT_INFERENCE_PROFILE_ARN
+        or DEFAULT_INFERENCE_PROFILE_ID
+    )
+    return ip
+
+def resolve_target_model_id(model_id: str, inference_profile: str | None = None) -> str:
+    """
+    Фактический modelId запроса Bedrock: профиль инференса (UI -> ENV -> defaults), иначе model_id.
+    В текущей версии SDK профиль передаётся в modelId (ID/ARN профиля),
+    так как параметры inferenceProfileArn/Id не поддерживаются.
+    """
+    ip = resolve_inference_profile(inference_profile)
+    return ip.strip() if ip and ip.strip() else model_id
+
+def _invoke_with_inference_profile(client, body: dict, model_id: str, inference_profile: str | None = None,
+                                   on_field=None):
+    payload = json.dumps(body)
+    target_model_id = resolve_target_model_id(model_id, inference_profile)
+    if BEDROCK_STREAMING and "messages" in body:
+        return _invoke_streaming(client, payload, target_model_id, on_field=on_field)
+    resp = client.invoke_model(
+        modelId=target_model_id,
+        contentType="application/json",
+        accept="application/json",
+        body=payload,
+    )
+    data = json.loads(resp["body"].read())
+    # Токены запроса/ответа — в спан текущей стадии (_timings)
+    tracing.record_usage(data.get("usage"))
+    return data
+
+def _invoke_streaming(client, payload: str, target_model_id: str, on_field=None) -> dict:
+    """
+    InvokeModelWithResponseStream (Anthropic messages): текст собирается из дельт и разбирается
+    инкрементально; после закрывающей '}' JSON-объекта поток закрывается, остаток генерации не читается.
+    Возвращает ответ в форме invoke_model: {"content": [{"type": "text", "text"}], "stop_reason", "usage"}.
+    """
+    t0 = time.monotonic()
+    resp = client.invoke_model_with_response_stream(
+        modelId=target_model_id,
+        contentType="application/json",
+        accept="application/json",
+        body=payload,
+    )
+    stream = resp["body"]
+    parser = JsonObjectStream()
+    usage = {}
+    stop_reason = None
+    first_token_ms = first_field_ms = None
+    try:
+        for event in stream:
+            chunk = (event.get("chunk") or {}).get("bytes")
+            if not chunk:
+                continue
+            msg = json.loads(chunk)
+            kind = msg.get("type")
+            if kind == "message_start":
+                usage.update((msg.get("message") or {}).get("usage") or {})
+            elif kind == "content_block_delta":
+                text = (msg.get("delta") or {}).get("text") or ""
+                if text and first_token_ms is None:
+                    first_token_ms = (time.monotonic() - t0) * 1000
+                for name, value in parser.feed(text):
+                    if first_field_ms is None:
+                        first_field_ms = (time.monotonic() - t0) * 1000
+                    if on_field is not None:
+                        on_field(name, value)
+                if parser.done:
+                    stop_reason = "json_complete"
+                    break
+            elif kind == "message_delta":
+                stop_reason = (msg.get("delta") or {}).get("stop_reason") or stop_reason
+                usage.update(msg.get("usage") or {})
+    finally:
+        # Досрочный выход: закрываем соединение, генерация дальше не оплачивается чтением
+        stream.close()
+    tracing.record_usage(usage)
+    span = tracing.current_span()
+    if span is not None:
+        span.set(stream_first_token_ms=round(first_token_ms or 0.0, 1), stream_first_field_ms=round(first_field_ms or 0.0, 1))
+        if stop_reason == "json_complete":
+            span.add("stream_cut", 1)
+    return {"content": [{"type": "text", "text": parser.text}], "stop_reason": stop_reason, "usage": usage}
+
+def call_bedrock_invoke(model_id: str, prompt: str, client, inference_profile: str | None = None, on_field=None,
+                        system: str | None = None):
+    """system — статичная инструкция: для Anthropic уходит в system (кэшируемый префикс), иначе ставится перед prompt."""
+    if model_id.startswith("anthropic."):
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 1024,
+            "temperature": 0,
+            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+        }
+        if system:
+            body["system"] = system_prompt(system)
+        data = _invoke_with_inference_profile(client, body, model_id=model_id, inference_profile=inference_profile,
+                                              on_field=on_field)
+        return data.get("content", [{}])[0].get("text", "")
+    else:
+        body = {"inputText": (system or "") + prompt, "textGenerationConfig": {"maxTokenCount": 1024, "temperature": 0}}
+        data = _invoke_with_inference_profile(client, body, model_id=model_id, inference_profile=inference_profile)
+        if "results" in data and data["results"]:
+            return data["results"][0].get("outputText", "")
+        return json.dumps(data)
+
+def stamp_source_images(file_bytes: bytes, key: str, content_type: str, is_pdf: bool, pdf_previews: dict | None) -> list[bytes]:
+    """Исходные изображения для детекции печати/QR: PNG превью страниц PDF или сам JPEG (байты из памяти)."""
+    if is_pdf and pdf_previews and pdf_previews.get("images"):
+        return list(pdf_previews["images"][:3])
+    if ("jpeg" in content_type.lower()) or ("jpg" in content_type.lower()) or key.lower().endswith((".jpg", ".jpeg")):
+        return [file_bytes]
+    return []
+
+# --- Кэш результатов по содержимому файла ---
+def result_cache_key(file_sha256: str, model_id: str, llm_mode: str) -> str:
+    """
+    Ключ кэша: хэш файла + модель + режим LLM + отпечаток промптов (и их размещения: system или сообщение
+    пользователя) и предобработки изображений и OCR-текста.
+    model_id — фактически вызываемая модель (resolve_target_model_id), а не MODEL_ID: смена профиля инференса
+    в UI или ENV не должна возвращать ответы другой модели.
+    """
+    prompts = build_prompt_russian("") + build_prompt_combined("") + STAMP_INSTRUCTION + STAMP_SCHEMA_FIELDS
+    prompts += f"|{vision.VISION_LONG_EDGE}|{vision.VISION_IMAGE_FORMAT}|{vision.VISION_IMAGE_QUALITY}|{vision.VISION_CROP}"
+    prompts += f"|{ocrtext.OCR_COMPACT}|{ocrtext.OCR_TOKEN_BUDGET}|{ocrtext.OCR_MIN_CONFIDENCE}|{BEDROCK_PROMPT_CACHE}"
+    prompt_version = hashlib.sha256(prompts.encode("utf-8")).hexdigest()[:12]
+    return hashlib.sha256(f"{file_sha256}|{model_id}|{llm_mode}|{prompt_version}".encode("utf-8")).hexdigest()
+
+def _result_cache_connect():
+    conn = sqlite3.connect(RESULT_CACHE_PATH, timeout=30, isolation_level=None)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS results ("
+        "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+    )
+    return conn
+
+def result_cache_get(key: str, s3_client=None, bucket: str | None = None) -> dict | None:
+    """
+    Ищет результат сначала в локальном SQLite, затем (если настроен) в S3.
+    Возвращает сохранённый dict (ocr_text, signatures, stamps, fields, page_count, textract_intermediate) или None. Ошибки кэша не пробрасываются.
+    """
+    now = time.time()
+    try:
+        conn = _result_cache_connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM results WHERE key = ? AND created_at >= ?", (key, now - RESULT_CACHE_TTL_SECONDS)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                return json.loads(row[0])
+        finally:
+            conn.close()
+    except Exception:
+        pass
+    if s3_client is None or not bucket or not RESULT_CACHE_S3_PREFIX:
+        return None
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=f"{RESULT_CACHE_S3_PREFIX}{key}.json")
+        value = json.loads(obj["Body"].read())
+        if value.get("created_at", 0) < now - RESULT_CACHE_TTL_SECONDS:
+            return None
+        result_cache_put(key, value)  # прогреваем локальный уровень
+        return value
+    except Exception:
+        return None
+
+def result_cache_put(key: str, value: dict, s3_client=None, bucket: str | None = None):
+    """Сохраняет результат в локальный кэш (с вытеснением по TTL и объёму) и, если настроен, в S3."""
+    value = dict(value)
+    value.setdefault("created_at", time.time())
+    data = json.dumps(value, ensure_ascii=False)
+    try:
+        conn = _result_cache_connect()
+        try:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), value["created_at"], now),
+            )
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - RESULT_CACHE_TTL_SECONDS,))
+            # Вытеснение давно не использованных записей, пока кэш не уложится в RESULT_CACHE_MAX_BYTES
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total > RESULT_CACHE_MAX_BYTES:
+                for old_key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed_at").fetchall():
+                    if total <= RESULT_CACHE_MAX_BYTES:
+                        break
+                    conn.execute("DELETE FROM results WHERE key = ?", (old_key,))
+                    total -= size
+        finally:
+            conn.close()
+    except Exception:
+        pass
+    if s3_client is not None and bucket and RESULT_CACHE_S3_PREFIX:
+        try:
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=f"{RESULT_CACHE_S3_PREFIX}{key}.json",
+                Body=data.encode("utf-8"),
+                ContentType="application/json; charset=utf-8",
+            )
+        except Exception:
+            pass
+
+_BACKGROUND_EXECUTOR = None
+_BACKGROUND_FUTURES: set = set()
+_BACKGROUND_LOCK = threading.Lock()
+
+def get_background_executor():
+    """Общий пул фоновых задач процесса (загрузка превью в S3 и т.п.), не блокирующих ответ пользователю."""
+    global _BACKGROUND_EXECUTOR
+    with _BACKGROUND_LOCK:
+        if _BACKGROUND_EXECUTOR is None:
+            _BACKGROUND_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="idp-background")
+        return _BACKGROUND_EXECUTOR
+
+def submit_background(fn, *args, **kwargs):
+    """Ставит задачу в фоновый пул и запоминает её до завершения (см. wait_background_tasks)."""
+    future = get_background_executor().submit(fn, *args, **kwargs)
+    with _BACKGROUND_LOCK:
+        _BACKGROUND_FUTURES.add(future)
+    future.add_done_callback(lambda f: _BACKGROUND_FUTURES.discard(f))
+    return future
+
+def wait_background_tasks(timeout: float | None = None):
+    """Дожидается фоновых задач (например, перед выходом пакетной обработки)."""
+    with _BACKGROUND_LOCK:
+        pending = list(_BACKGROUND_FUTURES)
+    for f in pending:
+        try:
+            f.result(timeout=timeout)
+        except Exception:
+            pass
+
+def run_stage_graph(stages: dict, max_workers: int | None = None, trace=None) -> dict:
+    """
+    Параллельный запуск стадий обработки с учётом зависимостей.
+    stages: {имя: (функция, [имена зависимостей])}; функция получает результаты зависимостей
+    позиционно в порядке их перечисления. Стадии должны быть перечислены после своих зависимостей.
+    Возвращает {имя: Future}; исключение стадии пробрасывается при вызове .result().
+    Стадии выполняются в рабочих потоках: всё, что им нужно, передаётся явно.
+    trace: если передан, каждая стадия (без ожидания зависимостей) записывается спаном с её именем.
+    """
+    # Потоков столько же, сколько стадий: ожидание зависимостей не может заблокировать пул
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1, thread_name_prefix="idp-stage")
+    futures = {}
+
+    def _run(name, fn, deps):
+        args = [futures[d].result() for d in deps]
+        if trace is None:
+            return fn(*args)
+        with trace.span(name):
+            return fn(*args)
+
+    try:
+        for name, (fn, deps) in stages.items():
+            futures[name] = executor.submit(_run, name, fn, list(deps))
+    finally:
+        executor.shutdown(wait=False)
+    return futures
+
+
+
+# =============== ПРОВЕРКИ И ОСНОВНОЙ ПРОЦЕСС =========================
+# --- Правила проверок МИБ ---
+# Единственное определение правил: compute_checks применяет их к одному документу, rescore.py — к уникальным
+# значениям столбцов архива. Порядок CHECK_ERRORS = порядок ошибок в _errors; второй элемент — ключ MIB_ERRORS.
+CHECK_ERRORS = (
+    ("fio_match", "ФИО заявителя и ФИО в документе должны совпадать"),
+    ("doc_type_match", "Наименование документа"),
+    ("is_valid_now", "Актуальная дата"),
+    ("stamp_or_qr_present", "Наличие QR или печати"),
+    ("pdf_has_one_page", "Прикрепленный файл должен содержать один документ"),
+)
+
+def norm_client_doc_type(client_doc_type: str | None) -> str | None:
+    """Тип документа заявителя: подпись из формы (DOC_TYPE_OPTIONS) или короткое значение -> Лист | Приказ | Справка."""
+    return norm_doc_type(DOC_TYPE_VALUE_MAP.get(client_doc_type) or client_doc_type)
+
+def fio_match_rule(client_name: str | None, doc_name: str | None) -> bool:
+    """ФИО после norm_name; два отсутствующих ФИО считаются совпадающими."""
+    return client_name == doc_name
+
+def doc_type_match_rule(client_dt: str | None, doc_dt: str | None) -> bool:
+    """Типы после norm_doc_type / norm_client_doc_type."""
+    return client_dt is not None and client_dt == doc_dt
+
+def validity_rule(doc_type: str | None, issue_date: date | None, today: date) -> tuple[str | None, bool | None]:
+    """(valid_until ISO, is_valid_now) по типу документа (VALIDITY_DAYS) и дате выдачи (parse_date_safe)."""
+    days = VALIDITY_DAYS.get(doc_type) if doc_type else None
+    if days is None or issue_date is None:
+        return None, None
+    try:
+        valid_until = date.fromordinal(issue_date.toordinal() + days)
+    except (ValueError, OverflowError):
+        # Дата выдачи у границы календаря (31.12.9999): срок не вычислить
+        return None, None
+    return valid_until.isoformat(), today <= valid_until
+
+def stamp_or_qr_rule(stamp_present, qr_present) -> bool | None:
+    if stamp_present is True or qr_present is True:
+        return True
+    if stamp_present is False and qr_present is False:
+        return False
+    return None
+
+def pdf_pages_rule(is_pdf: bool, page_count) -> tuple[bool | None, int | None]:
+    """(pdf_has_one_page, pdf_page_count); проверка только для PDF."""
+    if not is_pdf or not isinstance(page_count, int):
+        return None, None
+    return page_count == 1, page_count
+
+def verdict_rule(results: tuple) -> str:
+    """Итоговый вердикт по значениям проверок в порядке CHECK_ERRORS (True | False | None)."""
+    evaluated = [b for b in results if isinstance(b, bool)]
+    if any(b is False for b in evaluated):
+        return "fail"
+    if evaluated:
+        return "pass"
+    return "unknown"
+
+def errors_rule(results: tuple) -> list:
+    """Ошибки по стандарту МИБ для проваленных проверок (значения в порядке CHECK_ERRORS)."""
+    errors = []
+    for value, (_, field_key) in zip(results, CHECK_ERRORS):
+        err = MIB_ERRORS.get(field_key)
+        if value is False and err:
+            errors.append({"field": field_key, "code": err.get("code"), "message": err.get("message")})
+    return errors
+
+def compute_checks(parsed: dict, client_fio: str | None, client_doc_type: str | None,
+                   is_pdf: bool, page_count: int | None, today: date | None = None) -> tuple[dict, list]:
+    """
+    Проверки извлечённых полей против данных заявителя (_checks) и список ошибок по стандарту МИБ (_errors).
+    client_doc_type — подпись из формы (DOC_TYPE_OPTIONS) или короткое значение (Лист | Приказ | Справка).
+    today — дата оценки срока актуальности (по умолчанию сегодня, UTC).
+    """
+    checks = {}
+    # ФИО
+    checks["fio_match"] = fio_match_rule(norm_name(client_fio), norm_name(parsed.get("ФИО заявителя")))
+    # Тип документа
+    client_dt_norm = norm_client_doc_type(client_doc_type)
+    bedrock_dt_norm = norm_doc_type(parsed.get("Тип документа"))
+    checks["doc_type_match"] = doc_type_match_rule(client_dt_norm, bedrock_dt_norm)
+    # Срок актуальности
+    checks["valid_until"], checks["is_valid_now"] = validity_rule(
+        bedrock_dt_norm or client_dt_norm, parse_date_safe(parsed.get("Дата выдачи документа")),
+        today or datetime.utcnow().date())
+    # Печать/QR
+    si = parsed.get("_stamps") if isinstance(parsed.get("_stamps"), dict) else {}
+    checks["stamp_or_qr_present"] = stamp_or_qr_rule(si.get("stamp_present"), si.get("qr_present"))
+    # PDF страницы
+    checks["pdf_has_one_page"], checks["pdf_page_count"] = pdf_pages_rule(is_pdf, page_count)
+
+    # --- Итоговый вердикт и ошибки МИБ ---
+    results = tuple(checks[name] for name, _ in CHECK_ERRORS)
+    checks["verdict"] = verdict_rule(results)
+    return checks, errors_rule(results)
+
+
+def client_info(client_fio: str | None, client_doc_type: str | None) -> dict:
+    """Сведения заявителя для _client в итоговом JSON."""
+    return {
+        "fio": client_fio,
+        "doc_type": client_doc_type,
+        # Добавляем короткое значение для дальнейшей сверки с ответами Bedrock
+        "doc_type_value": DOC_TYPE_VALUE_MAP.get(client_doc_type) or norm_doc_type(client_doc_type),
+    }
+
+
+def preflight_rejection(preflight: dict, client_fio: str | None, client_doc_type: str | None) -> dict:
+    """
+    Итоговый JSON для файла, отклонённого предварительной проверкой: Textract и Bedrock не вызывались,
+    проверки полей не выполнялись (None), вердикт — fail с ошибками МИБ из preflight.
+    """
+    checks = {"fio_match": None, "doc_type_match": None, "valid_until": None, "is_valid_now": None,
+              "stamp_or_qr_present": None}
+    checks.update(preflight["checks"])
+    checks["verdict"] = "fail"
+    return {
+        "_client": client_info(client_fio, client_doc_type),
+        "_preflight": {k: v for k, v in preflight.items() if k not in ("checks", "errors")},
+        "_checks": checks,
+        "_errors": list(preflight["errors"]),
+    }
+
+
+def upload_document(s3_client, file_bytes: bytes, filename: str, content_type: str | None,
+                    bucket: str = BUCKET_NAME, key_prefix: str = KEY_PREFIX, sha256: str | None = None) -> str:
+    """
+    Выделяет папку загрузки (см. get_next_upload_folder) и загружает файл в S3 (multipart при размере больше
+    порога S3_TRANSFER_CONFIG). sha256 (из preflight_document) сохраняется в метаданных объекта. Возвращает ключ объекта.
+    """
+    base_prefix = (key_prefix or "").strip() or "uploads/"
+    if base_prefix and not base_prefix.endswith("/"):
+        base_prefix += "/"
+    with tracing.span("allocate_folder"):
+        upload_folder = get_next_upload_folder(s3_client, bucket, base_prefix)
+    key = f"{upload_folder}{filename}"
+    extra_args = {"ContentType": content_type or "application/octet-stream"}
+    if sha256:
+        extra_args["Metadata"] = {"sha256": sha256}
+    # Загрузку выполняют потоки s3transfer (их вызовы привязываются к спану по Bucket/Key);
+    # BytesIO над bytes не копирует буфер, части читаются из тех же байтов
+    with tracing.span("s3_upload", payload_bytes=len(file_bytes)), tracing.bind_calls(Bucket=bucket, Key=key):
+        s3_client.upload_fileobj(
+            Fileobj=io.BytesIO(file_bytes),
+            Bucket=bucket,
+            Key=key,
+            ExtraArgs=extra_args,
+            Config=_s3_transfer_config(),
+        )
+    return key
+
+
+def process_document(file_bytes: bytes, key: str, content_type: str | None,
+                     client_fio: str | None, client_doc_type: str | None,
+                     bucket: str = BUCKET_NAME, inference_profile: str | None = None,
+                     llm_mode: str | None = None, on_progress=None, trace=None, on_field=None,
+                     preflight: dict | None = None, replay: str | None = None) -> dict:
+    """
+    Обработка документа, уже загруженного в S3 под ключом key: Textract, подписи, печать/QR, поля,
+    проверки и сохранение extraction-*.json в папку документа.
+    on_progress(label, percent) вызывается только из потока вызывающего.
+    on_field(name, value) — поля ответов LLM по мере поступления при IDP_BEDROCK_STREAMING=1;
+    вызывается из потоков стадий.
+    preflight: результат preflight_document, если проверка уже выполнена до загрузки (иначе выполняется здесь
+    при IDP_PREFLIGHT=1). Отклонённый файл не отправляется в Textract и Bedrock: сохраняется JSON с ошибками МИБ.
+    replay: пересборка по intermediate/ папки документа без Textract — "textract" (поля и печать заново через
+    Bedrock, например после изменения промптов) или "checks" (и без Bedrock: только проверки МИБ). Кэш не используется.
+    trace: tracing.Trace документа (например, уже со спаном загрузки); длительности стадий попадают в _timings,
+    спаны — в IDP_TRACE_FILE.
+    Возвращает {"parsed", "json_key", "payload", "is_pdf", "page_count", "pdf_previews"}.
+    Ошибки Textract и извлечения полей пробрасываются; ошибки подписей и печатей фиксируются в _signatures/_stamps.
+    """
+    trace = trace or tracing.Trace()
+    try:
+        return _process_document(file_bytes, key, content_type, client_fio, client_doc_type,
+                                 bucket, inference_profile, llm_mode, on_progress, trace, on_field, preflight, replay)
+    finally:
+        trace.export()
+
+
+def _process_document(file_bytes, key, content_type, client_fio, client_doc_type,
+                      bucket, inference_profile, llm_mode, on_progress, trace, on_field=None, preflight=None,
+                      replay=None) -> dict:
+    def _progress(label: str, percent: int):
+        if on_progress is not None:
+            on_progress(label, percent)
+
+    profile = AWS_PROFILE.strip() or None
+    s3 = get_aws_client("s3", profile, AWS_REGION)
+    textract = get_aws_client("textract", profile, AWS_REGION)
+    bedrock = get_bedrock_client(profile, BEDROCK_REGION)
+
+    is_pdf = ("pdf" in (content_type or "").lower()) or key.lower().endswith(".pdf")
+    if preflight is None and PREFLIGHT_ENABLED:
+        with trace.span("preflight"):
+            preflight = preflight_document(file_bytes, key, content_type)
+    if preflight is not None and not preflight["ok"]:
+        # Файл заведомо не проходит проверку: без Textract и Bedrock, только JSON с ошибками
+        _progress("Файл не прошёл предварительную проверку", 90)
+        parsed = preflight_rejection(preflight, client_fio, client_doc_type)
+        json_key, payload = _save_extraction(s3, bucket, key, parsed, trace, _progress)
+        return {"parsed": parsed, "json_key": json_key, "payload": payload, "is_pdf": is_pdf,
+                "page_count": preflight["page_count"], "pdf_previews": None}
+    # Байты файла уже в памяти: число страниц известно до Textract (одностраничный PDF — синхронный путь)
+    if preflight is not None and preflight["page_count"] is not None:
+        page_count = preflight["page_count"]
+    else:
+        page_count = pdf_page_count(file_bytes) if is_pdf else None
+    llm_mode = "combined" if (llm_mode or LLM_MODE or "").strip().lower() == "combined" else "split"
+    replay = (replay or "").strip().lower() or None
+    if replay is not None and replay not in REPLAY_MODES:
+        raise ValueError(f"Неизвестный режим replay: {replay} (ожидается {' | '.join(REPLAY_MODES)})")
+    # Повторная загрузка того же файла: OCR, подписи, печать и поля берутся из кэша
+    # SHA-256 уже посчитан при предварительной проверке (тот же проход по байтам, что и метаданные страниц)
+    file_sha256 = (preflight or {}).get("sha256") or hashlib.sha256(file_bytes).hexdigest()
+    cache_key = result_cache_key(file_sha256, resolve_target_model_id(MODEL_ID, inference_profile), llm_mode)
+    cached = None
+    if replay is None:
+        with trace.span("cache_lookup"):
+            cached = result_cache_get(cache_key, s3_client=s3, bucket=bucket) if RESULT_CACHE_ENABLED else None
+        # Без ссылки на сохранённые блоки Textract (запись без промежуточных результатов) новую папку нельзя
+        # было бы пересобрать через replay="textract" — такая запись считается промахом
+        if cached is not None and INTERMEDIATES_ENABLED and not cached.get("textract_intermediate"):
+            cached = None
+    replay_blocks = None
+    if replay is not None:
+        # Сохранённые ответы вместо Textract (и Bedrock); без них пересборка невозможна
+        name = "textract" if replay == "textract" else "llm"
+        with trace.span("intermediate_load", replay=replay):
+            restored = load_intermediate(s3, bucket, key, name)
+        if restored is None:
+            raise Exception(f"Нет сохранённого промежуточного результата: {intermediate_key(key, name)}")
+        if replay == "textract":
+            replay_blocks = restored
+        else:
+            # Ответы LLM, подписи и число страниц исходной обработки — как запись кэша результатов
+            cached = restored
+            llm_mode = restored.get("llm_mode") or llm_mode
+            if page_count is None:
+                page_count = restored.get("page_count")
+
+    # --- Стадии обработки (выполняются параллельно по графу зависимостей) ---
+    # превью PDF -> печать/QR (LLM); Textract (текст + подписи) -> извлечение полей (LLM)
+    def _stage_previews():
+        # Если загружен PDF, рендерим превью в памяти; загрузка PNG в S3 идёт в фоне
+        if not is_pdf:
+            return None
+        previews = render_pdf_previews(file_bytes, max_pages=3, zoom=2.0)
+        if previews.get("images"):
+            # При replay превью уже лежат в папке документа
+            if replay is None:
+                previews["s3_keys"] = store_previews_async(s3, bucket, key, previews["images"])
+            else:
+                previews["s3_keys"] = preview_keys(key, len(previews["images"]))
+        return previews
+
+    def _stage_textract():
+        if replay_blocks is not None:
+            return replay_blocks
+        tex_resp = analyze_document_textract(textract, bucket, key, content_type, file_bytes=file_bytes, page_count=page_count)
+        # Сырые блоки сохраняются целиком: повторная сборка промптов и проверок без повторного OCR
+        if INTERMEDIATES_ENABLED:
+            store_intermediate_async(s3, bucket, key, "textract", {"Blocks": tex_resp.get("Blocks", [])})
+        return tex_resp
+
+    def _stage_signatures(tex_resp):
+        return extract_signatures(tex_resp)
+
+    def _stage_stamps(pdf_previews):
+        # Сначала локальный поиск QR (CPU); если QR найден — проверка решена без LLM
+        # Иначе LLM определение печати (изображения: превью страниц PDF или само изображение для JPEG)
+        stamp_hits = {"stamp_present": None, "stamp_confidence": None, "qr_present": None, "qr_confidence": None, "raw": "", "error": None}
+        try:
+            source_images = stamp_source_images(file_bytes, key, content_type, is_pdf, pdf_previews)
+            with tracing.span("local_qr"):
+                local_qr = detect_qr_local(source_images)
+            if local_qr:
+                return local_qr
+            # Изображения уменьшаются и перекодируются (см. vision.py) — меньше размер запроса и токенов
+            imgs_content = prepare_vision_content(source_images)
+            if imgs_content:
+                stamp_hits = detect_stamp_llm(bedrock, MODEL_ID, imgs_content, inference_profile=inference_profile,
+                                              on_field=on_field)
+        except Exception as e:
+            stamp_hits = {"stamp_present": None, "stamp_confidence": None, "qr_present": None, "qr_confidence": None, "raw": "", "error": str(e)}
+        return stamp_hits
+
+    def _stage_extraction(tex_resp):
+        extracted_text = llm_input_text(tex_resp)
+        return extract_fields_llm(bedrock, MODEL_ID, extracted_text, inference_profile=inference_profile, on_field=on_field)
+
+    def _stage_combined(pdf_previews, tex_resp):
+        # Совмещённый режим: поля + печать/QR одним запросом.
+        # Если QR найден локально или изображений нет — только текстовое извлечение полей
+        extracted_text = llm_input_text(tex_resp)
+        stamp_hits = {"stamp_present": None, "stamp_confidence": None, "qr_present": None, "qr_confidence": None, "raw": "", "error": None}
+        imgs_content = []
+        try:
+            source_images = stamp_source_images(file_bytes, key, content_type, is_pdf, pdf_previews)
+            with tracing.span("local_qr"):
+                local_qr = detect_qr_local(source_images)
+            if local_qr:
+                stamp_hits = local_qr
+            else:
+                imgs_content = prepare_vision_content(source_images)
+        except Exception as e:
+            stamp_hits["error"] = str(e)
+        if imgs_content:
+            return extract_combined_llm(bedrock, MODEL_ID, imgs_content, extracted_text, inference_profile=inference_profile,
+                                        on_field=on_field)
+        fields = extract_fields_llm(bedrock, MODEL_ID, extracted_text, inference_profile=inference_profile, on_field=on_field)
+        return fields, stamp_hits
+
+    # В режиме replay="checks" изображения не нужны: печать/QR берутся из сохранённого ответа
+    stages = {"previews": (_stage_previews, [])} if replay != "checks" else {}
+    if cached is None:
+        stages["textract"] = (_stage_textract, [])
+        stages["signatures"] = (_stage_signatures, ["textract"])
+        if llm_mode == "combined":
+            stages["combined"] = (_stage_combined, ["previews", "textract"])
+        else:
+            stages["stamps"] = (_stage_stamps, ["previews"])
+            stages["extraction"] = (_stage_extraction, ["textract"])
+
+    _progress("Textract, печати и извлечение полей через Bedrock...", 30)
+    stage_futures = run_stage_graph(stages, trace=trace)
+
+    try:
+        pdf_previews = stage_futures["previews"].result() if "previews" in stage_futures else None
+    except Exception as e:
+        pdf_previews = {"images": [], "s3_keys": [], "page_count": 0, "error": str(e)}
+    if isinstance(pdf_previews, dict) and isinstance(pdf_previews.get("page_count"), int) and page_count is None:
+        page_count = pdf_previews["page_count"]
+    _progress("Textract, печати и извлечение полей через Bedrock...", 60)
+
+    if cached is not None:
+        # Textract не вызывался: блоки исходной обработки копируются в папку документа (для replay="textract")
+        if replay is None and INTERMEDIATES_ENABLED:
+            copy_intermediate_async(s3, bucket, cached["textract_intermediate"], key, "textract")
+        signature_hits = cached.get("signatures")
+        stamp_hits = cached.get("stamps")
+        parsed = dict(cached["fields"]) if isinstance(cached.get("fields"), dict) else None
+    else:
+        # Ошибки подписей и печатей фиксируются в _signatures/_stamps; ошибки OCR/извлечения пробрасываются
+        try:
+            signature_hits = stage_futures["signatures"].result()
+        except Exception as e:
+            signature_hits = {"signatures": [], "error": str(e)}
+        if llm_mode == "combined":
+            parsed, stamp_hits = stage_futures["combined"].result()
+        else:
+            stamp_hits = stage_futures["stamps"].result()
+            parsed = stage_futures["extraction"].result()
+        # Кэшируем только полностью успешный результат
+        if replay is None and RESULT_CACHE_ENABLED and parsed is not None and not signature_hits.get("error") and not stamp_hits.get("error"):
+            result_cache_put(cache_key, {
+                "ocr_text": textract_blocks_to_text(stage_futures["textract"].result()),
+                "signatures": signature_hits,
+                "stamps": stamp_hits,
+                "fields": parsed,
+                "page_count": page_count,
+                # Сырые блоки уже сохранены в intermediate/ этой папки: при попадании в кэш их копирует S3
+                "textract_intermediate": ({"bucket": bucket, "key": intermediate_key(key, "textract")}
+                                          if INTERMEDIATES_ENABLED else None),
+            }, s3_client=s3, bucket=bucket)
+    # Ответы LLM для replay="checks" (и при попадании в кэш: папка документа новая)
+    if INTERMEDIATES_ENABLED and replay != "checks":
+        store_intermediate_async(s3, bucket, key, "llm", {
+            "model_id": resolve_target_model_id(MODEL_ID, inference_profile),
+            "llm_mode": llm_mode,
+            "signatures": signature_hits,
+            "stamps": stamp_hits,
+            "fields": parsed,
+            "page_count": page_count,
+        })
+    _progress("Проверки...", 90)
+
+    if parsed is None:
+        parsed = {"Ошибка": "LLM вернул невалидный JSON"}
+
+    # Добавим сведения заявителя в итоговый JSON
+    parsed["_client"] = client_info(client_fio, client_doc_type)
+
+    parsed["_signatures"] = signature_hits
+    parsed["_stamps"] = stamp_hits
+    # Режим LLM сохраняется для A/B сравнения задержки и точности
+    parsed["_llm_mode"] = llm_mode
+    parsed["_cache"] = {"hit": cached is not None and replay is None, "key": cache_key}
+    if replay is not None:
+        parsed["_replay"] = {"mode": replay, "source": intermediate_key(key, "textract" if replay == "textract" else "llm")}
+
+    # --- Сохраняем результаты проверок в JSON (_checks) ---
+    try:
+        with trace.span("checks"):
+            parsed["_checks"], parsed["_errors"] = compute_checks(parsed, client_fio, client_doc_type, is_pdf, page_count)
+    except Exception:
+        # Не ломаем процесс, если что-то пошло не так
+        parsed["_checks"] = {"error": "check_failed"}
+        parsed["_errors"] = [{"code": "unknown", "message": "check_failed"}]
+
+    json_key, payload = _save_extraction(s3, bucket, key, parsed, trace, _progress)
+    return {
+        "parsed": parsed,
+        "json_key": json_key,
+        "payload": payload,
+        "is_pdf": is_pdf,
+        "page_count": page_count,
+        "pdf_previews": pdf_previews if is_pdf else None,
+    }
+
+
+def _save_extraction(s3, bucket: str, key: str, parsed: dict, trace, _progress) -> tuple[str, bytes]:
+    """Сохраняет extraction-*.json в папку документа. Возвращает (ключ JSON, сериализованный payload)."""
+    _progress("Сохранение JSON в S3...", 95)
+    json_key = f"{document_folder(key)}extraction-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json"
+    # Длительности стадий до сохранения JSON; само сохранение есть только в экспортированных спанах
+    parsed["_timings"] = trace.timings()
+    payload = json.dumps(parsed, ensure_ascii=False, indent=2).encode("utf-8")
+    with trace.span("json_upload", payload_bytes=len(payload)), tracing.bind_calls(Bucket=bucket, Key=json_key):
+        s3.upload_fileobj(
+            Fileobj=io.BytesIO(payload),
+            Bucket=bucket,
+            Key=json_key,
+            ExtraArgs={"ContentType": "application/json; charset=utf-8"},
+        )
+    catalog.record_extraction(bucket, key, json_key, parsed)
+    _progress("Обработка завершена", 100)
+    return json_key, payload
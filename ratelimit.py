@@ -0,0 +1,230 @@
+"""
+Общий для процесса ограничитель запросов к AWS (Textract, Bedrock, S3).
+
+Все сессии и рабочие потоки делят одни и те же лимиты: token bucket (запросов в секунду) и семафор
+(одновременных вызовов) на сервис или на отдельную операцию. При ThrottlingException скорость корзины
+снижается (x0.7) и затем плавно восстанавливается (AIMD), запрос повторяется с полным jitter.
+
+Подключается к клиенту boto3 через события botocore (install), поэтому через лимиты проходят все вызовы
+клиента — включая пагинаторы, ожидание Textract и загрузки upload_fileobj. Собственные ретраи botocore
+при этом отключаются (см. AWS_CLIENT_CONFIG в pipeline.py), чтобы повторы не умножались.
+"""
+import json
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ConnectionError as BotoConnectionError, HTTPClientError
+
+# Лимиты по умолчанию. Ключ — "сервис" или "сервис.Операция" (операция точнее сервиса).
+# rate — запросов в секунду (0 — без ограничения), burst — ёмкость корзины, concurrency — одновременных вызовов.
+# Переопределяются JSON в IDP_RATE_LIMITS, например '{"bedrock-runtime": {"rate": 1, "burst": 2, "concurrency": 4}}'
+RATE_LIMITS = {
+    "textract.AnalyzeDocument": {"rate": 5, "burst": 5, "concurrency": 8},
+    "textract.StartDocumentAnalysis": {"rate": 5, "burst": 5, "concurrency": 4},
+    "textract.GetDocumentAnalysis": {"rate": 10, "burst": 10, "concurrency": 8},
+    "bedrock-runtime": {"rate": 2, "burst": 4, "concurrency": 8},
+    "s3": {"rate": 0, "burst": 0, "concurrency": 32},
+}
+RATE_LIMITS.update(json.loads(os.getenv("IDP_RATE_LIMITS", "{}") or "{}"))
+
+RATE_LIMIT_MAX_ATTEMPTS = int(os.getenv("IDP_RATE_LIMIT_MAX_ATTEMPTS", "6"))  # попыток на вызов, включая первую
+RATE_LIMIT_BACKOFF_BASE_SECONDS = 0.5
+RATE_LIMIT_BACKOFF_MAX_SECONDS = 20.0
+
+# Коды ошибок, означающие превышение квоты
+THROTTLING_CODES = {
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "LimitExceededException",
+    "SlowDown",
+}
+# Временные ошибки сервиса: повторяем без снижения скорости
+TRANSIENT_CODES = {"InternalServerError", "InternalError", "ServiceUnavailable", "ServiceUnavailableException", "ModelNotReadyException"}
+TRANSIENT_STATUS = {500, 502, 503, 504}
+
+
+class AdaptiveLimiter:
+    """Token bucket + семафор с адаптивной скоростью (AIMD) и счётчиками очереди."""
+
+    def __init__(self, name: str, rate: float, burst: float, concurrency: int):
+        self.name = name
+        self.max_rate = float(rate or 0)
+        self.rate = self.max_rate
+        self.burst = max(1.0, float(burst or rate or 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self.metrics = {"calls": 0, "throttled": 0, "retries": 0, "in_flight": 0, "waiting": 0,
+                        "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    def _take_token(self) -> float:
+        """Списывает токен; возвращает, сколько ждать до его появления (0 — можно сразу)."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire_slot(self):
+        """Занимает место среди одновременных вызовов (один раз на вызов API)."""
+        t0 = time.monotonic()
+        with self.lock:
+            self.metrics["waiting"] += 1
+        if self.slots is not None:
+            self.slots.acquire()
+        self._record_wait(time.monotonic() - t0, calls=1)
+
+    def release_slot(self):
+        with self.lock:
+            self.metrics["in_flight"] -= 1
+        if self.slots is not None:
+            self.slots.release()
+
+    def acquire_token(self):
+        """Ждёт токен перед каждой попыткой отправки запроса (включая повторы)."""
+        if not self.max_rate:
+            return
+        wait = self._take_token()
+        if wait > 0:
+            time.sleep(wait)
+            self._record_wait(wait)
+
+    def _record_wait(self, seconds: float, calls: int = 0):
+        with self.lock:
+            m = self.metrics
+            if calls:
+                m["calls"] += calls
+                m["waiting"] -= 1
+                m["in_flight"] += 1
+            m["wait_seconds_total"] += seconds
+            m["wait_seconds_max"] = max(m["wait_seconds_max"], seconds)
+
+    def on_throttle(self):
+        """Мультипликативное снижение скорости и сброс накопленных токенов."""
+        with self.lock:
+            self.metrics["throttled"] += 1
+            if self.max_rate:
+                self.rate = max(self.max_rate * 0.05, self.rate * 0.7)
+                self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self):
+        """Аддитивное восстановление скорости до настроенного предела."""
+        if self.max_rate and self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.metrics, rate=round(self.rate, 3), max_rate=self.max_rate,
+                        wait_seconds_total=round(self.metrics["wait_seconds_total"], 3),
+                        wait_seconds_max=round(self.metrics["wait_seconds_max"], 3))
+
+
+_LIMITERS: dict = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(service: str, operation: str) -> AdaptiveLimiter | None:
+    """Ограничитель для операции: сначала "сервис.Операция", затем "сервис"; None — без ограничений."""
+    name = f"{service}.{operation}" if f"{service}.{operation}" in RATE_LIMITS else service
+    cfg = RATE_LIMITS.get(name)
+    if cfg is None:
+        return None
+    limiter = _LIMITERS.get(name)
+    if limiter is None:
+        with _LIMITERS_LOCK:
+            limiter = _LIMITERS.get(name)
+            if limiter is None:
+                limiter = AdaptiveLimiter(name, cfg.get("rate", 0), cfg.get("burst", 0), cfg.get("concurrency", 0))
+                _LIMITERS[name] = limiter
+    return limiter
+
+
+def rate_limit_metrics() -> dict:
+    """Счётчики очереди по каждому ограничителю: вызовы, троттлинг, повторы, ожидание, в работе/в очереди."""
+    with _LIMITERS_LOCK:
+        limiters = list(_LIMITERS.values())
+    return {lim.name: lim.snapshot() for lim in limiters}
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным jitter: U(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(RATE_LIMIT_BACKOFF_MAX_SECONDS, RATE_LIMIT_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def _classify(response, caught_exception) -> str | None:
+    """"throttle" | "transient" | None по ответу botocore (http, parsed) или исключению соединения."""
+    if caught_exception is not None:
+        return "transient" if isinstance(caught_exception, (BotoConnectionError, HTTPClientError)) else None
+    if not response:
+        return None
+    http, parsed = response
+    code = ((parsed or {}).get("Error") or {}).get("Code")
+    if code in THROTTLING_CODES or http.status_code == 429:
+        return "throttle"
+    if code in TRANSIENT_CODES or http.status_code in TRANSIENT_STATUS:
+        return "transient"
+    return None
+
+
+def _operation_of(model=None, operation=None) -> tuple[str, str]:
+    op = model or operation
+    return op.service_model.service_id.hyphenize(), op.name
+
+
+def _before_call(model, context, **kwargs):
+    limiter = get_limiter(*_operation_of(model=model))
+    if limiter is not None:
+        limiter.acquire_slot()
+        context["_rate_limiter"] = limiter
+
+
+def _after_call(context, **kwargs):
+    limiter = context.pop("_rate_limiter", None)
+    if limiter is not None:
+        limiter.release_slot()
+
+
+def _before_send(request, **kwargs):
+    # Модель операции в before-send не передаётся: она сохранена в контексте запроса в _before_call
+    limiter = request.context.get("_rate_limiter") if getattr(request, "context", None) else None
+    if limiter is not None:
+        limiter.acquire_token()
+
+
+def _needs_retry(response, operation, attempts, caught_exception, **kwargs):
+    limiter = get_limiter(*_operation_of(operation=operation))
+    kind = _classify(response, caught_exception)
+    if kind is None:
+        if limiter is not None and response and response[0].status_code < 300:
+            limiter.on_success()
+        return None
+    if limiter is not None:
+        if kind == "throttle":
+            limiter.on_throttle()
+        if attempts < RATE_LIMIT_MAX_ATTEMPTS:
+            with limiter.lock:
+                limiter.metrics["retries"] += 1
+    if attempts >= RATE_LIMIT_MAX_ATTEMPTS:
+        return None
+    return backoff_delay(attempts)
+
+
+def install(client):
+    """Подключает общие лимиты и повторы к клиенту boto3. Клиенты без событий botocore (заглушки) не меняются."""
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is None:
+        return client
+    events.register("before-call", _before_call, unique_id="idp-rate-limit-before-call")
+    events.register("after-call", _after_call, unique_id="idp-rate-limit-after-call")
+    events.register("after-call-error", _after_call, unique_id="idp-rate-limit-after-call-error")
+    events.register("before-send", _before_send, unique_id="idp-rate-limit-before-send")
+    events.register("needs-retry", _needs_retry, unique_id="idp-rate-limit-needs-retry")
+    return client
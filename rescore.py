@@ -0,0 +1,237 @@
+"""
+Векторизованный пересчёт проверок МИБ по архиву extraction-*.json.
+
+Те же правила, что и compute_checks (pipeline.py) — совпадение ФИО, тип документа, срок актуальности,
+печать/QR, одна страница PDF, итоговый вердикт и коды ошибок, — но по столбцам pandas DataFrame сразу для всех
+документов. Правила не переписываются: функции pipeline (norm_name, parse_date_safe, *_rule) вызываются один раз
+на уникальное значение или сочетание значений своих столбцов (словарное кодирование), результат раскладывается
+по строкам. Изменение правила в pipeline.py сразу действует и здесь. Пересчёт архива не требует Textract,
+Bedrock и цикла по документам в Python.
+
+Файлы, отклонённые предварительной проверкой (_preflight), сохраняют свой вердикт и ошибки.
+
+Примеры:
+    python rescore.py ./out --output rescored.csv
+    python rescore.py s3://loan-deferment-idp-test-tlek/uploads/ --today 2026-01-31 --output rescored.parquet
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+
+CHECK_ERRORS = pipeline.CHECK_ERRORS  # порядок проверок = порядок ошибок в _errors
+
+
+def _bool_or_na(v):
+    return v if isinstance(v, bool) else pd.NA
+
+
+def _str_or_none(v):
+    return v if isinstance(v, str) else None
+
+
+def extraction_row(parsed: dict, source: str = "") -> dict:
+    """Входные данные проверок из одного extraction-*.json (плоская строка будущего DataFrame)."""
+    client = parsed.get("_client") or {}
+    stamps = parsed.get("_stamps") if isinstance(parsed.get("_stamps"), dict) else {}
+    checks = parsed.get("_checks") if isinstance(parsed.get("_checks"), dict) else {}
+    preflight = parsed.get("_preflight") or {}
+    page_count = checks.get("pdf_page_count")
+    return {
+        "source": source,
+        # Нестроковые значения в скалярных проверках считаются отсутствующими
+        "client_fio": _str_or_none(client.get("fio")),
+        "client_doc_type": _str_or_none(client.get("doc_type")),
+        "doc_fio": _str_or_none(parsed.get("ФИО заявителя")),
+        "doc_type": _str_or_none(parsed.get("Тип документа")),
+        "issue_date": _str_or_none(parsed.get("Дата выдачи документа")),
+        "stamp_present": _bool_or_na(stamps.get("stamp_present")),
+        "qr_present": _bool_or_na(stamps.get("qr_present")),
+        # Признак PDF в JSON не хранится: проверка страниц выполнялась только для PDF
+        "is_pdf": bool(preflight.get("is_pdf")) or checks.get("pdf_has_one_page") is not None or page_count is not None,
+        "page_count": page_count if isinstance(page_count, int) else pd.NA,
+        "preflight_failed": bool(preflight.get("issues")),
+        "preflight_codes": ",".join(str(e.get("code")) for e in parsed.get("_errors") or []) if preflight.get("issues") else "",
+        "old_verdict": checks.get("verdict"),
+        "old_codes": ",".join(str(e.get("code")) for e in parsed.get("_errors") or [] if e.get("code")),
+    }
+
+
+def extractions_frame(rows: list[dict]) -> pd.DataFrame:
+    df = pd.DataFrame(rows)
+    for col in ("client_fio", "client_doc_type", "doc_fio", "doc_type", "issue_date"):
+        df[col] = df[col].astype("string")
+    for col in ("stamp_present", "qr_present"):
+        df[col] = df[col].astype("boolean")
+    df["page_count"] = df["page_count"].astype("Int64")
+    return df
+
+
+def _map_unique(s: pd.Series, fn, dtype=None) -> pd.Series:
+    """
+    fn по уникальным значениям столбца (словарное кодирование): у типов документов и дат единицы-тысячи
+    различных значений на сотни тысяч строк. NA остаются NA.
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    mapped = pd.Series([fn(u) for u in uniques], dtype=dtype)
+    out = mapped.reindex(codes).set_axis(s.index)
+    return out.astype(dtype) if dtype else out
+
+
+def _scalar(v):
+    """Значение ячейки для скалярного правила: NA -> None, числа и bool numpy -> Python."""
+    if v is None or v is pd.NA or v is pd.NaT or (isinstance(v, float) and v != v):
+        return None
+    return v.item() if isinstance(v, np.generic) else v
+
+
+def _apply_rule(fn, *columns: pd.Series) -> pd.Series:
+    """
+    fn(*значения) по уникальным сочетаниям значений столбцов (NA передаётся как None, как в скалярной версии);
+    результаты (object) раскладываются по строкам.
+    """
+    key = np.zeros(len(columns[0]), dtype=np.int64)
+    for c in columns:
+        codes, uniques = pd.factorize(c, use_na_sentinel=False)
+        key = key * (len(uniques) + 1) + codes
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    results = np.empty(len(first), dtype=object)
+    for i, row in enumerate(first):
+        results[i] = fn(*(_scalar(c.iat[row]) for c in columns))
+    return pd.Series(results[inverse.reshape(-1)], index=columns[0].index, dtype=object)
+
+
+def _part(results: pd.Series, i: int, dtype=None) -> pd.Series:
+    """i-й элемент результатов правил, возвращающих кортеж."""
+    out = pd.Series([r[i] for r in results], index=results.index, dtype=object)
+    return out.astype(dtype) if dtype else out
+
+
+def compute_checks_frame(df: pd.DataFrame, today=None) -> pd.DataFrame:
+    """
+    Проверки compute_checks для всех строк сразу. df — результат extractions_frame.
+    Возвращает df с колонками fio_match, doc_type_match, valid_until, is_valid_now, stamp_or_qr_present,
+    pdf_has_one_page, pdf_page_count (nullable boolean/Int64), verdict и error_codes ("05,01", порядок как в _errors).
+    """
+    today = pd.Timestamp(today or datetime.utcnow().date()).date()
+    out = df.copy()
+
+    client_name = _map_unique(df["client_fio"], pipeline.norm_name, "string")
+    doc_name = _map_unique(df["doc_fio"], pipeline.norm_name, "string")
+    out["fio_match"] = _apply_rule(pipeline.fio_match_rule, client_name, doc_name).astype("boolean")
+
+    client_dt = _map_unique(df["client_doc_type"], pipeline.norm_client_doc_type, "string")
+    doc_dt = _map_unique(df["doc_type"], pipeline.norm_doc_type, "string")
+    out["doc_type_match"] = _apply_rule(pipeline.doc_type_match_rule, client_dt, doc_dt).astype("boolean")
+
+    issue = _map_unique(df["issue_date"], pipeline.parse_date_safe)
+    validity = _apply_rule(lambda dt, d: pipeline.validity_rule(dt, d, today), doc_dt.fillna(client_dt), issue)
+    out["valid_until"] = _part(validity, 0)
+    out["is_valid_now"] = _part(validity, 1, "boolean")
+
+    out["stamp_or_qr_present"] = _apply_rule(pipeline.stamp_or_qr_rule, df["stamp_present"], df["qr_present"]).astype("boolean")
+
+    pages = _apply_rule(pipeline.pdf_pages_rule, df["is_pdf"].astype(bool), df["page_count"])
+    out["pdf_has_one_page"] = _part(pages, 0, "boolean")
+    out["pdf_page_count"] = _part(pages, 1, "Int64")
+
+    checks = [out[name] for name, _ in CHECK_ERRORS]
+    out["verdict"] = _apply_rule(lambda *r: pipeline.verdict_rule(r), *checks)
+    out["error_codes"] = _apply_rule(lambda *r: ",".join(str(e["code"]) for e in pipeline.errors_rule(r)), *checks)
+
+    # Отклонённые предварительной проверкой: полей нет, вердикт и ошибки — из _preflight
+    rejected = df["preflight_failed"].astype(bool)
+    if rejected.any():
+        for name in ("fio_match", "doc_type_match", "is_valid_now", "stamp_or_qr_present"):
+            out.loc[rejected, name] = pd.NA
+        out.loc[rejected, "valid_until"] = None
+        out.loc[rejected, "verdict"] = "fail"
+        out.loc[rejected, "error_codes"] = df.loc[rejected, "preflight_codes"]
+    return out
+
+
+# --- Загрузка архива ---
+def _latest_only(keys: list[str]) -> list[str]:
+    """
+    Последний extraction-*.json каждого документа (имена сортируются по времени). Документ — всё до "extraction-":
+    папка в S3 или префикс имени в плоской папке batch.py --output-dir.
+    """
+    latest = {}
+    for key in keys:
+        folder = key.rsplit("extraction-", 1)[0]
+        if key > latest.get(folder, ""):
+            latest[folder] = key
+    return sorted(latest.values())
+
+
+def load_local(root: str, all_versions: bool = False) -> list[dict]:
+    paths = glob.glob(os.path.join(root, "**", "*extraction-*.json"), recursive=True)
+    rows = []
+    for path in paths if all_versions else _latest_only(paths):
+        with open(path, encoding="utf-8") as f:
+            rows.append(extraction_row(json.load(f), path))
+    return rows
+
+
+def load_s3(uri: str, workers: int = 32, all_versions: bool = False) -> list[dict]:
+    bucket, _, prefix = uri[len("s3://"):].partition("/")
+    s3 = pipeline.get_aws_client("s3", pipeline.AWS_PROFILE.strip() or None, pipeline.AWS_REGION)
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(o["Key"] for o in page.get("Contents", []) or []
+                    if o["Key"].rsplit("/", 1)[-1].startswith("extraction-") and o["Key"].endswith(".json"))
+
+    def _load(key):
+        return extraction_row(json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read()), f"s3://{bucket}/{key}")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(_load, keys if all_versions else _latest_only(keys)))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Пересчёт проверок МИБ по архиву extraction-*.json")
+    ap.add_argument("input", help="локальная папка или s3://bucket/prefix")
+    ap.add_argument("--today", help="дата оценки срока актуальности (YYYY-MM-DD), по умолчанию сегодня")
+    ap.add_argument("--all-versions", action="store_true", help="все extraction-*.json, а не последний в папке")
+    ap.add_argument("--workers", type=int, default=32, help="потоков чтения из S3")
+    ap.add_argument("--output", help="сохранить результат: .csv или .parquet")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    if args.input.startswith("s3://"):
+        rows = load_s3(args.input, workers=args.workers, all_versions=args.all_versions)
+    else:
+        rows = load_local(args.input, all_versions=args.all_versions)
+    if not rows:
+        print("extraction-*.json не найдены", file=sys.stderr)
+        return 1
+    df = extractions_frame(rows)
+    t1 = time.perf_counter()
+    result = compute_checks_frame(df, today=args.today)
+    t2 = time.perf_counter()
+
+    changed = (result["verdict"] != result["old_verdict"]) | (result["error_codes"] != result["old_codes"])
+    print(f"Документов: {len(result)}; загрузка {t1 - t0:.2f} c, проверки {t2 - t1:.3f} c", file=sys.stderr)
+    print("Вердикты: " + json.dumps(result["verdict"].value_counts().to_dict(), ensure_ascii=False), file=sys.stderr)
+    print(f"Изменились вердикт или коды ошибок: {int(changed.sum())}", file=sys.stderr)
+    if args.output:
+        if args.output.endswith(".parquet"):
+            result.to_parquet(args.output, index=False)
+        else:
+            result.to_csv(args.output, index=False)
+    else:
+        print(result.loc[changed, ["source", "old_verdict", "verdict", "old_codes", "error_codes"]].to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Лёгкая трассировка стадий обработки документа.
+
+Trace — один документ: корневой спан и спаны стадий (загрузка, выделение папки, превью, Textract,
+опрос задачи Textract, печать/QR, извлечение полей, проверки, сохранение JSON). Для каждого спана
+фиксируются длительность и атрибуты; вызовы AWS внутри спана учитываются автоматически через события
+botocore (install): число вызовов и попыток (повторы), байты запроса и ответа. Спан вызова определяется
+в потоке, где вызов начат, и переносится в контексте запроса botocore; вызовы из чужих потоков (рабочие потоки
+s3transfer) привязываются к спану через bind_calls. Использование токенов Bedrock (usage) добавляется
+через record_usage.
+
+Сводка по стадиям сохраняется в extraction JSON как _timings; при заданном IDP_TRACE_FILE все спаны
+дописываются в файл JSON Lines в формате, близком к OpenTelemetry (traceId, spanId, parentSpanId, ...).
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv("IDP_TRACE_FILE", "")  # путь к файлу спанов (JSON Lines); пусто — не экспортировать
+
+_local = threading.local()
+_EXPORT_LOCK = threading.Lock()
+_BOUND_CALLS = []  # (параметры вызова, спан) из bind_calls
+_BOUND_LOCK = threading.Lock()
+_CONTEXT_KEY = "idp_trace_span"  # спан в контексте запроса botocore (context / request.context)
+
+
+class Span:
+    def __init__(self, trace, name: str, parent_id: str | None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attrs = {}
+        self.status = "OK"
+
+    def set(self, **attrs):
+        with self.trace.lock:
+            self.attrs.update(attrs)
+
+    def add(self, key: str, value):
+        """Накопительный числовой атрибут (вызовы, байты, токены)."""
+        with self.trace.lock:
+            self.attrs[key] = self.attrs.get(key, 0) + value
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+class Trace:
+    """Спаны одного документа. Потокобезопасен: стадии выполняются в разных потоках."""
+
+    def __init__(self, name: str = "document"):
+        self.trace_id = secrets.token_hex(16)
+        self.lock = threading.Lock()
+        self.root = Span(self, name, None)
+        self.spans = []
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Спан в текущем потоке: дочерний к текущему спану этого трейса, иначе к корню."""
+        parent = getattr(_local, "span", None)
+        parent_id = parent.span_id if parent is not None and parent.trace is self else self.root.span_id
+        span = Span(self, name, parent_id)
+        span.attrs.update(attrs)
+        with self.lock:
+            self.spans.append(span)
+        _local.span = span
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "ERROR"
+            span.set(error=str(e))
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _local.span = parent
+
+    def timings(self) -> dict:
+        """
+        Сводка для _timings: длительность и атрибуты по имени стадии (повторяющиеся стадии суммируются).
+        retries — попытки запросов к AWS сверх числа вызовов.
+        """
+        stages = {}
+        with self.lock:
+            spans = [s for s in self.spans if s.end_ns is not None]
+            for s in spans:
+                st = stages.setdefault(s.name, {"duration_ms": 0.0, "count": 0})
+                st["duration_ms"] += s.duration_ms
+                st["count"] += 1
+                if s.status != "OK":
+                    st["error"] = s.attrs.get("error")
+                for k, v in s.attrs.items():
+                    if isinstance(v, (int, float)) and not isinstance(v, bool):
+                        st[k] = st.get(k, 0) + v
+        for st in stages.values():
+            st["duration_ms"] = round(st["duration_ms"], 1)
+            if "aws_requests" in st:
+                st["retries"] = st["aws_requests"] - st.get("aws_calls", 0)
+        return {"trace_id": self.trace_id, "total_ms": round(self.root.duration_ms, 1), "stages": stages}
+
+    def export(self, path: str | None = None):
+        """Дописывает корневой спан и спаны стадий в файл JSON Lines (формат в духе OTLP JSON)."""
+        self.root.end_ns = self.root.end_ns or time.time_ns()
+        path = TRACE_FILE if path is None else path
+        if not path:
+            return
+        with self.lock:
+            spans = [self.root] + [s for s in self.spans if s.end_ns is not None]
+            lines = [json.dumps({
+                "traceId": self.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "startTimeUnixNano": s.start_ns,
+                "endTimeUnixNano": s.end_ns,
+                "attributes": s.attrs,
+                "status": {"code": s.status},
+            }, ensure_ascii=False, default=str) for s in spans]
+        with _EXPORT_LOCK:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+
+def current_span() -> Span | None:
+    return getattr(_local, "span", None)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Дочерний спан текущего спана потока; без активного трейса ничего не записывает."""
+    parent = current_span()
+    if parent is None:
+        yield None
+        return
+    with parent.trace.span(name, **attrs) as s:
+        yield s
+
+
+def record_usage(usage: dict | None):
+    """
+    Добавляет usage ответа Bedrock (input_tokens, output_tokens, cache_read_input_tokens,
+    cache_creation_input_tokens, ...) к текущему спану; вызовы с чтением и записью кэша промпта — prompt_cache_hits
+    и prompt_cache_writes.
+    """
+    s = current_span()
+    if s is None or not isinstance(usage, dict):
+        return
+    for k, v in usage.items():
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            s.add(k, v)
+    if usage.get("cache_read_input_tokens"):
+        s.add("prompt_cache_hits", 1)
+    if usage.get("cache_creation_input_tokens"):
+        s.add("prompt_cache_writes", 1)
+
+
+@contextmanager
+def bind_calls(**params):
+    """
+    Пока блок активен, вызовы AWS из любых потоков с такими параметрами (например, Bucket и Key загрузки,
+    которую выполняют потоки s3transfer) учитываются в текущем спане этого потока.
+    """
+    s = current_span()
+    if s is None:
+        yield None
+        return
+    entry = (params, s)
+    with _BOUND_LOCK:
+        _BOUND_CALLS.append(entry)
+    try:
+        yield s
+    finally:
+        with _BOUND_LOCK:
+            _BOUND_CALLS.remove(entry)
+
+
+def _call_span(params) -> Span | None:
+    s = current_span()
+    if s is not None or not isinstance(params, dict):
+        return s
+    with _BOUND_LOCK:
+        for bound, bound_span in reversed(_BOUND_CALLS):
+            if all(params.get(k) == v for k, v in bound.items()):
+                return bound_span
+    return None
+
+
+# --- Учёт вызовов AWS через события botocore ---
+def _before_parameter_build(params=None, context=None, **kwargs):
+    # Здесь ещё видны параметры API (Bucket, Key) — спан запоминается в контексте запроса: попытки и ответ
+    # учитываются по контексту, а не по потоку
+    s = _call_span(params)
+    if s is not None and context is not None:
+        context[_CONTEXT_KEY] = s
+
+
+def _before_call(context=None, **kwargs):
+    s = (context or {}).get(_CONTEXT_KEY)
+    if s is not None:
+        s.add("aws_calls", 1)
+
+
+def _before_send(request, **kwargs):
+    s = (getattr(request, "context", None) or {}).get(_CONTEXT_KEY)
+    if s is None:
+        return
+    s.add("aws_requests", 1)
+    body = request.body
+    if isinstance(body, (bytes, bytearray, str)):
+        s.add("request_bytes", len(body))
+
+
+def _after_call(http_response, context=None, **kwargs):
+    s = (context or {}).get(_CONTEXT_KEY)
+    if s is not None and http_response is not None:
+        length = http_response.headers.get("content-length")
+        if length and str(length).isdigit():
+            s.add("response_bytes", int(length))
+
+
+def install(client):
+    """Подключает учёт вызовов к клиенту boto3. Клиенты без событий botocore (заглушки) не меняются."""
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is None:
+        return client
+    events.register("before-parameter-build", _before_parameter_build, unique_id="idp-trace-before-parameter-build")
+    events.register("before-call", _before_call, unique_id="idp-trace-before-call")
+    events.register("before-send", _before_send, unique_id="idp-trace-before-send")
+    events.register("after-call", _after_call, unique_id="idp-trace-after-call")
+    return client
@@ -0,0 +1,239 @@
+"""
+Подготовка изображений страниц для vision-запросов Bedrock (детекция печати/QR).
+
+Полностраничные PNG (zoom=2.0) весят мегабайты в base64 и почти целиком уходят во входные токены.
+Здесь изображения уменьшаются до целевого размера по длинной стороне, перекодируются в JPEG/WebP
+и при необходимости обрезаются до областей, где обычно находятся печать и QR (углы, нижняя часть).
+Модуль не зависит от Streamlit — его используют main.py и бенчмарки.
+"""
+import base64
+import importlib
+import io
+import json
+import os
+
+# Тяжёлые зависимости импортируются при первом использовании (optional_module), а не при загрузке модуля:
+# fitz (PyMuPDF), PIL.Image (опционально: только для WebP), cv2 + numpy (опционально: локальный поиск QR,
+# opencv-python-headless). Вместе это ~0.2 с холодного старта, а форме загрузки они не нужны.
+_OPTIONAL_MODULES: dict = {}
+
+# --- Параметры предобработки (переопределяются переменными окружения) ---
+# px по длинной стороне; 0 — без уменьшения. Страница A4 при 1280 px (~1.16 Мпикс) уже упирается в лимит модели
+# и стоит столько же токенов, что и полный PNG; 1024 px — примерно на треть меньше токенов
+VISION_LONG_EDGE = int(os.getenv("IDP_VISION_LONG_EDGE", "1024"))
+VISION_IMAGE_FORMAT = os.getenv("IDP_VISION_FORMAT", "jpeg")  # jpeg | webp | png
+VISION_IMAGE_QUALITY = int(os.getenv("IDP_VISION_QUALITY", "80"))  # качество JPEG/WebP (1..100)
+VISION_CROP = os.getenv("IDP_VISION_CROP", "full")  # ключ VISION_CROP_REGIONS
+LOCAL_QR_ENABLED = os.getenv("IDP_LOCAL_QR", "1") != "0"  # локальный поиск QR до вызова LLM (нужен OpenCV)
+
+# Области страницы в долях ширины/высоты: (x0, y0, x1, y1). Каждая область уходит отдельным изображением.
+VISION_CROP_REGIONS = {
+    "full": [(0.0, 0.0, 1.0, 1.0)],
+    "footer": [(0.0, 0.55, 1.0, 1.0)],
+    "corners": [(0.0, 0.0, 0.45, 0.3), (0.55, 0.0, 1.0, 0.3), (0.0, 0.7, 0.45, 1.0), (0.55, 0.7, 1.0, 1.0)],
+    "header_footer": [(0.0, 0.0, 1.0, 0.3), (0.0, 0.55, 1.0, 1.0)],
+}
+
+_MEDIA_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+
+def optional_module(name: str):
+    """Модуль необязательной зависимости, импортируемый один раз на процесс при первом вызове; None — не установлен."""
+    if name not in _OPTIONAL_MODULES:
+        try:
+            _OPTIONAL_MODULES[name] = importlib.import_module(name)
+        except Exception:
+            _OPTIONAL_MODULES[name] = None
+    return _OPTIONAL_MODULES[name]
+
+
+def preload_optional_modules(names: tuple = ("fitz", "numpy", "cv2")):
+    """Импорт зависимостей заранее (фоновый прогрев процесса), чтобы первый документ не ждал их загрузки."""
+    for name in names:
+        optional_module(name)
+
+# Инструкция и схема ответа для детекции печати/QR по изображениям
+STAMP_INSTRUCTION = (
+    "Определи, есть ли на изображении отсканированного документа: "
+    "1) печать (штамп: круглая или прямоугольная), "
+    "2) QR-код (квадратный матричный код)."
+)
+STAMP_SCHEMA_FIELDS = (
+    "  \"stamp_present\": true|false,\n"
+    "  \"stamp_confidence\": number (0..100),\n"
+    "  \"qr_present\": true|false,\n"
+    "  \"qr_confidence\": number (0..100)"
+)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Оценка входных токенов Claude за изображение: (ширина * высота) / 750.
+    Изображения длиннее 1568 px или больше ~1.15 Мпикс модель сама уменьшает — учитываем это.
+    """
+    scale = min(1.0, 1568 / max(width, height), (1_150_000 / (width * height)) ** 0.5)
+    return int(round(width * scale * height * scale / 750))
+
+
+def detect_qr_local(images: list[bytes]) -> dict | None:
+    """
+    Локальный (CPU) поиск QR-кода на изображениях страниц через OpenCV — до любых вызовов Bedrock.
+    Уверенным считается только QR, который удалось декодировать: тогда возвращается результат
+    в формате _stamps (qr_present=True), и проверка «Наличие QR или печати» уже пройдена.
+    Иначе (QR не найден, не декодирован или OpenCV не установлен) — None: решает LLM.
+    """
+    if not LOCAL_QR_ENABLED:
+        return None
+    cv2, np = optional_module("cv2"), optional_module("numpy")
+    if cv2 is None or np is None:
+        return None
+    detector = cv2.QRCodeDetector()
+    for page, img_bytes in enumerate(images, start=1):
+        try:
+            img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                continue
+            data, points, _ = detector.detectAndDecode(img)
+        except Exception:
+            continue
+        if data:
+            return {
+                "stamp_present": None,
+                "stamp_confidence": None,
+                "qr_present": True,
+                "qr_confidence": 100.0,
+                "raw": "",
+                "error": None,
+                "source": "local_qr",
+                "page": page,
+            }
+    return None
+
+
+def b64_image_from_bytes(img_bytes: bytes, media_type: str) -> dict:
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": media_type,
+            "data": base64.b64encode(img_bytes).decode("utf-8"),
+        },
+    }
+
+
+def _encode_pixmap(pix, fmt: str, quality: int) -> tuple[bytes, str]:
+    """Кодирует Pixmap в байты. WebP требует Pillow; без него используется JPEG."""
+    Image = optional_module("PIL.Image") if fmt == "webp" else None
+    if Image is not None:
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        buf = io.BytesIO()
+        img.save(buf, format="WEBP", quality=quality)
+        return buf.getvalue(), "webp"
+    if fmt == "png":
+        return pix.tobytes("png"), "png"
+    return pix.tobytes("jpeg", jpg_quality=quality), "jpeg"
+
+
+def preprocess_vision_image(img_bytes: bytes, long_edge: int | None = None, fmt: str | None = None,
+                            quality: int | None = None, crop: str | None = None) -> list[dict]:
+    """
+    Уменьшает, обрезает и перекодирует одно изображение страницы (PNG/JPEG).
+    Возвращает список {"bytes", "media_type", "width", "height", "tokens"} — по одному на область crop.
+    Без PyMuPDF возвращает исходное изображение как есть.
+    """
+    long_edge = VISION_LONG_EDGE if long_edge is None else long_edge
+    fmt = (fmt or VISION_IMAGE_FORMAT).lower().replace("jpg", "jpeg")
+    quality = VISION_IMAGE_QUALITY if quality is None else quality
+    regions = VISION_CROP_REGIONS.get(crop or VISION_CROP) or VISION_CROP_REGIONS["full"]
+    fitz = optional_module("fitz")
+    if fitz is None:
+        media = "image/png" if img_bytes[:8] == b"\x89PNG\r\n\x1a\n" else "image/jpeg"
+        return [{"bytes": img_bytes, "media_type": media, "width": None, "height": None, "tokens": None}]
+
+    src = fitz.Pixmap(img_bytes)
+    if src.alpha:
+        src = fitz.Pixmap(src, 0)  # без альфа-канала
+    if src.n != 3:
+        src = fitz.Pixmap(fitz.csRGB, src)
+    out = []
+    for x0, y0, x1, y1 in regions:
+        rw, rh = (x1 - x0) * src.width, (y1 - y0) * src.height
+        # Только уменьшение: область масштабируется так, чтобы её длинная сторона не превышала long_edge
+        scale = min(1.0, long_edge / max(rw, rh)) if long_edge else 1.0
+        sw, sh = max(1, round(src.width * scale)), max(1, round(src.height * scale))
+        clip = fitz.IRect(round(x0 * sw), round(y0 * sh), round(x1 * sw), round(y1 * sh))
+        if scale == 1.0 and clip == src.irect:
+            pix = src
+        else:
+            pix = fitz.Pixmap(src, sw, sh, clip)
+        data, used_fmt = _encode_pixmap(pix, fmt, quality)
+        out.append({
+            "bytes": data,
+            "media_type": _MEDIA_TYPES[used_fmt],
+            "width": pix.width,
+            "height": pix.height,
+            "tokens": estimate_image_tokens(pix.width, pix.height),
+        })
+    return out
+
+
+def prepare_vision_content(images: list[bytes], **options) -> list[dict]:
+    """Готовит блоки content (Anthropic messages API) из изображений страниц с предобработкой."""
+    content = []
+    for img in images:
+        for part in preprocess_vision_image(img, **options):
+            content.append(b64_image_from_bytes(part["bytes"], part["media_type"]))
+    return content
+
+
+def build_stamp_request_body(images: list[dict], prompt_cache: bool = False) -> dict:
+    """
+    Тело запроса invoke_model для детекции печати/QR. images — блоки content с изображениями.
+    Инструкция и схема ответа идут текстом перед изображениями; с prompt_cache — в system с точкой кэширования
+    (cache_control).
+    """
+    format_req = (
+        "Верни строго JSON без пояснений:\n"
+        "{\n"
+        + STAMP_SCHEMA_FIELDS + "\n"
+        "}"
+    )
+    instruction = STAMP_INSTRUCTION + "\n" + format_req
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 256,
+        "temperature": 0,
+    }
+    if prompt_cache:
+        body["system"] = [{"type": "text", "text": instruction, "cache_control": {"type": "ephemeral"}}]
+        body["messages"] = [{"role": "user", "content": images}]
+    else:
+        body["messages"] = [{"role": "user", "content": [{"type": "text", "text": instruction}] + images}]
+    return body
+
+
+def parse_stamp_response(text: str) -> dict:
+    """Разбор ответа модели в формат _stamps."""
+    parsed = None
+    try:
+        parsed = json.loads(text)
+    except Exception:
+        s = text.find("{")
+        e = text.rfind("}")
+        if s != -1 and e != -1 and e > s:
+            try:
+                parsed = json.loads(text[s:e + 1])
+            except Exception:
+                parsed = None
+    if not isinstance(parsed, dict):
+        return {"stamp_present": None, "stamp_confidence": None, "qr_present": None, "qr_confidence": None, "raw": text, "error": "LLM returned non-JSON"}
+    return {
+        # Существующие поля (совместимость)
+        "stamp_present": parsed.get("stamp_present"),
+        "stamp_confidence": parsed.get("stamp_confidence"),
+        "qr_present": parsed.get("qr_present"),
+        "qr_confidence": parsed.get("qr_confidence"),
+        # Технические поля
+        "raw": text,
+        "error": None,
+    }